@@ -0,0 +1,65 @@
+import pathlib
+
+import click
+import pandas as pd
+
+from metrics import find_metrics_files, load_metrics
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing entry-* subdirectories",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="metrics.csv",
+    type=str,
+    help="Output file of all records",
+)
+@click.option(
+    "--summary-file",
+    "-s",
+    default="metrics-summary.csv",
+    type=str,
+    help="Output file of per-stage statistics across entries",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    output_file: str = "metrics.csv",
+    summary_file: str = "metrics-summary.csv",
+):
+    input_directory = pathlib.Path(input_directory)
+    metrics_files = find_metrics_files(input_directory)
+
+    records = []
+    for metrics_file in metrics_files:
+        records.extend(load_metrics(metrics_file))
+    print(f"Loaded {len(records)} records from {len(metrics_files)} files")
+
+    df = pd.json_normalize(records)
+    df.to_csv(output_file, index=False)
+    print(f"Saved to {output_file}")
+
+    timed = df[df.stage != "environment"]
+    group_columns = ["stage"]
+    if "phase" in timed.columns:
+        timed = timed.assign(phase=timed.phase.fillna(""))
+        group_columns.append("phase")
+    aggregations = {"seconds": ["count", "mean", "median", "max", "sum"]}
+    if "ns_per_day" in timed.columns:
+        aggregations["ns_per_day"] = ["mean", "median", "min"]
+    summary = timed.groupby(group_columns).agg(aggregations)
+    summary.columns = ["_".join(column) for column in summary.columns]
+    summary = summary.reset_index()
+    summary.to_csv(summary_file, index=False)
+    print(summary.to_string(index=False))
+    print(f"Saved to {summary_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Structural and dynamical analysis of the production trajectory of a run,
+split across processes.
+
+    python analyze-trajectory.py -i boxes-nosort/n-2000/runs-interchange-final/entry-0000/ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1 \\
+        -a rdf --selection-a O --selection-b O -w 8
+
+Frames of ``production.dcd`` are read in memory-mapped chunks and
+reduced to partial results in worker processes; see ``trajectory.py``.
+Masses, elements and molecules are taken from the topology PDB, so
+its bonds (CONECT records) decide what is a molecule.
+
+- ``rdf``: radial distribution function between two element selections,
+  leaving out pairs in the same molecule.
+- ``density-profile``: mass density in g/mL along one box axis.
+- ``msd``: mean squared displacement of molecular centers of mass, in
+  nm^2, by lag in frames.
+"""
+
+import pathlib
+import time
+
+import click
+
+
+def get_selection(elements: list[str], selection: str):
+    """Indices of atoms with any of the comma-separated element symbols"""
+    import numpy as np
+
+    symbols = {symbol.strip() for symbol in selection.split(",")}
+    indices = np.array([i for i, element in enumerate(elements) if element in symbols], dtype=int)
+    if not len(indices):
+        raise click.BadParameter(f"No atoms with elements {selection}")
+    return indices
+
+
+def check_density_profile(profile, csv_file: pathlib.Path, start: int = 0, stop: int = None) -> bool:
+    """
+    Whether the mean density of ``profile`` matches the "Density (g/mL)"
+    column of the reporter CSV over the same frames, to within 0.1%.
+    The DCD and CSV reporters share a report interval, so rows are frames.
+    """
+    import pandas as pd
+
+    densities = pd.read_csv(csv_file, usecols=["Density (g/mL)"])["Density (g/mL)"].values[start:stop]
+    expected = densities.mean()
+    mean = profile.density.mean()
+    print(f"Mean profile density {mean:.5g} g/mL, {csv_file.name} density {expected:.5g} g/mL")
+    return abs(mean - expected) <= 1e-3 * expected
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Run directory containing production.dcd",
+)
+@click.option(
+    "--trajectory",
+    default="production.dcd",
+    type=str,
+    help="Trajectory file in the run directory",
+)
+@click.option(
+    "--topology",
+    default="equilibrated.pdb",
+    type=str,
+    help="Topology PDB in the run directory",
+)
+@click.option(
+    "--analysis",
+    "-a",
+    default="rdf",
+    type=click.Choice(["rdf", "density-profile", "msd"]),
+    help="Analysis to run",
+)
+@click.option(
+    "--selection-a",
+    default="O",
+    type=str,
+    help="Elements of the first RDF selection, e.g. O or C,N",
+)
+@click.option(
+    "--selection-b",
+    default=None,
+    type=str,
+    help="Elements of the second RDF selection. Default: the first selection",
+)
+@click.option(
+    "--cutoff",
+    default=1.2,
+    type=float,
+    help="RDF cutoff in nm",
+)
+@click.option(
+    "--bin-width",
+    default=0.01,
+    type=float,
+    help="RDF bin width in nm",
+)
+@click.option(
+    "--axis",
+    default="z",
+    type=click.Choice(["x", "y", "z"]),
+    help="Axis of the density profile",
+)
+@click.option(
+    "--n-bins",
+    default=100,
+    type=int,
+    help="Number of bins of the density profile",
+)
+@click.option(
+    "--max-lag",
+    default=100,
+    type=int,
+    help="Longest MSD lag in frames",
+)
+@click.option(
+    "--start",
+    default=0,
+    type=int,
+    help="First frame to analyze",
+)
+@click.option(
+    "--stop",
+    default=None,
+    type=int,
+    help="Frame to stop at. Default: the last frame",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    type=int,
+    help="Number of processes reading frame ranges in parallel",
+)
+@click.option(
+    "--chunk-size",
+    default=100,
+    type=int,
+    help="Number of frames each process holds in memory at once",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default=None,
+    type=str,
+    help="Output file. Default: <analysis>.csv in the run directory",
+)
+def main(
+    input_directory: str,
+    trajectory: str = "production.dcd",
+    topology: str = "equilibrated.pdb",
+    analysis: str = "rdf",
+    selection_a: str = "O",
+    selection_b: str = None,
+    cutoff: float = 1.2,
+    bin_width: float = 0.01,
+    axis: str = "z",
+    n_bins: int = 100,
+    max_lag: int = 100,
+    start: int = 0,
+    stop: int = None,
+    workers: int = 1,
+    chunk_size: int = 100,
+    output_file: str = None,
+):
+    import numpy as np
+    import openmm.app
+
+    from trajectory import DCDFile, MSD, RDF, DensityProfile, get_molecule_ids, run_analysis
+
+    input_directory = pathlib.Path(input_directory)
+    dcd_file = input_directory / trajectory
+    pdb = openmm.app.PDBFile(str(input_directory / topology))
+    atoms = list(pdb.topology.atoms())
+    n_atoms = len(atoms)
+    if DCDFile(dcd_file).n_atoms != n_atoms:
+        raise click.UsageError(f"{topology} and {trajectory} have different numbers of atoms")
+    elements = [atom.element.symbol if atom.element is not None else "" for atom in atoms]
+    masses = np.array([
+        atom.element.mass._value if atom.element is not None else 0.0
+        for atom in atoms
+    ])
+    molecule_ids = get_molecule_ids(
+        n_atoms, [(bond[0].index, bond[1].index) for bond in pdb.topology.bonds()]
+    )
+
+    if analysis == "rdf":
+        selection_a_indices = get_selection(elements, selection_a)
+        selection_b_indices = get_selection(elements, selection_b or selection_a)
+        calculator = RDF(
+            selection_a_indices,
+            selection_b_indices,
+            cutoff=cutoff,
+            bin_width=bin_width,
+            molecule_ids=molecule_ids,
+        )
+    elif analysis == "density-profile":
+        calculator = DensityProfile(masses, axis="xyz".index(axis), n_bins=n_bins)
+    else:
+        calculator = MSD(masses, molecule_ids, max_lag=max_lag)
+
+    start_time = time.perf_counter()
+    df = run_analysis(
+        calculator,
+        dcd_file,
+        n_workers=workers,
+        chunk_size=chunk_size,
+        start=start,
+        stop=stop,
+    )
+    elapsed = time.perf_counter() - start_time
+    print(f"Analyzed {trajectory} in {elapsed:.1f} s on {workers} workers")
+
+    csv_file = dcd_file.with_suffix(".csv")
+    if analysis == "density-profile" and csv_file.exists():
+        if not check_density_profile(df, csv_file, start=start, stop=stop):
+            print(f"Warning: the density profile does not match {csv_file.name}")
+
+    if output_file is None:
+        output_file = input_directory / f"{analysis}.csv"
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} rows to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
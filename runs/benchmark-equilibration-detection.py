@@ -0,0 +1,135 @@
+"""
+Time ``equilibration.detect_equilibration_batch`` against pymbar's
+``detect_equilibration`` and check that they agree.
+
+    python benchmark-equilibration-detection.py -n 2000 -n 6000
+    python benchmark-equilibration-detection.py -f .../equilibration.csv
+
+Without an input file, synthetic observables are generated: AR(1) noise
+with a range of correlation times, relaxing from a range of offsets.
+"""
+
+import sys
+import time
+
+import click
+
+
+def generate_observables(
+    n_samples: int,
+    correlation_times: list[float] = (1.0, 10.0, 50.0),
+    offsets: list[float] = (0.0, 5.0, 50.0),
+    seed: int = 0,
+):
+    """
+    One column per pair of correlation time and offset. Each offset
+    decays over the first tenth of the series.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    relaxation = np.exp(-np.arange(n_samples) / (n_samples / 10))
+    columns = []
+    for tau in correlation_times:
+        phi = np.exp(-1 / tau)
+        noise = rng.normal(size=n_samples)
+        x = np.empty(n_samples)
+        x[0] = noise[0]
+        for i in range(1, n_samples):
+            x[i] = phi * x[i - 1] + noise[i]
+        for offset in offsets:
+            columns.append(x + offset * relaxation)
+    return np.array(columns).T
+
+
+def compare(A_t, nskip: int = 1) -> dict:
+    import numpy as np
+    from pymbar.timeseries import detect_equilibration
+
+    from equilibration import detect_equilibration_batch
+
+    start_time = time.perf_counter()
+    expected = [detect_equilibration(A_t[:, i], nskip=nskip) for i in range(A_t.shape[1])]
+    pymbar_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    t0, g, _ = detect_equilibration_batch(A_t, nskip=nskip, refine=False)
+    batched_seconds = time.perf_counter() - start_time
+
+    expected_t0, expected_g, _ = map(np.array, zip(*expected))
+    return {
+        "n_samples": A_t.shape[0],
+        "n_observables": A_t.shape[1],
+        "pymbar_seconds": pymbar_seconds,
+        "batched_seconds": batched_seconds,
+        "speedup": pymbar_seconds / batched_seconds,
+        "n_t0_mismatches": int((t0 != expected_t0).sum()),
+        "max_g_relative_error": float(np.max(np.abs(g - expected_g) / expected_g)),
+    }
+
+
+@click.command()
+@click.option(
+    "--input-file",
+    "-f",
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    help="Reporter CSV to benchmark on, instead of synthetic observables",
+)
+@click.option(
+    "--n-samples",
+    "-n",
+    multiple=True,
+    type=int,
+    default=[500, 2000, 6000],
+    help="Length of the synthetic series; repeat for several",
+)
+@click.option(
+    "--nskip",
+    default=1,
+    type=int,
+    help="Only try every nskip-th sample as the equilibration time",
+)
+@click.option(
+    "--tolerance",
+    default=1e-4,
+    type=float,
+    help="Largest relative difference in g accepted as agreement",
+)
+def main(
+    input_file: str = None,
+    n_samples: list[int] = (500, 2000, 6000),
+    nskip: int = 1,
+    tolerance: float = 1e-4,
+):
+    if input_file is not None:
+        import pandas as pd
+
+        from tailing import IGNORE_COLUMNS
+
+        df = pd.read_csv(input_file, usecols=lambda column: column not in IGNORE_COLUMNS)
+        datasets = [df.values.astype(float)]
+    else:
+        datasets = [generate_observables(n) for n in n_samples]
+
+    agree = True
+    for A_t in datasets:
+        result = compare(A_t, nskip=nskip)
+        print(
+            f"{result['n_samples']} samples x {result['n_observables']} observables: "
+            f"pymbar {result['pymbar_seconds']:.3f} s, "
+            f"batched {result['batched_seconds']:.3f} s "
+            f"({result['speedup']:.1f}x); "
+            f"{result['n_t0_mismatches']} t0 mismatches, "
+            f"max relative error in g {result['max_g_relative_error']:.2e}"
+        )
+        if result["n_t0_mismatches"] or result["max_g_relative_error"] > tolerance:
+            agree = False
+
+    if not agree:
+        print("Batched results do not match pymbar")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
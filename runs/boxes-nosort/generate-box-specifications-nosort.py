@@ -5,9 +5,44 @@ such that the smallest proportion is first.
 """
 
 import click
+import collections
+import hashlib
 import json
+import pathlib
 import pandas as pd
 
+KPA_PER_ATM = 101.325
+
+
+def get_box_hash(box: tuple[tuple[str, int], ...]) -> str:
+    """A stable identifier of a box's composition, independent of its index"""
+    return hashlib.sha256(json.dumps(box).encode()).hexdigest()[:16]
+
+
+def get_property_box_rows(entry: dict, n_molecules: int) -> list[dict]:
+    """
+    The boxes a Sage property is estimated from, with the coefficient
+    of each box's per-molecule observable in the estimate.
+
+    A density is the density of the mixture box. An enthalpy of mixing
+    is the enthalpy per molecule of the mixture box minus that of each
+    pure box, weighted by its mole fraction in the mixture box.
+    """
+    mixture = tuple(
+        (component["smiles"], int(round(component["mole_fraction"] * n_molecules)))
+        for component in entry["components"]
+    )
+    rows = [{"box": mixture, "role": "mixture", "coefficient": 1.0}]
+    if entry["property_type"] == "EnthalpyOfMixing":
+        n_mixture = sum(count for _, count in mixture)
+        for smiles, count in mixture:
+            rows.append({
+                "box": ((smiles, n_molecules),),
+                "role": "pure",
+                "coefficient": -count / n_mixture,
+            })
+    return rows
+
 def turn_property_into_boxes(
     entry: dict,
     n_molecules: int,
@@ -22,6 +57,54 @@ def turn_property_into_boxes(
     return all_boxes
 
 
+def cluster_sorted(values: list[float], resolution: float) -> list[list[float]]:
+    """
+    Split sorted ``values`` into groups wherever consecutive values are
+    more than ``resolution`` apart.
+    """
+    groups = []
+    for value in values:
+        if groups and value - groups[-1][-1] <= resolution:
+            groups[-1].append(value)
+        else:
+            groups.append([value])
+    return groups
+
+
+def merge_state_points(
+    state_points: collections.Counter,
+    temperature_resolution: float = 1.0,
+    pressure_resolution: float = 0.1,
+) -> list[dict]:
+    """
+    Merge (temperature, pressure) pairs that are within the resolution
+    of each other, keeping the most common value of each group.
+    Temperatures are in K and pressures in atm.
+
+    Temperatures are grouped first and then pressures within each group,
+    splitting only where neighbouring values are further apart than the
+    resolution, so points closer than the resolution always merge.
+    """
+    merged = []
+    temperatures = sorted({temperature for temperature, _ in state_points})
+    for temperature_group in cluster_sorted(temperatures, temperature_resolution):
+        points = {
+            point: count for point, count in state_points.items()
+            if point[0] in temperature_group
+        }
+        pressures = sorted({pressure for _, pressure in points})
+        for pressure_group in cluster_sorted(pressures, pressure_resolution):
+            group = collections.Counter({
+                point: count for point, count in points.items()
+                if point[1] in pressure_group
+            })
+            merged.append(group.most_common(1)[0][0])
+    return [
+        {"temperature": temperature, "pressure": round(pressure, 4)}
+        for temperature, pressure in sorted(merged)
+    ]
+
+
 @click.command()
 @click.option(
     "--n-molecules",
@@ -37,17 +120,49 @@ def turn_property_into_boxes(
     type=click.Path(file_okay=True, dir_okay=False),
     help="Output file",
 )
+@click.option(
+    "--temperature-resolution",
+    default=1.0,
+    type=float,
+    help="State points closer than this in K are merged",
+)
+@click.option(
+    "--pressure-resolution",
+    default=0.1,
+    type=float,
+    help="State points closer than this in atm are merged",
+)
 def main(
     n_molecules: int = 1000,
     output_file: str = "liquid-boxes.json",
+    temperature_resolution: float = 1.0,
+    pressure_resolution: float = 0.1,
 ):
     with open("../../data/sage-train-v1.json", "r") as f:
         data = json.load(f)
 
     all_boxes = set()
+    # conditions each box is needed at, for ladder runs
+    state_points = collections.defaultdict(collections.Counter)
+    # which boxes each reference property is estimated from
+    property_boxes = []
 
     for entry in data["entries"]:
-        all_boxes |= turn_property_into_boxes(entry, n_molecules)
+        boxes = turn_property_into_boxes(entry, n_molecules)
+        all_boxes |= boxes
+        for box in boxes:
+            state_points[box][(entry["temperature"], entry["pressure"] / KPA_PER_ATM)] += 1
+        for row in get_property_box_rows(entry, n_molecules):
+            property_boxes.append({
+                "dataset": "sage",
+                "property_id": entry["id"],
+                "property_type": entry["property_type"],
+                "temperature": entry["temperature"],
+                "pressure": entry["pressure"],
+                "value": entry["value"],
+                "std_error": entry["std_error"],
+                **row,
+            })
     
     df = pd.read_csv("../../data/full_results_mnsol_2_0_0.csv")
     for solvent in df.Solvent.unique():
@@ -57,6 +172,26 @@ def main(
         solute = row.Solute
         solvent = row.Solvent
         all_boxes.add(((solute, 1), (solvent, n_molecules - 1)))
+        state_point = (row["Temperature (K)"], row["Pressure (kPa)"] / KPA_PER_ATM)
+        state_points[((solvent, n_molecules),)][state_point] += 1
+        state_points[((solute, 1), (solvent, n_molecules - 1))][state_point] += 1
+        for box, role in [
+            (((solute, 1), (solvent, n_molecules - 1)), "solution"),
+            (((solvent, n_molecules),), "solvent"),
+        ]:
+            property_boxes.append({
+                "dataset": "mnsol",
+                "property_id": row.Id,
+                "property_type": row["Property Type"],
+                "temperature": row["Temperature (K)"],
+                "pressure": row["Pressure (kPa)"],
+                "value": row["Reference Value"],
+                "std_error": row["Reference Std"],
+                "box": box,
+                "role": role,
+                # solvation free energies are not averages of box observables
+                "coefficient": None,
+            })
     
     all_boxes = sorted(all_boxes, key=lambda x: (len(x), x[0][1], x))
     output = []
@@ -64,12 +199,31 @@ def main(
         output.append({
             "smiles": [component[0] for component in box],
             "n_molecules": [component[1] for component in box],
+            "box_hash": get_box_hash(box),
+            "state_points": merge_state_points(
+                state_points[box],
+                temperature_resolution=temperature_resolution,
+                pressure_resolution=pressure_resolution,
+            ),
         })
 
     with open(output_file, "w") as f:
         json.dump(output, f, indent=4)
     print(f"Wrote {len(output)} boxes to {output_file}")
 
+    # results are saved by box index as entry-0113
+    box_indices = {box: index for index, box in enumerate(all_boxes)}
+    mapping = pd.DataFrame(property_boxes)
+    mapping["box_index"] = [box_indices[box] for box in mapping.box]
+    mapping["box_hash"] = [get_box_hash(box) for box in mapping.box]
+    mapping["n_molecules"] = [sum(count for _, count in box) for box in mapping.box]
+    mapping = mapping.drop(columns="box").sort_values(["dataset", "property_id", "box_index"])
+    mapping_file = pathlib.Path(output_file).with_name(
+        f"{pathlib.Path(output_file).stem}-properties.csv"
+    )
+    mapping.to_csv(mapping_file, index=False)
+    print(f"Wrote {len(mapping)} property-box pairs to {mapping_file}")
+
 
 if __name__ == "__main__":
     main()
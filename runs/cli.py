@@ -0,0 +1,209 @@
+"""
+One entry point for the packing, simulation and analysis scripts.
+
+Subcommands are loaded from their scripts only when invoked, so
+``python cli.py simulate ...`` never imports plotting or analysis
+libraries and ``--help`` stays fast:
+
+    python cli.py pack -i liquid-boxes.json -idx 3
+    python cli.py simulate -i . -ne 6000000 -np 5000000
+    python cli.py analyze equilibration -i boxes-nosort/n-2000 -r ...
+    python cli.py profile-imports
+
+The scripts themselves still work standalone.
+"""
+
+import importlib.util
+import pathlib
+import re
+import subprocess
+import sys
+import time
+
+import click
+
+SCRIPT_DIRECTORY = pathlib.Path(__file__).resolve().parent
+
+
+class LazyGroup(click.Group):
+    """
+    A group whose subcommands are ``(script, attribute)`` pairs
+    that are imported on first use.
+    """
+
+    def __init__(self, *args, lazy_subcommands: dict[str, tuple[str, str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx) -> list[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx, name: str):
+        if name in self.lazy_subcommands:
+            return load_command(*self.lazy_subcommands[name])
+        return super().get_command(ctx, name)
+
+
+def load_command(script: str, attribute: str = "main") -> click.Command:
+    """Import a click command from a script whose name need not be a module name"""
+    path = SCRIPT_DIRECTORY / script
+    module_name = path.stem.replace("-", "_")
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return getattr(sys.modules[module_name], attribute)
+
+
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "pack": ("pack-boxes-with-interchange.py", "main"),
+        "simulate": ("simulate-general-middle.py", "main"),
+        "simulate-config": ("simulate-config.py", "main"),
+        "simulate-multiple": ("simulate-multiple.py", "main"),
+        "simulate-sweep": ("simulate-sweep.py", "main"),
+        "simulate-gas-phase": ("simulate-gas-phase.py", "main"),
+        "worker": ("simulation-worker.py", "cli"),
+        "probe-timestep": ("probe-timestep.py", "main"),
+        "tune-nonbonded": ("tune-nonbonded.py", "main"),
+    },
+)
+def cli():
+    pass
+
+
+@cli.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "equilibration": ("determine-equilibration-time.py", "main"),
+        "compare-equilibration": ("compare-equilibration-times.py", "main"),
+        "properties": ("estimate-properties.py", "main"),
+        "reference": ("compare-to-reference.py", "main"),
+        "metrics": ("aggregate-metrics.py", "main"),
+        "memory": ("plan-memory-requests.py", "main"),
+        "heartbeats": ("watch-heartbeats.py", "main"),
+        "watch-equilibration": ("watch-equilibration.py", "main"),
+        "trajectory": ("analyze-trajectory.py", "main"),
+        "reweight": ("reweight-properties.py", "main"),
+    },
+)
+def analyze():
+    """Analysis of finished and running simulations"""
+
+
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Imports reported by ``python -X importtime``, with times in seconds"""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        imports.append({
+            "module": name,
+            "self_seconds": int(self_us) * 1e-6,
+            "cumulative_seconds": int(cumulative_us) * 1e-6,
+            # nesting depth; 0 is imported directly by the script
+            "depth": (len(indent) - 1) // 2,
+        })
+    return imports
+
+
+def profile_command(arguments: list[str]) -> dict:
+    """Wall time and import times of running ``cli.py`` with ``arguments``"""
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(SCRIPT_DIRECTORY / "cli.py"), *arguments],
+        capture_output=True,
+        text=True,
+    )
+    seconds = time.perf_counter() - start_time
+    imports = parse_importtime(result.stderr)
+    top_level = [entry for entry in imports if entry["depth"] == 0]
+    return {
+        "command": " ".join(arguments),
+        "returncode": result.returncode,
+        "wall_seconds": seconds,
+        "import_seconds": sum(entry["cumulative_seconds"] for entry in top_level),
+        "n_modules": len(imports),
+        "top_level": top_level,
+    }
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SCRIPT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+@cli.command("profile-imports")
+@click.option(
+    "--command",
+    "-c",
+    "commands",
+    multiple=True,
+    default=[
+        "--help",
+        "pack --help",
+        "simulate --help",
+        "worker --help",
+        "analyze equilibration --help",
+    ],
+    help="Arguments to cli.py to profile; repeat for several",
+)
+@click.option(
+    "--n-top",
+    default=10,
+    type=int,
+    help="Number of slowest imports to print per command",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="import-times.jsonl",
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="JSONL file to append the profile to, for tracking across releases",
+)
+def profile_imports(
+    commands: list[str],
+    n_top: int = 10,
+    output_file: str = "import-times.jsonl",
+):
+    """Profile startup latency with ``python -X importtime``"""
+    from metrics import MetricsRecorder, get_package_versions
+
+    metrics = MetricsRecorder(
+        output_file,
+        commit=get_git_commit(),
+        python=sys.version.split()[0],
+        package_versions=get_package_versions(),
+    )
+    for command in commands:
+        profile = profile_command(command.split())
+        print(
+            f"{command}: {profile['wall_seconds']:.2f} s wall, "
+            f"{profile['import_seconds']:.2f} s importing {profile['n_modules']} modules"
+        )
+        slowest = sorted(profile["top_level"], key=lambda entry: -entry["cumulative_seconds"])
+        for entry in slowest[:n_top]:
+            print(f"    {entry['cumulative_seconds']:8.3f} s  {entry['module']}")
+        if profile["returncode"]:
+            print(f"    exited with {profile['returncode']}")
+        metrics.record("import-time", **profile)
+    print(f"Appended to {output_file}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,106 @@
+"""
+Compare detected equilibration times between two protocols,
+e.g. standard NPT against runs with a pre-equilibration stage.
+
+Both inputs are outputs of ``determine-equilibration-time.py``.
+Detected times only count from the start of equilibration, so for runs
+with a pre-equilibration stage (``npe-<steps>_`` run names) the annealing
+time, ``n_pre_equilibration_steps`` times the run's timestep, is added
+before the protocols are compared.
+"""
+
+import re
+
+import click
+import numpy as np
+import pandas as pd
+from scipy.stats import wilcoxon
+
+
+def get_pre_equilibration_ns(run: str) -> float:
+    """Simulated time before equilibration in the run named ``run``, in ns"""
+    match = re.search(r"(?:^|_)npe-(\d+)(?:_|$)", run)
+    if match is None:
+        return 0.0
+    timestep = re.search(r"(?:^|_)dt-([0-9.]+)(?:_|$)", run)
+    if timestep is None:
+        raise click.UsageError(
+            f"Cannot find the timestep of pre-equilibrated run {run!r}"
+        )
+    return int(match.group(1)) * float(timestep.group(1)) / 1e6
+
+
+@click.command()
+@click.option(
+    "--baseline-file",
+    "-a",
+    default="boxes-nosort_n-2000_interchange-equilibration.csv",
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Equilibration times of the baseline protocol",
+)
+@click.option(
+    "--comparison-file",
+    "-b",
+    required=True,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Equilibration times of the protocol to compare",
+)
+@click.option(
+    "--ps-per-frame",
+    default=2.0,
+    type=float,
+    help="Simulated time between CSV rows in ps",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="equilibration-time-comparison.csv",
+    type=str,
+    help="Output file",
+)
+def main(
+    baseline_file: str = "boxes-nosort_n-2000_interchange-equilibration.csv",
+    comparison_file: str = None,
+    ps_per_frame: float = 2.0,
+    output_file: str = "equilibration-time-comparison.csv",
+):
+    baseline = pd.read_csv(baseline_file)
+    comparison = pd.read_csv(comparison_file)
+    # only compare entries that finished under both protocols
+    df = baseline.merge(
+        comparison,
+        on=["entry", "property"],
+        suffixes=("_baseline", "_comparison"),
+    )
+    for suffix in ["baseline", "comparison"]:
+        pre_equilibration_ns = df[f"run_{suffix}"].map(get_pre_equilibration_ns)
+        df[f"t0_ns_{suffix}"] = (
+            df[f"t0_{suffix}"] * ps_per_frame / 1000 + pre_equilibration_ns
+        )
+    df["difference_ns"] = df.t0_ns_comparison - df.t0_ns_baseline
+
+    rows = []
+    for prop, subdf in df.groupby("property"):
+        differences = subdf.difference_ns.values
+        p_value = np.nan
+        if np.any(differences != 0):
+            p_value = wilcoxon(differences).pvalue
+        rows.append({
+            "property": prop,
+            "n_entries": len(subdf),
+            "median_t0_ns_baseline": subdf.t0_ns_baseline.median(),
+            "median_t0_ns_comparison": subdf.t0_ns_comparison.median(),
+            "mean_difference_ns": differences.mean(),
+            "fraction_reduced": (differences < 0).mean(),
+            "max_t0_ns_baseline": subdf.t0_ns_baseline.max(),
+            "max_t0_ns_comparison": subdf.t0_ns_comparison.max(),
+            "wilcoxon_p": p_value,
+        })
+    summary = pd.DataFrame(rows)
+    summary.to_csv(output_file, index=False)
+    print(summary.to_string(index=False))
+    print(f"Saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Estimate every reference property from per-box results and compare
+with the reference values.
+
+    python compare-to-reference.py -p boxes-nosort_n-2000_properties.csv \\
+        -m boxes-nosort/n-2000/liquid-boxes-properties.csv
+
+The mapping table is written next to ``liquid-boxes.json`` by
+``generate-box-specifications-nosort.py``. It links each property to its
+boxes by index, with the coefficient of each box's observable in the
+estimate. Per-box results come from ``estimate-properties.py``.
+
+- A density is the mixture box's density.
+- An enthalpy of mixing is the mixture box's enthalpy per molecule,
+  minus each pure box's enthalpy per molecule weighted by its mole
+  fraction in the mixture.
+
+Each property is estimated from the boxes simulated at its own state
+point, to within ``--temperature-tolerance`` and ``--pressure-tolerance``.
+A property whose boxes were not all simulated at its state point is
+reported as missing. Ladder runs give a box several state points.
+
+Enthalpies are total energy plus PV at the simulated pressure.
+Uncertainties are combined assuming the terms are independent.
+All properties are estimated at once from one table join.
+Solvation free energies are not averages of box observables, so they
+are not estimated.
+"""
+
+import click
+import numpy as np
+import pandas as pd
+
+# kPa nm^3 to kJ/mol
+PV_CONVERSION = 6.02214076e-4
+KPA_PER_ATM = 101.325
+
+OBSERVABLES = {
+    "density": "Density (g/mL)",
+    "energy": "Total Energy (kJ/mole)",
+    "volume": "Box Volume (nm^3)",
+}
+
+
+def get_box_observables(properties: pd.DataFrame, uncertainty: str = "sem_block") -> pd.DataFrame:
+    """
+    Mean and uncertainty of each observable, one row per box index and
+    simulated state point, with temperature in K and pressure in atm.
+    """
+    properties = properties[properties.property.isin(OBSERVABLES.values())]
+    wide = properties.pivot_table(
+        index=["entry", "temperature", "pressure"], columns="property", values=["mean", uncertainty]
+    )
+    boxes = pd.DataFrame(index=wide.index)
+    for name, column in OBSERVABLES.items():
+        boxes[name] = wide.get(("mean", column), np.nan)
+        boxes[f"{name}_sem"] = wide.get((uncertainty, column), np.nan)
+    boxes.index.names = ["entry", "simulated_temperature", "simulated_pressure"]
+    return boxes.reset_index()
+
+
+def match_state_points(
+    mapping: pd.DataFrame,
+    boxes: pd.DataFrame,
+    temperature_tolerance: float = 1.0,
+    pressure_tolerance: float = 0.1,
+) -> pd.DataFrame:
+    """
+    Each row of ``mapping`` with the observables of its box at the closest
+    simulated state point within the tolerances in K and atm, or NaN if
+    there is none.
+    """
+    mapping = mapping.reset_index(drop=True).rename_axis("row").reset_index()
+    df = mapping[["row", "box_index", "temperature", "pressure"]].merge(
+        boxes, left_on="box_index", right_on="entry", how="inner"
+    )
+    temperature_difference = (df.simulated_temperature - df.temperature).abs() / temperature_tolerance
+    pressure_difference = (df.simulated_pressure - df.pressure / KPA_PER_ATM).abs() / pressure_tolerance
+    df["distance"] = temperature_difference + pressure_difference
+    df = df[(temperature_difference <= 1) & (pressure_difference <= 1)]
+    df = df.sort_values("distance", kind="stable").drop_duplicates("row")
+    columns = [column for column in boxes.columns if column != "entry"]
+    matched = mapping.merge(df[["row", *columns]], on="row", how="left")
+    return matched.drop(columns="row")
+
+
+def estimate_reference_properties(
+    mapping: pd.DataFrame,
+    boxes: pd.DataFrame,
+    temperature_tolerance: float = 1.0,
+    pressure_tolerance: float = 0.1,
+) -> pd.DataFrame:
+    """Estimate of each property of ``mapping`` that is a sum over box observables"""
+    df = match_state_points(
+        mapping[mapping.coefficient.notna()],
+        boxes,
+        temperature_tolerance=temperature_tolerance,
+        pressure_tolerance=pressure_tolerance,
+    )
+    is_density = (df.property_type == "Density").values
+    pv_factor = df.simulated_pressure * KPA_PER_ATM * PV_CONVERSION
+    enthalpy = (df.energy + pv_factor * df.volume) / df.n_molecules
+    enthalpy_sem = np.hypot(df.energy_sem, pv_factor * df.volume_sem) / df.n_molecules
+    df["contribution"] = df.coefficient * np.where(is_density, df.density, enthalpy)
+    df["variance"] = (df.coefficient * np.where(is_density, df.density_sem, enthalpy_sem)) ** 2
+    df["missing"] = df.contribution.isna()
+
+    grouped = df.groupby(["dataset", "property_id"], sort=True)
+    result = grouped[["property_type", "temperature", "pressure", "value", "std_error"]].first()
+    result["estimate"] = grouped.contribution.sum()
+    result["uncertainty"] = np.sqrt(grouped.variance.sum())
+    result["n_boxes"] = grouped.size()
+    result["n_missing_boxes"] = grouped.missing.sum()
+    incomplete = result.n_missing_boxes > 0
+    result.loc[incomplete, ["estimate", "uncertainty"]] = np.nan
+    result["difference"] = result.estimate - result.value
+    return result.reset_index()
+
+
+@click.command()
+@click.option(
+    "--properties-file",
+    "-p",
+    default="boxes-nosort_n-2000_properties.csv",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    help="Per-box results from estimate-properties.py",
+)
+@click.option(
+    "--mapping-file",
+    "-m",
+    default="boxes-nosort/n-2000/liquid-boxes-properties.csv",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    help="Property to box mapping from the box generation script",
+)
+@click.option(
+    "--run",
+    "-r",
+    default=None,
+    type=str,
+    help="Run to use if the properties file has several",
+)
+@click.option(
+    "--uncertainty",
+    default="sem_block",
+    type=click.Choice(["sem_block", "sem_g", "sem_bootstrap"]),
+    help="Per-box uncertainty to propagate",
+)
+@click.option(
+    "--temperature-tolerance",
+    default=1.0,
+    type=float,
+    help="Largest difference in K between a property's temperature and a simulated one",
+)
+@click.option(
+    "--pressure-tolerance",
+    default=0.1,
+    type=float,
+    help="Largest difference in atm between a property's pressure and a simulated one",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="boxes-nosort_n-2000_reference-comparison.csv",
+    type=str,
+    help="Output file",
+)
+def main(
+    properties_file: str = "boxes-nosort_n-2000_properties.csv",
+    mapping_file: str = "boxes-nosort/n-2000/liquid-boxes-properties.csv",
+    run: str = None,
+    uncertainty: str = "sem_block",
+    temperature_tolerance: float = 1.0,
+    pressure_tolerance: float = 0.1,
+    output_file: str = "boxes-nosort_n-2000_reference-comparison.csv",
+):
+    properties = pd.read_csv(properties_file)
+    if run is not None:
+        properties = properties[properties.run == run]
+    elif properties.run.nunique() > 1:
+        raise click.UsageError(f"{properties_file} has several runs; choose one with --run")
+    if "temperature" not in properties.columns:
+        raise click.UsageError(f"{properties_file} has no state points; rerun estimate-properties.py")
+
+    mapping = pd.read_csv(mapping_file)
+    boxes = get_box_observables(properties, uncertainty=uncertainty)
+    df = estimate_reference_properties(
+        mapping,
+        boxes,
+        temperature_tolerance=temperature_tolerance,
+        pressure_tolerance=pressure_tolerance,
+    )
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} properties to {output_file}")
+
+    estimated = df[df.estimate.notna()]
+    for property_type, group in estimated.groupby("property_type"):
+        rmse = np.sqrt((group.difference ** 2).mean())
+        print(f"{property_type}: {len(group)} of {(df.property_type == property_type).sum()} estimated, RMSE {rmse:.4g}")
+
+
+if __name__ == "__main__":
+    main()
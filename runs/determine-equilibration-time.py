@@ -1,10 +1,75 @@
+"""
+Detect the equilibration time of every observable of every entry of a run.
+
+By default all observables of an entry are analyzed together with
+``equilibration.detect_equilibration_batch``, which matches pymbar's
+``detect_equilibration``; ``--method pymbar`` calls pymbar per column.
+
+Entries are analyzed in parallel with ``--workers`` processes, only the
+requested observables are read, and results are appended to the output
+file every ``--chunk-size`` entries so that partial results survive.
+
+With ``--incremental``, results are kept in a ``results_cache.ResultsCache``
+next to the output file and only entries whose ``equilibration.csv`` is
+new or changed are analyzed; the output file is then rewritten atomically
+from the cache.
+"""
+
+import concurrent.futures
+import importlib.util
 import pathlib
 import tqdm
 
 import click
-import numpy as np
-import pandas as pd
-from pymbar.timeseries import detect_equilibration
+
+
+def read_observables(csv_file: pathlib.Path, columns: list[str] = None):
+    """Read only ``columns`` (default: all observables) of a reporter CSV"""
+    import pandas as pd
+
+    from tailing import IGNORE_COLUMNS
+
+    usecols = columns
+    if usecols is None:
+        usecols = lambda column: column not in IGNORE_COLUMNS
+    # pyarrow parses in parallel but cannot take a callable
+    engine = "c"
+    if columns is not None and importlib.util.find_spec("pyarrow") is not None:
+        engine = "pyarrow"
+    return pd.read_csv(csv_file, usecols=usecols, engine=engine)
+
+
+def analyze_entry(
+    production_csv: pathlib.Path,
+    run: str,
+    columns: list[str] = None,
+    method: str = "batched",
+    nskip: int = 1,
+) -> list[dict]:
+    equilibration_csv = production_csv.parent / "equilibration.csv"
+    df = read_observables(equilibration_csv, columns)
+    entry = int(production_csv.parent.parent.name.split("-")[1])
+
+    if method == "batched":
+        from equilibration import detect_equilibration_batch
+
+        results = zip(*detect_equilibration_batch(df.values, nskip=nskip))
+    else:
+        from pymbar.timeseries import detect_equilibration
+
+        results = [detect_equilibration(df[col].values, nskip=nskip) for col in df.columns]
+
+    rows = []
+    for col, (t0, g, Neff_max) in zip(df.columns, results):
+        rows.append({
+            "entry": entry,
+            "run": run,
+            "property": col,
+            "t0": int(t0),
+            "g": float(g),
+            "Neff_max": float(Neff_max)
+        })
+    return rows
 
 
 @click.command()
@@ -29,51 +94,138 @@ from pymbar.timeseries import detect_equilibration
     type=str,
     help="Output file",
 )
+@click.option(
+    "--column",
+    "-c",
+    "columns",
+    multiple=True,
+    help="Observable to analyze, e.g. 'Density (g/mL)'; repeat for several. Default: all",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    type=int,
+    help="Number of processes analyzing entries in parallel",
+)
+@click.option(
+    "--method",
+    default="batched",
+    type=click.Choice(["batched", "pymbar"]),
+    help="Analyze all observables of an entry at once, or each with pymbar",
+)
+@click.option(
+    "--nskip",
+    default=1,
+    type=int,
+    help="Only try every nskip-th sample as the equilibration time",
+)
+@click.option(
+    "--chunk-size",
+    default=50,
+    type=int,
+    help="Number of entries whose results are written at a time",
+)
+@click.option(
+    "--incremental/--no-incremental",
+    default=False,
+    help="Only analyze entries that are new or changed since the last pass",
+)
+@click.option(
+    "--cache-file",
+    default=None,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Results cache for --incremental. Default: the output file with a .sqlite suffix",
+)
 def main(
     input_directory: str = "boxes-nosort/n-1000",
     run: str = "ne-2500000_np-1000000_dt-2.0_nb-25",
-    output_file: str = "boxes-nosort_n-1000_equilibration.csv"
+    output_file: str = "boxes-nosort_n-1000_equilibration.csv",
+    columns: list[str] = (),
+    workers: int = 1,
+    method: str = "batched",
+    nskip: int = 1,
+    chunk_size: int = 50,
+    incremental: bool = False,
+    cache_file: str = None,
 ):
+    import pandas as pd
+
+    from results_cache import ResultsCache, write_csv_atomic
+    from tailing import IGNORE_COLUMNS
+
     input_directory = pathlib.Path(input_directory)
     pattern = f"*/{run}/production.csv"
     production_files = sorted(input_directory.glob(pattern))
+    columns = list(columns) or None
 
-    entries = []
-
-    for production_csv in tqdm.tqdm(production_files):
-        equilibration_csv = production_csv.parent / "equilibration.csv"
-
-        df = pd.concat([
-            pd.read_csv(equilibration_csv),
-            # pd.read_csv(production_csv)
-        ])
-
-        # just assume step size is 1000, dt is 2 ps
-        df['#"Step"'] = np.arange(1, len(df) + 1, dtype=float) * 1000
-        df["Time (ps)"] = df['#"Step"'] * 2 / 1000
-        #combined_csv = production_csv.parent / "combined.csv"
-        #df.to_csv(combined_csv)
-        #print(f"Combined csv saved to {combined_csv}")
-
-        # detect equilibration
-        ignore_cols = ['#"Step"', 'Time (ps)']
-        for col in df.columns:
-            if col in ignore_cols:
-                continue
-            t0, g, Neff_max = detect_equilibration(df[col])
-            entry = {
-                "entry": int(production_csv.parent.parent.name.split("-")[1]),
+    output_file = pathlib.Path(output_file)
+    if incremental:
+        cache = ResultsCache(
+            cache_file or output_file.with_suffix(".sqlite"),
+            settings={
                 "run": run,
-                "property": col,
-                "t0": t0,
-                "g": g,
-                "Neff_max": Neff_max
-            }
-            entries.append(entry)
-        
-    df = pd.DataFrame(entries)
-    df.to_csv(output_file, index=False)
-    print(f"Saved to {output_file}")
+                "columns": columns or {"ignored": IGNORE_COLUMNS},
+                "method": method,
+                "nskip": nskip,
+            },
+        )
+        equilibration_files = [
+            production_csv.parent / "equilibration.csv"
+            for production_csv in production_files
+        ]
+        stale = cache.get_stale(equilibration_files)
+        print(f"{len(stale)} of {len(production_files)} entries are new or changed")
+        production_files = [
+            production_csv
+            for production_csv in production_files
+            if production_csv.parent / "equilibration.csv" in stale
+        ]
+    else:
+        output_file.unlink(missing_ok=True)
+    n_rows = 0
+    chunk = []
+
+    def write_chunk():
+        nonlocal n_rows
+        if not chunk:
+            return
+        if incremental:
+            cache.store([
+                (production_csv.parent / "equilibration.csv", stale[production_csv.parent / "equilibration.csv"], rows)
+                for production_csv, rows in chunk
+            ])
+        else:
+            pd.DataFrame([
+                row for _, rows in chunk for row in rows
+            ]).to_csv(output_file, mode="a", header=not n_rows, index=False)
+        n_rows += sum(len(rows) for _, rows in chunk)
+        chunk.clear()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps the results in entry order
+        results = executor.map(
+            analyze_entry,
+            production_files,
+            [run] * len(production_files),
+            [columns] * len(production_files),
+            [method] * len(production_files),
+            [nskip] * len(production_files),
+            chunksize=max(len(production_files) // (workers * 8), 1),
+        )
+        results = tqdm.tqdm(results, total=len(production_files))
+        for i, (production_csv, rows) in enumerate(zip(production_files, results)):
+            chunk.append((production_csv, rows))
+            if (i + 1) % chunk_size == 0:
+                write_chunk()
+    write_chunk()
+
+    if incremental:
+        print(f"Analyzed {n_rows} rows")
+        df = pd.DataFrame(cache.get_rows(equilibration_files))
+        write_csv_atomic(df, output_file)
+        n_rows = len(df)
+    print(f"Saved {n_rows} rows to {output_file}")
 
 
 if __name__ == "__main__":
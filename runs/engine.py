@@ -0,0 +1,654 @@
+"""
+A simulation engine driven by a declarative run configuration.
+
+The simulate-*.py scripts differ only in integrator, friction, HMR,
+platform and run naming. Here those are fields of a ``RunConfig`` read
+from YAML or JSON, integrators and protocols are looked up in registries,
+and the OpenMM System is built once per box and hydrogen mass so that
+variants run in the same process do not re-parameterize it.
+
+Configurations reproducing each of the scripts are in ``configs/``.
+``run_entry`` runs one entry with the options of
+``simulate-general-middle.py`` and is called repeatedly by the
+multi-entry runners and workers.
+"""
+
+import contextlib
+import dataclasses
+import json
+import pathlib
+import shutil
+import traceback
+
+import openmm
+import openmm.app
+from openmm import unit as openmm_unit
+
+from openff.units import unit
+from openff.units.openmm import from_openmm, to_openmm
+from openff.interchange import Interchange
+
+from metrics import MetricsRecorder, get_package_versions
+from nonbonded import apply_nonbonded_settings
+from platforms import get_context_precision, select_platform
+from protocols import get_annealing_schedule, set_conditions
+from reporters import OBSERVABLES, SimulationDivergedError, as_divergence, assign_force_groups
+from simulation import (
+    MINIMIZED_FILES,
+    minimize_interchange,
+    record_divergence,
+    record_finished,
+    simulate,
+)
+
+# the run directory name of simulate-general-middle.py
+DEFAULT_NAME_TEMPLATE = (
+    "ne-{n_equilibration_steps}_np-{n_production_steps}_dt-{timestep}"
+    "_nb-{n_barostat_steps}_fc-{friction_coefficient}_h{hydrogen_mass}{suffix}"
+)
+
+INTEGRATORS = {}
+PROTOCOLS = {}
+
+
+def register_integrator(name: str):
+    """Register a function creating an integrator from a ``RunConfig``"""
+    def decorator(function):
+        INTEGRATORS[name] = function
+        return function
+    return decorator
+
+
+def register_protocol(name: str):
+    """
+    Register a function running the phases of a protocol.
+
+    It is called with the engine, the config, the output directory,
+    the metrics recorder and the selected platform.
+    """
+    def decorator(function):
+        PROTOCOLS[name] = function
+        return function
+    return decorator
+
+
+@dataclasses.dataclass
+class RunConfig:
+    """Settings of one run; temperatures in K, pressures in atm, times in fs"""
+
+    integrator: str = "langevin-middle"
+    protocol: str = "npt"
+    temperature: float = 298.15
+    pressure: float = 1.0
+    friction_coefficient: float = 1.0
+    timestep: float = 2.0
+    hydrogen_mass: float = 1
+    n_barostat_steps: int = 25
+    n_equilibration_steps: int = 100000
+    n_production_steps: int = 1000000
+    output_frequency: int = 1000
+    n_pre_equilibration_steps: int = 0
+    annealing_temperature: float = 400.0
+    compression_pressure: float = 500.0
+    n_pre_equilibration_stages: int = 10
+    # (temperature, pressure) dictionaries for the ladder protocol
+    state_points: list[dict] = None
+    n_ladder_equilibration_steps: int = 500000
+    minimizer: str = "interchange"
+    # settings of the staged minimizer, see minimization.staged_minimize
+    minimization_tolerance: float = 10.0
+    n_minimization_iterations: int = 10000
+    n_clash_iterations: int = 500
+    clash_max_force: float = 1.0e4
+    n_minimization_md_steps: int = 0
+    platform: str = "default"
+    platform_properties: dict = dataclasses.field(default_factory=dict)
+    # re-run the benchmark of platform "auto" even if a choice is cached
+    refresh_platform: bool = False
+    # let platform "auto" pick single precision on GPUs if it is faster
+    allow_single_precision: bool = False
+    # use the timestep and hydrogen mass of the entry's timestep-probe.json
+    timestep_from_probe: bool = False
+    # settings from tune-nonbonded.py, or its JSON file relative to the entry directory
+    nonbonded_settings: dict = None
+    heartbeat_interval: float = 60
+    # derived observables to report alongside the StateDataReporter, see ObservableReporter
+    observables: list[str] = dataclasses.field(default_factory=list)
+    watchdog_thresholds: dict = dataclasses.field(default_factory=lambda: {
+        "max_potential_energy_per_particle": 1000,
+        "max_temperature": 1000,
+        "min_volume_fraction": 0.25,
+        "max_volume_fraction": 3.0,
+    })
+    suffix: str = ""
+    name_template: str = DEFAULT_NAME_TEMPLATE
+
+    def __post_init__(self):
+        # so that run names match those of the click scripts
+        self.friction_coefficient = float(self.friction_coefficient)
+        self.timestep = float(self.timestep)
+        if self.hydrogen_mass == int(self.hydrogen_mass):
+            self.hydrogen_mass = int(self.hydrogen_mass)
+        if self.integrator not in INTEGRATORS:
+            raise ValueError(
+                f"Unknown integrator {self.integrator}; choose from {sorted(INTEGRATORS)}"
+            )
+        if self.protocol not in PROTOCOLS:
+            raise ValueError(
+                f"Unknown protocol {self.protocol}; choose from {sorted(PROTOCOLS)}"
+            )
+        unknown = set(self.observables) - set(OBSERVABLES)
+        if unknown:
+            raise ValueError(
+                f"Unknown observables {sorted(unknown)}; choose from {OBSERVABLES}"
+            )
+
+    @property
+    def run_name(self) -> str:
+        name = self.name_template.format(**dataclasses.asdict(self))
+        if self.n_pre_equilibration_steps:
+            name = f"npe-{self.n_pre_equilibration_steps}_{name}"
+        return name
+
+    def get_minimization_settings(self) -> dict:
+        """Keyword arguments of ``minimize_interchange`` for this config"""
+        settings = {"minimizer": self.minimizer}
+        if self.minimizer == "staged":
+            settings.update(
+                tolerance=self.minimization_tolerance,
+                max_iterations=self.n_minimization_iterations,
+                n_clash_iterations=self.n_clash_iterations,
+                clash_max_force=self.clash_max_force,
+                n_md_steps=self.n_minimization_md_steps,
+            )
+        return settings
+
+    def replace(self, **overrides) -> "RunConfig":
+        return dataclasses.replace(self, **overrides)
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def read_config_file(config_file: pathlib.Path) -> dict:
+    """Read a YAML or JSON run configuration file"""
+    config_file = pathlib.Path(config_file)
+    with config_file.open("r") as f:
+        if config_file.suffix in (".yaml", ".yml"):
+            import yaml
+
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_configs(config_file: pathlib.Path, **overrides) -> list[RunConfig]:
+    """
+    Read run configurations from a YAML or JSON file.
+
+    Top-level keys are the settings shared by every run. An optional
+    ``variants`` list holds per-run overrides, giving one config each;
+    ``overrides`` are applied last.
+    """
+    data = read_config_file(config_file)
+    variants = data.pop("variants", None) or [{}]
+    return [RunConfig(**{**data, **variant, **overrides}) for variant in variants]
+
+
+@register_integrator("langevin-middle")
+def create_langevin_middle_integrator(config: RunConfig) -> openmm.Integrator:
+    return openmm.LangevinMiddleIntegrator(
+        config.temperature * openmm_unit.kelvin,
+        config.friction_coefficient / openmm_unit.picosecond,
+        config.timestep * openmm_unit.femtoseconds,
+    )
+
+
+@register_integrator("langevin")
+def create_langevin_integrator(config: RunConfig) -> openmm.Integrator:
+    return openmm.LangevinIntegrator(
+        config.temperature * openmm_unit.kelvin,
+        config.friction_coefficient / openmm_unit.picosecond,
+        config.timestep * openmm_unit.femtoseconds,
+    )
+
+
+@register_integrator("openmmtools-langevin")
+def create_openmmtools_langevin_integrator(config: RunConfig) -> openmm.Integrator:
+    # used by the original simulate.py and friction coefficient scripts
+    import openmmtools
+
+    return openmmtools.integrators.LangevinIntegrator(
+        temperature=config.temperature * openmm_unit.kelvin,
+        collision_rate=config.friction_coefficient / openmm_unit.picosecond,
+        timestep=config.timestep * openmm_unit.femtoseconds,
+    )
+
+
+class SimulationEngine:
+    """
+    Runs configs on one box, building its System once per hydrogen mass
+    and nonbonded settings and carrying positions and box vectors from
+    one phase to the next.
+    """
+
+    def __init__(self, interchange: Interchange):
+        self.interchange = interchange
+        self.topology = interchange.to_openmm_topology()
+        self.positions = to_openmm(interchange.positions)
+        self.box_vectors = to_openmm(interchange.box)
+        self.minimized = None
+        self._minimized_directory = None
+        self._systems = {}
+
+    @classmethod
+    def from_file(cls, interchange_file: pathlib.Path) -> "SimulationEngine":
+        return cls(Interchange.parse_file(interchange_file))
+
+    def get_system(self, hydrogen_mass: float = 1, nonbonded_settings: dict = None) -> openmm.System:
+        """A copy of the parameterized System, built on first use"""
+        key = (hydrogen_mass, json.dumps(nonbonded_settings, sort_keys=True))
+        if key not in self._systems:
+            system = self.interchange.to_openmm_system(hydrogen_mass=1.007947 * hydrogen_mass)
+            if nonbonded_settings is not None:
+                apply_nonbonded_settings(system, nonbonded_settings)
+            self._systems[key] = system
+        return openmm.XmlSerializer.clone(self._systems[key])
+
+    def create_simulation(self, config: RunConfig, platform: dict = None) -> openmm.app.Simulation:
+        system = self.get_system(config.hydrogen_mass, config.nonbonded_settings)
+        if "force-groups" in config.observables:
+            assign_force_groups(system)
+        system.addForce(
+            openmm.MonteCarloBarostat(
+                config.pressure * openmm_unit.atmospheres,
+                config.temperature * openmm_unit.kelvin,
+                config.n_barostat_steps,
+            )
+        )
+        integrator = INTEGRATORS[config.integrator](config)
+        platform_args = []
+        if platform is not None:
+            platform_args = [
+                openmm.Platform.getPlatformByName(platform["platform"]),
+                platform.get("properties", {}),
+            ]
+        simulation = openmm.app.Simulation(self.topology, system, integrator, *platform_args)
+        simulation.context.setPeriodicBoxVectors(*self.box_vectors)
+        simulation.context.setPositions(self.positions)
+        return simulation
+
+    def select_platform(self, config: RunConfig) -> dict:
+        """
+        Platform configuration for ``config``: None lets OpenMM choose,
+        and "auto" benchmarks this System, see ``platforms.select_platform``.
+        """
+        if config.platform == "default":
+            return None
+        if config.platform != "auto":
+            return {"platform": config.platform, "properties": config.platform_properties}
+        system = self.get_system(config.hydrogen_mass, config.nonbonded_settings)
+        system.addForce(
+            openmm.MonteCarloBarostat(
+                config.pressure * openmm_unit.atmospheres,
+                config.temperature * openmm_unit.kelvin,
+                config.n_barostat_steps,
+            )
+        )
+        return select_platform(
+            system,
+            INTEGRATORS[config.integrator](config),
+            self.positions,
+            self.box_vectors,
+            refresh=config.refresh_platform,
+            allow_single_precision=config.allow_single_precision,
+        )
+
+    def update_state(self, simulation: openmm.app.Simulation):
+        state = simulation.context.getState(getPositions=True)
+        self.positions = state.getPositions(asNumpy=True)
+        self.box_vectors = state.getPeriodicBoxVectors()
+
+    def to_pdb(self, output_file: pathlib.Path):
+        self.interchange.positions = from_openmm(self.positions)
+        self.interchange.box = from_openmm(self.box_vectors)
+        self.interchange.to_pdb(output_file)
+
+    def run_phase(
+        self,
+        config: RunConfig,
+        name: pathlib.Path,
+        n_steps: int = 0,
+        schedule: list[dict] = None,
+        metrics: MetricsRecorder = None,
+        platform: dict = None,
+        simulation: openmm.app.Simulation = None,
+    ) -> openmm.app.Simulation:
+        """
+        Run one phase from the current state and keep its final state.
+
+        An existing ``simulation`` is continued with fresh reporters
+        instead of creating a new one.
+        """
+        if metrics is None:
+            metrics = MetricsRecorder()
+        if simulation is None:
+            with metrics.timed("context-creation", phase=pathlib.Path(name).name) as record:
+                simulation = self.create_simulation(config, platform)
+                record["platform"] = simulation.context.getPlatform().getName()
+                record["precision"] = get_context_precision(simulation.context)
+                record["n_particles"] = simulation.system.getNumParticles()
+                record["integrator"] = config.integrator
+        else:
+            simulation.reporters.clear()
+        simulate(
+            simulation,
+            name=name,
+            timestep=config.timestep * unit.femtoseconds,
+            n_total_steps=n_steps,
+            output_frequency=config.output_frequency,
+            metrics=metrics,
+            heartbeat_interval=config.heartbeat_interval,
+            watchdog_thresholds=config.watchdog_thresholds,
+            schedule=schedule,
+            observables=config.observables,
+        )
+        self.update_state(simulation)
+        return simulation
+
+    def minimize(
+        self,
+        config: RunConfig,
+        output_directory: pathlib.Path,
+        metrics: MetricsRecorder = None,
+    ):
+        """
+        Minimize once per minimizer and minimizer settings. Later configs
+        reuse the structure and get a copy of the minimized files in their
+        own output directory.
+        """
+        settings = config.get_minimization_settings()
+        key = json.dumps(settings, sort_keys=True)
+        if self.minimized == key:
+            for file_name in MINIMIZED_FILES:
+                shutil.copyfile(self._minimized_directory / file_name, output_directory / file_name)
+            return
+        self.interchange.positions = from_openmm(self.positions)
+        self.interchange.box = from_openmm(self.box_vectors)
+        minimize_interchange(
+            self.interchange,
+            output_directory,
+            metrics=metrics,
+            **settings,
+        )
+        self.positions = to_openmm(self.interchange.positions)
+        self.minimized = key
+        self._minimized_directory = pathlib.Path(output_directory)
+
+
+@register_protocol("npt")
+def run_npt(
+    engine: SimulationEngine,
+    config: RunConfig,
+    output_directory: pathlib.Path,
+    metrics: MetricsRecorder,
+    platform: dict = None,
+):
+    """Optional annealing pre-equilibration, then NPT equilibration and production"""
+    if config.n_pre_equilibration_steps:
+        print("Pre-equilibrating...")
+        schedule = get_annealing_schedule(
+            config.n_pre_equilibration_steps,
+            temperature=config.temperature * unit.kelvin,
+            pressure=config.pressure * unit.atmospheres,
+            n_barostat_steps=config.n_barostat_steps,
+            annealing_temperature=config.annealing_temperature * unit.kelvin,
+            compression_pressure=config.compression_pressure * unit.atmospheres,
+            n_stages=config.n_pre_equilibration_stages,
+        )
+        engine.run_phase(
+            config, output_directory / "pre-equilibration",
+            schedule=schedule, metrics=metrics, platform=platform,
+        )
+        engine.to_pdb(output_directory / "pre-equilibrated.pdb")
+
+    print("Equilibrating...")
+    engine.run_phase(
+        config, output_directory / "equilibration",
+        n_steps=config.n_equilibration_steps, metrics=metrics, platform=platform,
+    )
+    engine.to_pdb(output_directory / "equilibrated.pdb")
+
+    print("Simulating...")
+    engine.run_phase(
+        config, output_directory / "production",
+        n_steps=config.n_production_steps, metrics=metrics, platform=platform,
+    )
+
+
+def get_state_point_name(temperature: float, pressure: float) -> str:
+    return f"T-{temperature:.2f}_P-{pressure:.3f}"
+
+
+@register_protocol("ladder")
+def run_ladder(
+    engine: SimulationEngine,
+    config: RunConfig,
+    output_directory: pathlib.Path,
+    metrics: MetricsRecorder,
+    platform: dict = None,
+):
+    """
+    Equilibrate at the first state point, then walk one Context through
+    every state point in order of temperature and pressure. Each point
+    gets a production run in its own subdirectory, starting from the
+    final state of the previous point; every point after the first is
+    briefly re-equilibrated first.
+    """
+    state_points = config.state_points or [
+        {"temperature": config.temperature, "pressure": config.pressure}
+    ]
+    state_points = sorted(
+        state_points, key=lambda point: (point["temperature"], point["pressure"])
+    )
+    first = state_points[0]
+    first_config = config.replace(temperature=first["temperature"], pressure=first["pressure"])
+
+    print(f"Equilibrating at {first['temperature']} K, {first['pressure']} atm...")
+    simulation = engine.run_phase(
+        first_config, output_directory / "equilibration",
+        n_steps=config.n_equilibration_steps, metrics=metrics, platform=platform,
+    )
+    engine.to_pdb(output_directory / "equilibrated.pdb")
+
+    for point in state_points:
+        point_name = get_state_point_name(point["temperature"], point["pressure"])
+        point_directory = output_directory / point_name
+        point_directory.mkdir(exist_ok=True)
+        print(f"Simulating {point_name}...")
+
+        set_conditions(
+            simulation,
+            point["temperature"] * unit.kelvin,
+            point["pressure"] * unit.atmospheres,
+        )
+        # tag the records of this state point
+        metrics.metadata["state_point"] = point_name
+        metrics.record("state-point", **point)
+        # the box was just equilibrated at the first point
+        if point is not first:
+            engine.run_phase(
+                config, point_directory / "equilibration",
+                n_steps=config.n_ladder_equilibration_steps, metrics=metrics, simulation=simulation,
+            )
+        engine.run_phase(
+            config, point_directory / "production",
+            n_steps=config.n_production_steps, metrics=metrics, simulation=simulation,
+        )
+        engine.to_pdb(point_directory / "final.pdb")
+    metrics.metadata.pop("state_point", None)
+
+
+def read_entry_settings(input_directory: pathlib.Path, config: RunConfig) -> tuple[RunConfig, dict]:
+    """
+    ``config`` with the settings it reads from files of the entry: the
+    timestep and hydrogen mass of ``timestep-probe.json`` and nonbonded
+    settings given as a file. Also returns the timestep probe, if read.
+    """
+    timestep_probe = None
+    if config.timestep_from_probe:
+        with (input_directory / "timestep-probe.json").open("r") as f:
+            timestep_probe = json.load(f)
+        config = config.replace(
+            timestep=timestep_probe["timestep_fs"],
+            hydrogen_mass=timestep_probe["hydrogen_mass"],
+        )
+        print(f"Using probed timestep {config.timestep} fs and hydrogen mass x{config.hydrogen_mass}")
+    if isinstance(config.nonbonded_settings, str):
+        with (input_directory / config.nonbonded_settings).open("r") as f:
+            config = config.replace(nonbonded_settings=json.load(f)["settings"])
+    return config, timestep_probe
+
+
+def run_config(
+    input_directory: pathlib.Path,
+    config: RunConfig,
+    engine: SimulationEngine = None,
+    profile_memory: bool = False,
+    **metadata,
+) -> pathlib.Path:
+    """
+    Run ``config`` on the box in ``input_directory`` and return the
+    output directory.
+
+    Pass the same ``engine`` for several configs on one box to share
+    the parameterized System and the minimized structure. ``metadata``
+    is added to every metrics record.
+
+    Raises ``SimulationDivergedError`` after recording the divergence
+    in ``status.json``, the metrics and the heartbeat.
+    """
+    input_directory = pathlib.Path(input_directory)
+    config, timestep_probe = read_entry_settings(input_directory, config)
+    output_directory = input_directory / config.run_name
+    output_file = input_directory / f"{config.run_name}.pdb"
+    if output_file.exists():
+        print(f"{output_file} exists")
+        return output_directory
+    output_directory.mkdir(exist_ok=True, parents=True)
+
+    metrics = MetricsRecorder(
+        output_directory / "metrics.jsonl",
+        profile_memory=profile_memory,
+        entry=input_directory.resolve().name,
+        run=config.run_name,
+        **metadata,
+    )
+    package_versions = get_package_versions()
+    with (output_directory / "package-versions.json").open("w") as f:
+        json.dump(package_versions, f, indent=2)
+    metrics.record("environment", package_versions=package_versions)
+    with (output_directory / "run-config.json").open("w") as f:
+        json.dump(config.to_dict(), f, indent=2)
+    metrics.record("run-config", config=config.to_dict())
+    if config.nonbonded_settings is not None:
+        metrics.record("nonbonded-settings", settings=config.nonbonded_settings)
+    if timestep_probe is not None:
+        metrics.record(
+            "timestep-selection",
+            timestep_fs=config.timestep,
+            hydrogen_mass=config.hydrogen_mass,
+            probes=timestep_probe["probes"],
+        )
+
+    if engine is None:
+        with metrics.timed("parse-interchange") as record:
+            engine = SimulationEngine.from_file(input_directory / "interchange.json")
+            record["n_atoms"] = engine.interchange.topology.n_atoms
+            record["n_molecules"] = engine.interchange.topology.n_molecules
+
+    print("Minimizing...")
+    engine.minimize(config, output_directory, metrics=metrics)
+
+    with metrics.timed("platform-selection", platform=config.platform) as record:
+        platform = engine.select_platform(config)
+        record["selection"] = platform
+    if platform is not None:
+        # None means OpenMM's default precision of the platform
+        properties = platform.get("properties", {})
+        with (output_directory / "run-config.json").open("w") as f:
+            json.dump(
+                {
+                    **config.to_dict(),
+                    "selected_platform": platform["platform"],
+                    "selected_properties": properties,
+                    "selected_precision": properties.get("Precision"),
+                },
+                f,
+                indent=2,
+            )
+
+    minimized = engine.positions, engine.box_vectors
+    try:
+        PROTOCOLS[config.protocol](engine, config, output_directory, metrics, platform)
+        engine.to_pdb(output_file)
+        engine.to_pdb(output_directory / "final.pdb")
+    except (SimulationDivergedError, openmm.OpenMMException) as e:
+        divergence = as_divergence(e)
+        if divergence is None:
+            raise
+        record_divergence(divergence, output_directory, metrics, config.heartbeat_interval)
+        if divergence is e:
+            raise
+        raise divergence from e
+    finally:
+        # the next config on this engine starts from the minimized structure
+        engine.positions, engine.box_vectors = minimized
+
+    record_finished(output_directory, config.heartbeat_interval)
+    return output_directory
+
+
+def run_entry(
+    input_directory: str,
+    profile_memory: bool = False,
+    watchdog: bool = True,
+    max_energy_per_particle: float = 1000,
+    max_temperature: float = 1000,
+    min_volume_fraction: float = 0.25,
+    max_volume_fraction: float = 3.0,
+    **settings,
+) -> pathlib.Path:
+    """
+    Run one entry directory containing ``interchange.json`` with the
+    options of ``simulate-general-middle.py`` and return the output
+    directory. ``settings`` are fields of ``RunConfig``.
+
+    Raises ``SimulationDivergedError`` after recording the divergence.
+    """
+    watchdog_thresholds = None
+    if watchdog:
+        watchdog_thresholds = {
+            "max_potential_energy_per_particle": max_energy_per_particle,
+            "max_temperature": max_temperature,
+            "min_volume_fraction": min_volume_fraction,
+            "max_volume_fraction": max_volume_fraction,
+        }
+    config = RunConfig(watchdog_thresholds=watchdog_thresholds, **settings)
+    return run_config(input_directory, config, profile_memory=profile_memory)
+
+
+def run_entry_quietly(input_directory: str, log_file: str, **kwargs) -> str:
+    """
+    Run one entry with its console output going to ``log_file``
+    and return ``"finished"`` or ``"diverged"``.
+    """
+    with open(log_file, "a") as f:
+        with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            try:
+                run_entry(input_directory, **kwargs)
+            except SimulationDivergedError:
+                return "diverged"
+            except Exception:
+                traceback.print_exc()
+                raise
+    return "finished"
@@ -0,0 +1,179 @@
+"""
+Equilibration detection for many observables at once.
+
+``detect_equilibration_batch`` gives the same ``t0``, ``g`` and ``Neff_max``
+as ``pymbar.timeseries.detect_equilibration`` for every column of a
+``(n_samples, n_observables)`` array. pymbar recomputes the statistical
+inefficiency of each suffix ``A_t[t:]`` from scratch, which is quadratic
+in the length of the series for each observable. Here every lag of the
+correlation function is computed once, for all suffixes and all columns,
+from cumulative sums of the lagged products ``A[:T - t] * A[t:]``.
+"""
+
+import numpy as np
+
+# suffixes whose variance is this small relative to that of the whole
+# series are treated as constant, where pymbar raises a ParameterError
+CONSTANT_TOLERANCE = 1e-12
+
+
+def get_suffix_statistical_inefficiencies(
+    A_t: np.ndarray,
+    starts: np.ndarray,
+    fast: bool = True,
+    mintime: int = 3,
+) -> np.ndarray:
+    """
+    Statistical inefficiency of ``A_t[start:]`` for each of ``starts``
+    and each column of ``A_t``, as ``pymbar.timeseries.statistical_inefficiency``.
+
+    Parameters
+    ----------
+    A_t: np.ndarray
+        Timeseries, shape (n_samples, n_observables)
+    starts: np.ndarray
+        Sorted indices at which the suffixes start, all below n_samples - 1
+    fast: bool
+        Increase the lag increment by one every step, as pymbar's ``fast``
+    mintime: int
+        Minimum lag before the correlation function may be truncated
+        at its first non-positive value
+
+    Returns
+    -------
+    g: np.ndarray
+        Statistical inefficiencies, shape (len(starts), n_observables).
+        Constant suffixes get ``n_samples - start + 1``, as in pymbar.
+    """
+    T, n_columns = A_t.shape
+    starts = np.asarray(starts, dtype=int)
+    # centering on the global mean keeps the cumulative sums well conditioned
+    x = A_t - A_t.mean(axis=0)
+    zeros = np.zeros((1, n_columns))
+    prefix = np.concatenate([zeros, np.cumsum(x, axis=0)])
+    prefix_squared = np.concatenate([zeros, np.cumsum(x ** 2, axis=0)])
+
+    n = (T - starts)[:, None]
+    mu = (prefix[T] - prefix[starts]) / n
+    sigma2 = (prefix_squared[T] - prefix_squared[starts]) / n - mu ** 2
+    constant = sigma2 <= CONSTANT_TOLERANCE * x.var(axis=0)
+
+    g = np.ones((len(starts), n_columns))
+    active = ~constant
+    t = 1
+    increment = 1
+    while True:
+        # a suffix of length n only has lags below n - 1
+        n_long = np.searchsorted(starts, T - t - 1)
+        active[n_long:] = False
+        if not active.any():
+            break
+        s = starts[:n_long]
+        n_s = n[:n_long]
+        mu_s = mu[:n_long]
+
+        # sum over i >= s of x[i] * x[i + t], for every s
+        lagged = x[: T - t] * x[t:]
+        suffix_sums = np.cumsum(lagged[::-1], axis=0)[::-1]
+        covariance = (
+            suffix_sums[s]
+            - mu_s * (prefix[T - t] - prefix[s] + prefix[T] - prefix[s + t])
+            + (n_s - t) * mu_s ** 2
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            C = covariance / ((n_s - t) * sigma2[:n_long])
+
+        still_active = active[:n_long]
+        still_active &= ~((C <= 0) & (t > mintime))
+        g[:n_long] += np.where(still_active, 2.0 * C * (1.0 - t / n_s) * increment, 0.0)
+
+        t += increment
+        if fast:
+            increment += 1
+
+    g = np.maximum(g, 1.0)
+    return np.where(constant, (T - starts + 1)[:, None], g)
+
+
+def detect_equilibration_batch(
+    A_t: np.ndarray,
+    nskip: int = 1,
+    refine: bool = True,
+    fast: bool = True,
+    mintime: int = 3,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Detect the equilibration time of each column of ``A_t`` by maximizing
+    the number of effective samples, as ``pymbar.timeseries.detect_equilibration``.
+
+    Parameters
+    ----------
+    A_t: np.ndarray
+        Timeseries, shape (n_samples,) or (n_samples, n_observables)
+    nskip: int
+        Only try every ``nskip``-th sample as the start of production
+    refine: bool
+        With ``nskip > 1``, also try every sample within ``nskip`` of
+        the best coarse start. pymbar does not refine.
+    fast: bool
+        Use pymbar's fast statistical inefficiency
+    mintime: int
+        Minimum lag of the correlation function
+
+    Returns
+    -------
+    t0: np.ndarray
+        Index of the start of equilibrated data, per column
+    g: np.ndarray
+        Statistical inefficiency of the equilibrated data, per column
+    Neff_max: np.ndarray
+        Number of effective uncorrelated samples, per column
+    """
+    A_t = np.asarray(A_t, dtype=np.float64)
+    if A_t.ndim == 1:
+        A_t = A_t[:, None]
+    T, n_columns = A_t.shape
+
+    # float32 like pymbar, so that ties in Neff break the same way
+    g_t = np.ones((T - 1, n_columns), np.float32)
+    Neff_t = np.ones((T - 1, n_columns), np.float32)
+
+    def evaluate(starts):
+        g_t[starts] = get_suffix_statistical_inefficiencies(A_t, starts, fast=fast, mintime=mintime)
+        Neff_t[starts] = (T - starts + 1)[:, None] / g_t[starts].astype(np.float64)
+
+    evaluated = np.zeros(T - 1, dtype=bool)
+    starts = np.arange(0, T - 1, nskip)
+    evaluate(starts)
+    evaluated[starts] = True
+
+    if refine and nskip > 1:
+        window = np.zeros(T - 1, dtype=bool)
+        for best in np.unique(Neff_t.argmax(axis=0)):
+            window[max(best - nskip + 1, 0) : best + nskip] = True
+        starts = np.flatnonzero(window & ~evaluated)
+        if len(starts):
+            evaluate(starts)
+
+    t0 = Neff_t.argmax(axis=0)
+    columns = np.arange(n_columns)
+    g = g_t[t0, columns]
+    Neff_max = Neff_t[t0, columns]
+
+    # pymbar returns (0, 1, 1) for a constant series
+    constant = A_t.std(axis=0) == 0
+    t0[constant] = 0
+    g[constant] = 1
+    Neff_max[constant] = 1
+    return t0, g, Neff_max
+
+
+def detect_equilibration(
+    A_t: np.ndarray,
+    nskip: int = 1,
+    refine: bool = True,
+    fast: bool = True,
+) -> tuple[int, float, float]:
+    """``detect_equilibration_batch`` for a single timeseries"""
+    t0, g, Neff_max = detect_equilibration_batch(A_t, nskip=nskip, refine=refine, fast=fast)
+    return int(t0[0]), float(g[0]), float(Neff_max[0])
@@ -0,0 +1,281 @@
+"""
+Estimate the mean of every observable of every entry of a run, with
+uncertainties, from the samples after the detected equilibration time.
+
+    python estimate-properties.py -i boxes-nosort/n-2000/runs-interchange-final \\
+        -r ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1 \\
+        -e boxes-nosort_n-2000_interchange-equilibration.csv
+
+Reporter CSVs are read in chunks into ``estimators.BlockAccumulator``;
+the samples used are also kept for their statistical inefficiency.
+By default only production samples are used, and t0 from the
+equilibration results (from determine-equilibration-time.py) only
+matters when it falls inside production. With ``--include-equilibration``,
+equilibration samples after t0 are used too.
+
+Ladder runs (see engine.run_ladder) are estimated at each of their
+state points, from the T-<K>_P-<atm>/ subdirectories of the run. Other
+runs are at ``--temperature`` and ``--pressure``. Equilibration results
+only apply to the run itself, so ladder points use all their production
+samples.
+
+Each row gives the mean, the block standard error, the standard error
+from the statistical inefficiency g of the samples used, and a
+bootstrap over block means, which is done for all entries and
+observables at once. ``g_equilibration`` is the statistical
+inefficiency that determine-equilibration-time.py found after t0 in
+equilibration.csv, for reference.
+"""
+
+import concurrent.futures
+import functools
+import pathlib
+import re
+
+import click
+import numpy as np
+import tqdm
+
+# subdirectories of ladder runs, from engine.get_state_point_name
+STATE_POINT_PATTERN = re.compile(r"T-([\d.]+)_P-([\d.]+)")
+
+
+def count_rows(csv_file: pathlib.Path) -> int:
+    """Number of data rows of a CSV with a header, without parsing it"""
+    n_lines = 0
+    with open(csv_file, "rb") as f:
+        while chunk := f.read(1 << 20):
+            n_lines += chunk.count(b"\n")
+    return max(n_lines - 1, 0)
+
+
+def estimate_entry(
+    run_directory: pathlib.Path,
+    equilibration: dict[str, dict] = None,
+    columns: list[str] = None,
+    include_equilibration: bool = False,
+    max_blocks: int = 64,
+    chunk_size: int = 10000,
+    temperature: float = 298.15,
+    pressure: float = 1.0,
+) -> list[dict]:
+    """
+    Statistics of each observable of one run, or of one state point of a
+    ladder run. Runs that are not ladder points are at ``temperature`` in
+    K and ``pressure`` in atm.
+
+    ``equilibration`` maps properties to their row of the equilibration
+    results, with t0 counted in samples of equilibration.csv.
+    """
+    import pandas as pd
+
+    from equilibration import get_suffix_statistical_inefficiencies
+    from estimators import BlockAccumulator
+    from tailing import IGNORE_COLUMNS
+
+    equilibration = equilibration or {}
+    equilibration_csv = run_directory / "equilibration.csv"
+    # the first state point of a ladder run is not re-equilibrated
+    n_equilibration_rows = count_rows(equilibration_csv) if equilibration_csv.exists() else 0
+    files = [(run_directory / "production.csv", n_equilibration_rows)]
+    if include_equilibration and n_equilibration_rows:
+        files.insert(0, (equilibration_csv, 0))
+
+    usecols = columns
+    if usecols is None:
+        usecols = lambda column: column not in IGNORE_COLUMNS
+    accumulators = {}
+    samples = {}
+    starts = {}
+    for csv_file, offset in files:
+        # index of the first row of the chunk in equilibration + production
+        index = offset
+        for df in pd.read_csv(csv_file, usecols=usecols, chunksize=chunk_size):
+            for column in df.columns:
+                if column not in accumulators:
+                    accumulators[column] = BlockAccumulator(max_blocks=max_blocks)
+                    samples[column] = []
+                    t0 = equilibration.get(column, {}).get("t0", 0)
+                    starts[column] = max(t0, offset)
+                start = max(starts[column] - index, 0)
+                accumulators[column].update(df[column].values[start:])
+                samples[column].append(df[column].values[start:].astype(float))
+            index += len(df)
+
+    state_point = STATE_POINT_PATTERN.fullmatch(run_directory.name)
+    if state_point is None:
+        run = run_directory.name
+        entry_directory = run_directory.parent
+    else:
+        run = run_directory.parent.name
+        entry_directory = run_directory.parent.parent
+        temperature, pressure = map(float, state_point.groups())
+    entry = int(entry_directory.name.split("-")[1])
+    rows = []
+    for column, accumulator in accumulators.items():
+        statistics = accumulator.get_statistics()
+        values = np.concatenate(samples[column])
+        g = np.nan
+        if len(values) > 2:
+            g = get_suffix_statistical_inefficiencies(values[:, None], np.array([0]), fast=False)[0, 0]
+        rows.append({
+            "entry": entry,
+            "run": run,
+            "temperature": temperature,
+            "pressure": pressure,
+            "property": column,
+            "start": starts[column],
+            **statistics,
+            "g": g,
+            "sem_g": statistics["std"] * np.sqrt(g / statistics["n_samples"]),
+            "g_equilibration": equilibration.get(column, {}).get("g", np.nan),
+            "block_means": accumulator.block_means,
+        })
+    return rows
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-1000",
+    type=str,
+    help="Directory containing entry-* subdirectories",
+)
+@click.option(
+    "--run",
+    "-r",
+    default="ne-2500000_np-1000000_dt-2.0_nb-25",
+    type=str,
+    help="Run",
+)
+@click.option(
+    "--equilibration-file",
+    "-e",
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    help="Output of determine-equilibration-time.py for this run. Default: t0 = 0",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="boxes-nosort_n-1000_properties.csv",
+    type=str,
+    help="Output file",
+)
+@click.option(
+    "--column",
+    "-c",
+    "columns",
+    multiple=True,
+    help="Observable to estimate, e.g. 'Density (g/mL)'; repeat for several. Default: all",
+)
+@click.option(
+    "--temperature",
+    "-t",
+    default=298.15,
+    type=float,
+    help="Temperature in K of runs that are not ladder runs",
+)
+@click.option(
+    "--pressure",
+    "-p",
+    default=1.0,
+    type=float,
+    help="Pressure in atm of runs that are not ladder runs",
+)
+@click.option(
+    "--include-equilibration/--production-only",
+    default=False,
+    help="Also use equilibration samples after t0",
+)
+@click.option(
+    "--max-blocks",
+    default=64,
+    type=int,
+    help="Blocks are merged pairwise once there are twice this many",
+)
+@click.option(
+    "--n-bootstrap",
+    default=1000,
+    type=int,
+    help="Number of bootstrap samples of the block means",
+)
+@click.option(
+    "--seed",
+    default=0,
+    type=int,
+    help="Seed of the bootstrap",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    type=int,
+    help="Number of processes reading entries in parallel",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-1000",
+    run: str = "ne-2500000_np-1000000_dt-2.0_nb-25",
+    equilibration_file: str = None,
+    output_file: str = "boxes-nosort_n-1000_properties.csv",
+    columns: list[str] = (),
+    temperature: float = 298.15,
+    pressure: float = 1.0,
+    include_equilibration: bool = False,
+    max_blocks: int = 64,
+    n_bootstrap: int = 1000,
+    seed: int = 0,
+    workers: int = 1,
+):
+    import pandas as pd
+
+    from estimators import bootstrap_means
+
+    input_directory = pathlib.Path(input_directory)
+    run_directories = sorted(
+        production_csv.parent
+        for pattern in [f"*/{run}/production.csv", f"*/{run}/T-*_P-*/production.csv"]
+        for production_csv in input_directory.glob(pattern)
+    )
+    columns = list(columns) or None
+
+    equilibration = {}
+    if equilibration_file is not None:
+        df = pd.read_csv(equilibration_file)
+        for row in df[df.run == run].to_dict(orient="records"):
+            equilibration.setdefault(row["entry"], {})[row["property"]] = row
+
+    def get_equilibration(run_directory):
+        if run_directory.name != run:
+            # ladder state points are not in the equilibration results
+            return None
+        return equilibration.get(int(run_directory.parent.name.split("-")[1]))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            functools.partial(estimate_entry, temperature=temperature, pressure=pressure),
+            run_directories,
+            [get_equilibration(run_directory) for run_directory in run_directories],
+            [columns] * len(run_directories),
+            [include_equilibration] * len(run_directories),
+            [max_blocks] * len(run_directories),
+            chunksize=max(len(run_directories) // (workers * 8), 1),
+        )
+        rows = [
+            row
+            for entry_rows in tqdm.tqdm(results, total=len(run_directories))
+            for row in entry_rows
+        ]
+
+    means = bootstrap_means([row.pop("block_means") for row in rows], n_bootstrap=n_bootstrap, seed=seed)
+    df = pd.DataFrame(rows)
+    with np.errstate(invalid="ignore"):
+        df["sem_bootstrap"] = np.std(means, axis=1, ddof=1)
+        df["ci_low"], df["ci_high"] = np.percentile(means, [2.5, 97.5], axis=1)
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} rows to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Means and uncertainties of observables from timeseries read in chunks.
+
+``BlockAccumulator`` keeps a running mean and variance and the sums of
+at most ``2 * max_blocks`` contiguous blocks. When the blocks fill up,
+neighbouring blocks are merged and the block size doubles, so memory
+stays constant however long the series is. The blocks end up longer
+than the correlation time of any reasonably sampled observable. Their
+means are then treated as independent samples. They give the block
+standard error, the statistical inefficiency, and the unit that
+``bootstrap_means`` resamples.
+"""
+
+import collections
+
+import numpy as np
+
+
+class BlockAccumulator:
+    def __init__(self, max_blocks: int = 64):
+        self.max_blocks = max_blocks
+        self.block_size = 1
+        self.block_sums = np.zeros(0)
+        self.partial_sum = 0.0
+        self.partial_count = 0
+        self.n_samples = 0
+        self.mean = 0.0
+        # sum of squared deviations from the mean
+        self.m2 = 0.0
+
+    def update(self, values: np.ndarray):
+        """Add the next samples of the series"""
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return
+
+        # Chan et al.'s pairwise update of the mean and variance
+        n = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.n_samples + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n_samples * n / total
+        self.n_samples = total
+
+        # complete the partial block, then add whole blocks
+        n_fill = min(self.block_size - self.partial_count, n)
+        self.partial_sum += values[:n_fill].sum()
+        self.partial_count += n_fill
+        values = values[n_fill:]
+        if self.partial_count < self.block_size:
+            return
+        n_blocks = len(values) // self.block_size
+        n_whole = n_blocks * self.block_size
+        self.block_sums = np.concatenate([
+            self.block_sums,
+            [self.partial_sum],
+            values[:n_whole].reshape(n_blocks, self.block_size).sum(axis=1),
+        ])
+        self.partial_sum = values[n_whole:].sum()
+        self.partial_count = len(values) - n_whole
+
+        while len(self.block_sums) >= 2 * self.max_blocks:
+            if len(self.block_sums) % 2:
+                # the last whole block joins the partial block that follows it
+                self.partial_sum += self.block_sums[-1]
+                self.partial_count += self.block_size
+                self.block_sums = self.block_sums[:-1]
+            self.block_sums = self.block_sums[0::2] + self.block_sums[1::2]
+            self.block_size *= 2
+
+    @property
+    def block_means(self) -> np.ndarray:
+        """Means of the whole blocks; the samples of the partial block are left out"""
+        return self.block_sums / self.block_size
+
+    @property
+    def variance(self) -> float:
+        if self.n_samples < 2:
+            return np.nan
+        return self.m2 / (self.n_samples - 1)
+
+    def get_statistics(self) -> dict:
+        """Mean, standard deviation, block standard error and statistical inefficiency"""
+        block_means = self.block_means
+        n_blocks = len(block_means)
+        variance = self.variance
+        block_variance = block_means.var(ddof=1) if n_blocks > 1 else np.nan
+        return {
+            "n_samples": self.n_samples,
+            "mean": self.mean,
+            "std": np.sqrt(variance),
+            "n_blocks": n_blocks,
+            "block_size": self.block_size,
+            "sem_block": np.sqrt(block_variance / n_blocks) if n_blocks > 1 else np.nan,
+            # ratio of the variance of block means to that of independent samples
+            "g_block": max(self.block_size * block_variance / variance, 1.0) if n_blocks > 1 else np.nan,
+        }
+
+
+def bootstrap_means(
+    block_means: list[np.ndarray],
+    n_bootstrap: int = 1000,
+    seed: int = None,
+) -> np.ndarray:
+    """
+    Bootstrap the means of many series of block means at once.
+
+    Series with the same number of blocks share multinomial resampling
+    weights, so each such group is a single matrix product.
+
+    Returns
+    -------
+    means: np.ndarray
+        Bootstrapped means, shape (len(block_means), n_bootstrap).
+        Series with fewer than two blocks are NaN.
+    """
+    rng = np.random.default_rng(seed)
+    means = np.full((len(block_means), n_bootstrap), np.nan)
+    groups = collections.defaultdict(list)
+    for i, series in enumerate(block_means):
+        if len(series) > 1:
+            groups[len(series)].append(i)
+    for n_blocks, indices in groups.items():
+        weights = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=n_bootstrap)
+        series = np.array([block_means[i] for i in indices])
+        means[indices] = series @ weights.T / n_blocks
+    return means
@@ -0,0 +1,168 @@
+"""
+Single-molecule gas-phase simulations with the parameters of a liquid box.
+
+The gas-phase System is cut out of the OpenMM System of a pure liquid box,
+so the molecule has exactly the parameters, charges and constraints that
+it has in the liquid. Nonbonded interactions have no cutoff and no PME.
+The System is small enough that each simulation uses one CPU thread, and
+many run side by side in a process pool.
+"""
+
+import json
+import pathlib
+import time
+
+import openmm
+from openmm import unit as openmm_unit
+
+from openff.units.openmm import to_openmm
+from openff.interchange import Interchange
+
+from estimators import BlockAccumulator
+from reporters import BOLTZMANN, write_json_atomic
+
+
+def extract_molecule_system(system: openmm.System, atom_indices: list[int]) -> openmm.System:
+    """
+    A non-periodic System of the particles ``atom_indices`` of ``system``
+    and the interactions between them only.
+    """
+    index_map = {old: new for new, old in enumerate(atom_indices)}
+
+    def map_particles(*particles):
+        if all(particle in index_map for particle in particles):
+            return [index_map[particle] for particle in particles]
+        return None
+
+    molecule_system = openmm.System()
+    for old in atom_indices:
+        if system.isVirtualSite(old):
+            raise ValueError("Virtual sites are not supported")
+        molecule_system.addParticle(system.getParticleMass(old))
+    for i in range(system.getNumConstraints()):
+        p1, p2, distance = system.getConstraintParameters(i)
+        particles = map_particles(p1, p2)
+        if particles is not None:
+            molecule_system.addConstraint(*particles, distance)
+
+    for force in system.getForces():
+        if isinstance(force, openmm.HarmonicBondForce):
+            new_force = openmm.HarmonicBondForce()
+            for i in range(force.getNumBonds()):
+                p1, p2, *parameters = force.getBondParameters(i)
+                particles = map_particles(p1, p2)
+                if particles is not None:
+                    new_force.addBond(*particles, *parameters)
+        elif isinstance(force, openmm.HarmonicAngleForce):
+            new_force = openmm.HarmonicAngleForce()
+            for i in range(force.getNumAngles()):
+                p1, p2, p3, *parameters = force.getAngleParameters(i)
+                particles = map_particles(p1, p2, p3)
+                if particles is not None:
+                    new_force.addAngle(*particles, *parameters)
+        elif isinstance(force, openmm.PeriodicTorsionForce):
+            new_force = openmm.PeriodicTorsionForce()
+            for i in range(force.getNumTorsions()):
+                p1, p2, p3, p4, *parameters = force.getTorsionParameters(i)
+                particles = map_particles(p1, p2, p3, p4)
+                if particles is not None:
+                    new_force.addTorsion(*particles, *parameters)
+        elif isinstance(force, openmm.NonbondedForce):
+            new_force = openmm.NonbondedForce()
+            new_force.setNonbondedMethod(openmm.NonbondedForce.NoCutoff)
+            for old in atom_indices:
+                new_force.addParticle(*force.getParticleParameters(old))
+            for i in range(force.getNumExceptions()):
+                p1, p2, *parameters = force.getExceptionParameters(i)
+                particles = map_particles(p1, p2)
+                if particles is not None:
+                    new_force.addException(*particles, *parameters)
+        elif isinstance(force, (openmm.CMMotionRemover, openmm.MonteCarloBarostat)):
+            continue
+        else:
+            raise ValueError(f"Cannot cut a molecule out of a {force.__class__.__name__}")
+        new_force.setName(force.getName())
+        new_force.setForceGroup(force.getForceGroup())
+        molecule_system.addForce(new_force)
+    return molecule_system
+
+
+def run_gas_phase(
+    entry_directory: str,
+    temperature: float = 298.15,
+    friction_coefficient: float = 1.0,
+    timestep: float = 1.0,
+    hydrogen_mass: float = 1,
+    n_equilibration_steps: int = 100000,
+    n_production_steps: int = 1000000,
+    output_frequency: int = 500,
+    n_threads: int = 1,
+    seed: int = 0,
+) -> dict:
+    """
+    Simulate the first molecule of the pure box in ``entry_directory`` in
+    vacuum, in K, ps^-1 and fs, and write its potential energy statistics
+    to ``gas-phase.json`` there. Existing results are returned as they are.
+    """
+    entry_directory = pathlib.Path(entry_directory)
+    output_file = entry_directory / "gas-phase.json"
+    if output_file.exists():
+        with output_file.open("r") as f:
+            return json.load(f)
+
+    start_time = time.perf_counter()
+    interchange = Interchange.parse_file(entry_directory / "interchange.json")
+    molecule = interchange.topology.molecule(0)
+    atom_indices = list(range(molecule.n_atoms))
+    system = interchange.to_openmm_system(hydrogen_mass=1.007947 * hydrogen_mass)
+    molecule_system = extract_molecule_system(system, atom_indices)
+    positions = to_openmm(interchange.positions)[: molecule.n_atoms]
+    del interchange, system
+
+    integrator = openmm.LangevinMiddleIntegrator(
+        temperature * openmm_unit.kelvin,
+        friction_coefficient / openmm_unit.picosecond,
+        timestep * openmm_unit.femtoseconds,
+    )
+    integrator.setRandomNumberSeed(seed)
+    context = openmm.Context(
+        molecule_system,
+        integrator,
+        openmm.Platform.getPlatformByName("CPU"),
+        {"Threads": str(n_threads)},
+    )
+    context.setPositions(positions)
+    openmm.LocalEnergyMinimizer.minimize(context)
+    context.setVelocitiesToTemperature(temperature * openmm_unit.kelvin, seed)
+    setup_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    integrator.step(n_equilibration_steps)
+    energies = []
+    for _ in range(n_production_steps // output_frequency):
+        integrator.step(output_frequency)
+        state = context.getState(getEnergy=True)
+        energies.append(state.getPotentialEnergy().value_in_unit(openmm_unit.kilojoules_per_mole))
+    md_seconds = time.perf_counter() - start_time
+
+    accumulator = BlockAccumulator()
+    accumulator.update(energies)
+    statistics = accumulator.get_statistics()
+    n_steps = n_equilibration_steps + n_production_steps
+    result = {
+        "entry": entry_directory.name,
+        "smiles": molecule.to_smiles(),
+        "n_atoms": molecule.n_atoms,
+        "temperature": temperature,
+        "n_samples": statistics["n_samples"],
+        "potential_energy": statistics["mean"],
+        "potential_energy_std": statistics["std"],
+        "potential_energy_sem": statistics["sem_block"],
+        "g_block": statistics["g_block"],
+        "RT": BOLTZMANN * temperature,
+        "setup_seconds": setup_seconds,
+        "md_seconds": md_seconds,
+        "ns_per_day": n_steps * timestep * 1e-6 * 86400 / md_seconds,
+    }
+    write_json_atomic(result, output_file)
+    return result
@@ -0,0 +1,243 @@
+"""
+A local SQLite-backed queue of entries for long-lived workers.
+
+Any number of workers on any number of nodes can share one queue file.
+SQLite's locking is not reliable on network filesystems such as NFS and
+Lustre, so a claim is only made by exclusively creating a claim file for
+that attempt of the entry in ``<queue file>.claims/``. An exclusive
+create is atomic on these filesystems, so two workers never run the same
+attempt even if their SQLite transactions overlap. A claim file is
+removed again if its attempt cannot be recorded; one left behind by a
+worker killed in between is taken as lost once older than
+``stale_seconds``, and the next attempt is made instead. Workers refresh
+a heartbeat on their claimed entry; an entry whose heartbeat is older
+than ``stale_seconds`` is assumed to belong to a crashed worker and is
+handed out again, up to ``max_attempts`` times.
+"""
+
+import contextlib
+import os
+import pathlib
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    entry TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    message TEXT
+)
+"""
+
+STATUSES = ["pending", "running", "finished", "diverged", "failed"]
+
+
+def parse_indices(text: str) -> list[int]:
+    """Parse e.g. ``0-3,7`` into ``[0, 1, 2, 3, 7]``"""
+    indices = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            indices.extend(range(int(start), int(end) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+class JobQueue:
+    def __init__(
+        self,
+        queue_file: pathlib.Path,
+        stale_seconds: float = 1800,
+        max_attempts: int = 3,
+    ):
+        self.queue_file = pathlib.Path(queue_file)
+        self.claim_directory = self.queue_file.with_name(f"{self.queue_file.name}.claims")
+        self.claim_directory.mkdir(parents=True, exist_ok=True)
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        with self.transaction() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A write transaction that holds the database lock from the start,
+        so that a read followed by an update cannot race another worker.
+        """
+        connection = sqlite3.connect(self.queue_file, timeout=300, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def add(self, entries: list[str]) -> int:
+        """Queue entries that are not already queued; returns the number added"""
+        with self.transaction() as connection:
+            cursor = connection.executemany(
+                "INSERT OR IGNORE INTO jobs (entry) VALUES (?)",
+                [(entry,) for entry in entries],
+            )
+            return cursor.rowcount
+
+    def get_claim_file(self, entry: str, attempt: int) -> pathlib.Path:
+        return self.claim_directory / f"{entry}.{attempt}"
+
+    def is_stale_claim(self, entry: str, attempt: int) -> bool:
+        """Whether the claim file of ``attempt`` of ``entry`` is older than ``stale_seconds``"""
+        try:
+            modified = self.get_claim_file(entry, attempt).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - modified > self.stale_seconds
+
+    def create_claim_file(self, entry: str, attempt: int, worker: str) -> bool:
+        """Exclusively create the claim file of ``attempt`` of ``entry``; False if it exists"""
+        claim_file = self.get_claim_file(entry, attempt)
+        try:
+            fd = os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{worker} {time.time()}\n")
+        return True
+
+    def create_next_claim_file(self, entry: str, attempts: int, worker: str) -> int:
+        """
+        Claim the attempt after the ``attempts`` recorded for ``entry``;
+        returns its number, or None if another worker holds it.
+
+        An old claim file of an attempt that was never recorded belongs
+        to a worker killed before committing, so the attempt after it is
+        tried instead.
+        """
+        attempt = attempts + 1
+        while not self.create_claim_file(entry, attempt, worker):
+            if not self.is_stale_claim(entry, attempt):
+                return None
+            attempt += 1
+        return attempt
+
+    def reset(self, statuses: list[str] = ("failed", "diverged")) -> int:
+        """Make entries with the given statuses pending again"""
+        placeholders = ",".join("?" for _ in statuses)
+        with self.transaction() as connection:
+            entries = connection.execute(
+                f"SELECT entry FROM jobs WHERE status IN ({placeholders})",
+                list(statuses),
+            ).fetchall()
+            # attempts start again from one
+            for entry, in entries:
+                for claim_file in self.claim_directory.glob(f"{entry}.*"):
+                    claim_file.unlink(missing_ok=True)
+            cursor = connection.execute(
+                f"UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL "
+                f"WHERE status IN ({placeholders})",
+                list(statuses),
+            )
+            return cursor.rowcount
+
+    def claim(self, worker: str) -> str:
+        """
+        Atomically claim the next pending or stale entry for ``worker``.
+
+        Returns None when nothing is left to claim.
+        """
+        now = time.time()
+        claim_file = None
+        try:
+            with self.transaction() as connection:
+                # entries of crashed workers that have used up their attempts
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', message = 'worker lost' "
+                    "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                    (now - self.stale_seconds, self.max_attempts),
+                )
+                rows = connection.execute(
+                    "SELECT entry, attempts FROM jobs "
+                    "WHERE status = 'pending' "
+                    "OR (status = 'running' AND heartbeat_at < ?) "
+                    "ORDER BY attempts, entry",
+                    (now - self.stale_seconds,),
+                ).fetchall()
+                for entry, attempts in rows:
+                    attempt = self.create_next_claim_file(entry, attempts, worker)
+                    # another worker is making this attempt
+                    if attempt is None:
+                        continue
+                    claim_file = self.get_claim_file(entry, attempt)
+                    connection.execute(
+                        "UPDATE jobs SET status = 'running', attempts = ?, "
+                        "worker = ?, claimed_at = ?, heartbeat_at = ?, message = NULL "
+                        "WHERE entry = ?",
+                        (attempt, worker, now, now, entry),
+                    )
+                    return entry
+                return None
+        except BaseException:
+            # the attempt was not recorded, so leave it to another worker
+            if claim_file is not None:
+                claim_file.unlink(missing_ok=True)
+            raise
+
+    def heartbeat(self, entry: str, worker: str):
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? "
+                "WHERE entry = ? AND worker = ? AND status = 'running'",
+                (time.time(), entry, worker),
+            )
+
+    def complete(self, entry: str, worker: str, status: str = "finished", message: str = None):
+        """
+        Record the outcome of a claimed entry. Failed entries go back
+        to pending until they have used up their attempts.
+        """
+        if status not in STATUSES:
+            raise ValueError(f"Unknown status {status}")
+        with self.transaction() as connection:
+            if status == "failed":
+                connection.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? "
+                    "THEN 'failed' ELSE 'pending' END, message = ?, finished_at = ? "
+                    "WHERE entry = ? AND worker = ?",
+                    (self.max_attempts, message, time.time(), entry, worker),
+                )
+            else:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, message = ?, finished_at = ? "
+                    "WHERE entry = ? AND worker = ?",
+                    (status, message, time.time(), entry, worker),
+                )
+
+    def get_counts(self) -> dict[str, int]:
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def get_jobs(self, status: str = None) -> list[dict]:
+        query = "SELECT * FROM jobs"
+        parameters = []
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters.append(status)
+        with self.transaction() as connection:
+            connection.row_factory = sqlite3.Row
+            rows = connection.execute(query + " ORDER BY entry", parameters).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,279 @@
+"""
+Timing and throughput records for packing and simulation runs.
+
+Each stage appends one JSON record per line to a ``metrics.jsonl`` file
+so that runs across the whole array can be aggregated afterwards
+with ``aggregate-metrics.py``.
+
+Memory profiling is opt-in as tracemalloc slows down
+allocation-heavy Python code considerably.
+"""
+
+import contextlib
+import importlib
+import json
+import pathlib
+import os
+import platform
+import resource
+import socket
+import threading
+import time
+import tracemalloc
+
+PACKAGES = [
+    "openmm",
+    "openmmtools",
+    "openff.toolkit",
+    "openff.units",
+    "openff.interchange",
+    "openff.evaluator",
+    "pymbar",
+]
+
+
+def get_package_versions(packages: list[str] = PACKAGES) -> dict[str, str]:
+    """Versions of the packages that are importable in this environment"""
+    package_versions = {"python": platform.python_version()}
+    for package in packages:
+        try:
+            module = importlib.import_module(package)
+        except ImportError:
+            continue
+        package_versions[package] = getattr(module, "__version__", "unknown")
+    return package_versions
+
+
+def get_peak_children_rss_mb() -> float:
+    """
+    Largest resident memory of any waited-for child process, such as
+    packmol, over the life of this process.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def get_current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            n_pages = int(f.read().split()[1])
+    except OSError:
+        return float("nan")
+    return n_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+class RSSSampler:
+    """
+    Samples the resident memory of this process from a background
+    thread and keeps the highest value seen.
+
+    ``ru_maxrss`` is a high-water mark over the life of the process, so
+    in a process that runs several stages or entries it would attribute
+    the peak of an earlier one to every later one. This is the peak of
+    the enclosed block only, missing spikes shorter than the interval.
+    """
+
+    def __init__(self, interval_seconds: float = 0.1):
+        self.interval_seconds = interval_seconds
+        self.start_mb = get_current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        self.peak_mb = max(self.peak_mb, get_current_rss_mb())
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.sample()
+
+    def start(self) -> "RSSSampler":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def get_top_allocations(n_top: int = 10) -> list[dict]:
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ])
+    top_allocations = []
+    for stat in snapshot.statistics("lineno")[:n_top]:
+        frame = stat.traceback[0]
+        top_allocations.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_mb": stat.size / 1024 ** 2,
+            "count": stat.count,
+        })
+    return top_allocations
+
+
+def ns_per_day(
+    n_steps: int,
+    timestep_fs: float,
+    seconds: float,
+) -> float:
+    if seconds <= 0:
+        return float("nan")
+    simulated_ns = n_steps * timestep_fs * 1e-6
+    return simulated_ns * 86400 / seconds
+
+
+class MetricsRecorder:
+    """
+    Append-only recorder of per-stage timings.
+
+    Parameters
+    ----------
+    output_file: pathlib.Path
+        JSONL file to append records to.
+        If None, records are returned but not written
+    profile_memory: bool
+        Whether to record the peak RSS and the top tracemalloc
+        allocators of every timed stage
+    n_top_allocations: int
+        Number of allocation sites to record per stage
+    rss_sample_seconds: float
+        Interval at which RSS is sampled during a timed stage
+    **metadata
+        Extra fields written into every record, e.g. the entry name
+    """
+
+    def __init__(
+        self,
+        output_file: pathlib.Path = None,
+        profile_memory: bool = False,
+        n_top_allocations: int = 10,
+        rss_sample_seconds: float = 0.1,
+        **metadata
+    ):
+        self.output_file = None
+        if output_file is not None:
+            self.output_file = pathlib.Path(output_file)
+            self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        self.profile_memory = profile_memory
+        self.n_top_allocations = n_top_allocations
+        self.rss_sample_seconds = rss_sample_seconds
+        if profile_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.metadata = {
+            "hostname": socket.gethostname(),
+            **metadata,
+        }
+
+    def record(self, stage: str, **fields):
+        record = {
+            "stage": stage,
+            "timestamp": time.time(),
+            **self.metadata,
+            **fields,
+        }
+        if self.output_file is None:
+            return record
+        # one line per write keeps concurrent appends readable
+        with self.output_file.open("a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        return record
+
+    @contextlib.contextmanager
+    def timed(self, stage: str, **fields):
+        """
+        Time the enclosed block and record it as ``stage``.
+
+        The yielded dictionary can be updated inside the block
+        to add fields that are only known afterwards, e.g. ``n_steps``.
+        """
+        extra = dict(fields)
+        sampler = None
+        if self.profile_memory:
+            start_children_rss = get_peak_children_rss_mb()
+            tracemalloc.reset_peak()
+            sampler = RSSSampler(self.rss_sample_seconds).start()
+        start_time = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            elapsed = time.perf_counter() - start_time
+            if "n_steps" in extra and "timestep_fs" in extra:
+                extra["ns_per_day"] = ns_per_day(
+                    extra["n_steps"], extra["timestep_fs"], elapsed
+                )
+            if sampler is not None:
+                sampler.stop()
+                extra.update(self.get_memory_fields(sampler, start_children_rss))
+            self.record(stage, seconds=elapsed, **extra)
+
+    def get_memory_fields(self, sampler: RSSSampler, start_children_rss: float) -> dict:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        end_rss = get_current_rss_mb()
+        fields = {
+            "peak_rss_mb": sampler.peak_mb,
+            "rss_mb": end_rss,
+            "rss_delta_mb": end_rss - sampler.start_mb,
+            "peak_rss_delta_mb": sampler.peak_mb - sampler.start_mb,
+            "traced_peak_mb": traced_peak / 1024 ** 2,
+            "top_allocations": get_top_allocations(self.n_top_allocations),
+        }
+        # the high-water mark of children only says something about this
+        # stage if a child of this stage raised it
+        children_rss = get_peak_children_rss_mb()
+        if children_rss > start_children_rss:
+            fields["peak_rss_children_mb"] = children_rss
+        return fields
+
+    def record_package_versions(self):
+        return self.record("environment", package_versions=get_package_versions())
+
+
+def find_metrics_files(input_directory: pathlib.Path) -> list[pathlib.Path]:
+    input_directory = pathlib.Path(input_directory)
+    # packing records live in the entry directory,
+    # simulation records in each run subdirectory
+    return sorted(
+        list(input_directory.glob("*/metrics.jsonl"))
+        + list(input_directory.glob("*/*/metrics.jsonl"))
+    )
+
+
+def load_metrics(metrics_file: pathlib.Path) -> list[dict]:
+    records = []
+    with metrics_file.open("r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # a job killed mid-write leaves a truncated last line
+                continue
+    return records
+
+
+class TimedReporter:
+    """
+    Wraps an OpenMM reporter and accumulates the wall time spent in it.
+
+    Reporter I/O happens inside ``Simulation.step``, so this is the only
+    way to separate it out from integration time.
+    """
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self.seconds = 0.0
+        self.n_reports = 0
+
+    def describeNextReport(self, simulation):
+        return self.reporter.describeNextReport(simulation)
+
+    def report(self, simulation, state):
+        start_time = time.perf_counter()
+        self.reporter.report(simulation, state)
+        self.seconds += time.perf_counter() - start_time
+        self.n_reports += 1
@@ -0,0 +1,228 @@
+"""
+Staged energy minimization of freshly packed boxes.
+
+1. Clash relief: steepest descent with per-atom displacements capped,
+   so that a handful of overlapping atoms cannot dominate the step
+   or blow up the box.
+2. L-BFGS with an explicit force tolerance and iteration limit.
+3. Optionally, a brief low-temperature MD run to relax remaining strain.
+
+Each stage is timed and reported through a ``MetricsRecorder``.
+"""
+
+import time
+
+import numpy as np
+import openmm
+from openmm import unit as openmm_unit
+
+from openff.units import unit
+from openff.units.openmm import from_openmm, to_openmm
+from openff.interchange import Interchange
+
+from metrics import MetricsRecorder
+
+KJ_PER_MOL = openmm_unit.kilojoules_per_mole
+KJ_PER_MOL_NM = openmm_unit.kilojoules_per_mole / openmm_unit.nanometer
+
+
+def get_energy_and_max_force(context: openmm.Context) -> tuple[float, float]:
+    state = context.getState(getEnergy=True, getForces=True)
+    forces = state.getForces(asNumpy=True).value_in_unit(KJ_PER_MOL_NM)
+    energy = state.getPotentialEnergy().value_in_unit(KJ_PER_MOL)
+    return energy, float(np.linalg.norm(forces, axis=1).max())
+
+
+def relieve_clashes(
+    context: openmm.Context,
+    max_force: float = 1.0e4,
+    max_displacement: float = 0.01,
+    n_iterations: int = 500,
+    constraint_tolerance: float = 1e-5,
+) -> dict:
+    """
+    Capped-force steepest descent.
+
+    Each atom moves along its force by at most ``max_displacement`` nm;
+    atoms with forces below ``max_force`` move proportionally less.
+    The step is halved whenever the energy goes up and grown again on success.
+
+    Parameters
+    ----------
+    context: openmm.Context
+        Context to minimize in place
+    max_force: float
+        Force cap in kJ/mol/nm. The stage stops once no atom
+        has a force larger than this
+    max_displacement: float
+        Initial largest displacement per step, in nm
+    n_iterations: int
+        Maximum number of steps
+    constraint_tolerance: float
+        Tolerance for re-applying constraints after each step
+    """
+    system = context.getSystem()
+    masses = np.array([
+        system.getParticleMass(i).value_in_unit(openmm_unit.dalton)
+        for i in range(system.getNumParticles())
+    ])
+    # virtual sites are placed by OpenMM, not moved
+    movable = (masses > 0)[:, None]
+
+    state = context.getState(getEnergy=True, getForces=True, getPositions=True)
+    positions = state.getPositions(asNumpy=True).value_in_unit(openmm_unit.nanometer)
+    forces = state.getForces(asNumpy=True).value_in_unit(KJ_PER_MOL_NM)
+    energy = state.getPotentialEnergy().value_in_unit(KJ_PER_MOL)
+    initial_energy = energy
+
+    step_size = max_displacement
+    n_accepted = 0
+    iteration = 0
+    for iteration in range(1, n_iterations + 1):
+        force_norms = np.linalg.norm(forces, axis=1)
+        if force_norms.max() < max_force:
+            break
+        scale = step_size / np.maximum(force_norms, max_force)
+        trial_positions = positions + forces * scale[:, None] * movable
+
+        context.setPositions(trial_positions)
+        context.applyConstraints(constraint_tolerance)
+        trial_state = context.getState(getEnergy=True, getForces=True, getPositions=True)
+        trial_energy = trial_state.getPotentialEnergy().value_in_unit(KJ_PER_MOL)
+
+        if np.isfinite(trial_energy) and trial_energy < energy:
+            positions = trial_state.getPositions(asNumpy=True).value_in_unit(openmm_unit.nanometer)
+            forces = trial_state.getForces(asNumpy=True).value_in_unit(KJ_PER_MOL_NM)
+            energy = trial_energy
+            step_size = min(step_size * 1.2, max_displacement)
+            n_accepted += 1
+        else:
+            step_size *= 0.5
+            if step_size < 1e-6:
+                break
+
+        if iteration % 50 == 0:
+            print(
+                f"Clash relief iteration {iteration}: energy {energy:.1f} kJ/mol, "
+                f"max force {force_norms.max():.1f} kJ/mol/nm"
+            )
+
+    # leave the context at the best accepted positions
+    context.setPositions(positions)
+    return {
+        "initial_energy": initial_energy,
+        "n_iterations": iteration,
+        "n_accepted": n_accepted,
+    }
+
+
+def staged_minimize(
+    interchange: Interchange,
+    metrics: MetricsRecorder = None,
+    clash_max_force: float = 1.0e4,
+    n_clash_iterations: int = 500,
+    tolerance: float = 10.0,
+    max_iterations: int = 10000,
+    n_md_steps: int = 0,
+    md_temperature: unit.Quantity = 50.0 * unit.kelvin,
+    md_timestep: unit.Quantity = 1.0 * unit.femtoseconds,
+    platform: openmm.Platform = None,
+) -> list[dict]:
+    """
+    Minimize ``interchange`` in place and return a record of each stage.
+
+    Parameters
+    ----------
+    interchange: Interchange
+        Interchange with positions and box to minimize
+    metrics: MetricsRecorder
+        Optional recorder for the timing of each stage
+    clash_max_force: float
+        Force cap of the clash-relief stage, in kJ/mol/nm
+    n_clash_iterations: int
+        Maximum number of clash-relief steps; 0 to skip the stage
+    tolerance: float
+        Force tolerance of the L-BFGS stage, in kJ/mol/nm
+    max_iterations: int
+        Maximum number of L-BFGS iterations; 0 runs to convergence
+    n_md_steps: int
+        Number of low-temperature MD steps; 0 to skip the stage
+    md_temperature: unit.Quantity
+        Temperature of the MD stage
+    md_timestep: unit.Quantity
+        Timestep of the MD stage
+    platform: openmm.Platform
+        Platform to minimize on. OpenMM picks the fastest if not given
+    """
+    if metrics is None:
+        metrics = MetricsRecorder()
+
+    system = interchange.to_openmm_system()
+    integrator = openmm.LangevinMiddleIntegrator(
+        to_openmm(md_temperature),
+        1.0 / openmm_unit.picosecond,
+        to_openmm(md_timestep),
+    )
+    if platform is None:
+        context = openmm.Context(system, integrator)
+    else:
+        context = openmm.Context(system, integrator, platform)
+    context.setPeriodicBoxVectors(*to_openmm(interchange.box))
+    context.setPositions(to_openmm(interchange.positions))
+
+    stages = []
+
+    def run_stage(stage: str, function, **fields):
+        start_time = time.perf_counter()
+        with metrics.timed(stage, **fields) as record:
+            record.update(function() or {})
+            energy, max_force = get_energy_and_max_force(context)
+            record.update(final_energy=energy, final_max_force=max_force)
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{stage}: energy {energy:.1f} kJ/mol, max force {max_force:.1f} kJ/mol/nm "
+            f"({elapsed:.1f} s)"
+        )
+        stages.append({"stage": stage, "seconds": elapsed, **record})
+
+    energy, max_force = get_energy_and_max_force(context)
+    print(f"Initial: energy {energy:.1f} kJ/mol, max force {max_force:.1f} kJ/mol/nm")
+
+    if n_clash_iterations > 0:
+        run_stage(
+            "minimize-clash-relief",
+            lambda: relieve_clashes(
+                context,
+                max_force=clash_max_force,
+                n_iterations=n_clash_iterations,
+            ),
+            max_force=clash_max_force,
+        )
+
+    run_stage(
+        "minimize-lbfgs",
+        lambda: openmm.LocalEnergyMinimizer.minimize(
+            context,
+            tolerance * KJ_PER_MOL_NM,
+            max_iterations,
+        ),
+        tolerance=tolerance,
+        max_iterations=max_iterations,
+    )
+
+    if n_md_steps > 0:
+        def run_md():
+            context.setVelocitiesToTemperature(to_openmm(md_temperature))
+            integrator.step(n_md_steps)
+
+        run_stage(
+            "minimize-md",
+            run_md,
+            n_steps=n_md_steps,
+            timestep_fs=md_timestep.m_as(unit.femtoseconds),
+            temperature=md_temperature.m_as(unit.kelvin),
+        )
+
+    state = context.getState(getPositions=True)
+    interchange.positions = from_openmm(state.getPositions(asNumpy=True))
+    return stages
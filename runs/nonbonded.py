@@ -0,0 +1,247 @@
+"""
+Tuning of the PME parameters for throughput at a fixed force accuracy.
+
+Nonbonded forces of each candidate setting are compared against a
+high-accuracy reference (the force field's own cutoff with a tight Ewald
+error tolerance) for a few snapshots of the box, and the fastest
+candidate within the error budget is chosen. The cutoff is a force-field
+parameter, so it is only changed if other cutoffs are asked for.
+"""
+
+import itertools
+import math
+
+import numpy as np
+import openmm
+from openmm import unit as openmm_unit
+
+from platforms import benchmark_configuration
+
+KJ_PER_MOL_NM = openmm_unit.kilojoules_per_mole / openmm_unit.nanometer
+# force group of the nonbonded forces when comparing forces
+NONBONDED_GROUP = 1
+
+
+def get_nonbonded_force(system: openmm.System) -> openmm.NonbondedForce:
+    for force in system.getForces():
+        if isinstance(force, openmm.NonbondedForce):
+            return force
+    raise ValueError("System has no NonbondedForce")
+
+
+def get_nonbonded_settings(system: openmm.System) -> dict:
+    force = get_nonbonded_force(system)
+    alpha, nx, ny, nz = force.getPMEParameters()
+    return {
+        "cutoff": force.getCutoffDistance().value_in_unit(openmm_unit.nanometer),
+        "ewald_error_tolerance": force.getEwaldErrorTolerance(),
+        "pme_grid": [nx, ny, nz] if nx else None,
+    }
+
+
+def get_pme_parameters(
+    cutoff: float,
+    ewald_error_tolerance: float,
+    box_lengths: list[float],
+) -> tuple[float, list[int]]:
+    """Ewald alpha and grid dimensions as OpenMM chooses them, lengths in nm"""
+    alpha = math.sqrt(-math.log(2 * ewald_error_tolerance)) / cutoff
+    grid = [
+        int(math.ceil(2 * alpha * length / (3 * ewald_error_tolerance ** 0.2)))
+        for length in box_lengths
+    ]
+    return alpha, grid
+
+
+def apply_nonbonded_settings(system: openmm.System, settings: dict):
+    """
+    Set cutoff, Ewald error tolerance and optionally explicit PME grid
+    dimensions on every nonbonded force of ``system`` in place.
+
+    The switching distance keeps its offset from the cutoff.
+    """
+    cutoff = settings["cutoff"]
+    for force in system.getForces():
+        if not isinstance(force, (openmm.NonbondedForce, openmm.CustomNonbondedForce)):
+            continue
+        old_cutoff = force.getCutoffDistance().value_in_unit(openmm_unit.nanometer)
+        if force.getUseSwitchingFunction():
+            switch_width = old_cutoff - force.getSwitchingDistance().value_in_unit(openmm_unit.nanometer)
+            force.setSwitchingDistance(max(cutoff - switch_width, 0) * openmm_unit.nanometer)
+        force.setCutoffDistance(cutoff * openmm_unit.nanometer)
+
+    force = get_nonbonded_force(system)
+    force.setEwaldErrorTolerance(settings["ewald_error_tolerance"])
+    if settings.get("pme_grid"):
+        alpha = settings.get("alpha")
+        if alpha is None:
+            alpha = math.sqrt(-math.log(2 * settings["ewald_error_tolerance"])) / cutoff
+        force.setPMEParameters(alpha, *settings["pme_grid"])
+    else:
+        # let OpenMM choose from the tolerance
+        force.setPMEParameters(0, 0, 0, 0)
+
+
+def set_nonbonded_group(system: openmm.System):
+    """Put the nonbonded forces of ``system`` in ``NONBONDED_GROUP`` and all others in group 0"""
+    for force in system.getForces():
+        is_nonbonded = isinstance(force, (openmm.NonbondedForce, openmm.CustomNonbondedForce))
+        force.setForceGroup(NONBONDED_GROUP if is_nonbonded else 0)
+
+
+def compute_forces(
+    system: openmm.System,
+    snapshots: list[tuple],
+    platform_name: str = "CPU",
+    platform_properties: dict = None,
+    groups: set[int] = None,
+) -> list[np.ndarray]:
+    """Forces of each snapshot, from the force groups ``groups`` or all forces"""
+    integrator = openmm.VerletIntegrator(1.0 * openmm_unit.femtoseconds)
+    platform = openmm.Platform.getPlatformByName(platform_name)
+    context = openmm.Context(system, integrator, platform, platform_properties or {})
+    forces = []
+    for positions, box_vectors in snapshots:
+        context.setPeriodicBoxVectors(*box_vectors)
+        context.setPositions(positions)
+        if groups is None:
+            state = context.getState(getForces=True)
+        else:
+            state = context.getState(getForces=True, groups=groups)
+        forces.append(state.getForces(asNumpy=True).value_in_unit(KJ_PER_MOL_NM))
+    del context
+    return forces
+
+
+def get_relative_force_error(forces: list[np.ndarray], reference: list[np.ndarray]) -> float:
+    """RMS force error relative to the RMS reference force, over all snapshots"""
+    difference = np.concatenate(forces) - np.concatenate(reference)
+    reference = np.concatenate(reference)
+    return float(
+        np.sqrt(np.mean(np.sum(difference ** 2, axis=1)))
+        / np.sqrt(np.mean(np.sum(reference ** 2, axis=1)))
+    )
+
+
+def tune_nonbonded(
+    system: openmm.System,
+    integrator: openmm.Integrator,
+    snapshots: list[tuple],
+    max_error: float = 5e-4,
+    cutoffs: list[float] = None,
+    ewald_error_tolerances: list[float] = (1e-4, 5e-4, 1e-3),
+    grid_scales: list[float] = (None, 0.8, 0.9),
+    reference_tolerance: float = 1e-6,
+    platform_name: str = "CPU",
+    platform_properties: dict = None,
+    n_benchmark_steps: int = 300,
+) -> dict:
+    """
+    Fastest nonbonded settings whose forces stay within ``max_error``
+    of the reference.
+
+    Parameters
+    ----------
+    system: openmm.System
+        System to tune; it is not modified
+    integrator: openmm.Integrator
+        Integrator used to benchmark each candidate
+    snapshots: list[tuple]
+        (positions, box vectors) pairs to compute forces for
+    max_error: float
+        Largest allowed RMS nonbonded force error relative to the RMS
+        reference nonbonded force
+    cutoffs: list[float]
+        Candidate cutoffs in nm. None keeps the force field's cutoff; the
+        cutoff is a force-field parameter, so other values change the
+        physics and not only the accuracy
+    ewald_error_tolerances: list[float]
+        Candidate Ewald error tolerances
+    grid_scales: list[float]
+        Candidate scale factors of the PME grid OpenMM would choose;
+        None leaves the grid to OpenMM
+    reference_tolerance: float
+        Ewald error tolerance of the reference, at the system's own cutoff
+    platform_name: str
+        Platform for force evaluations and benchmarks
+    platform_properties: dict
+        Properties of the platform
+    n_benchmark_steps: int
+        Number of steps to time each candidate for
+    """
+    original = get_nonbonded_settings(system)
+    if not cutoffs:
+        cutoffs = [original["cutoff"]]
+    # bonded forces are exact and much larger, so only nonbonded forces are compared
+    system = openmm.XmlSerializer.clone(system)
+    set_nonbonded_group(system)
+    reference_system = openmm.XmlSerializer.clone(system)
+    apply_nonbonded_settings(
+        reference_system,
+        {"cutoff": original["cutoff"], "ewald_error_tolerance": reference_tolerance},
+    )
+    reference_forces = compute_forces(
+        reference_system, snapshots, platform_name, platform_properties, groups={NONBONDED_GROUP}
+    )
+    # the grid is sized for the largest box among the snapshots
+    box_lengths = np.max([
+        [vector[i].value_in_unit(openmm_unit.nanometer) for i, vector in enumerate(box_vectors)]
+        for _, box_vectors in snapshots
+    ], axis=0)
+
+    positions, box_vectors = snapshots[-1]
+    candidates = []
+    for cutoff, tolerance, grid_scale in itertools.product(
+        cutoffs, ewald_error_tolerances, grid_scales
+    ):
+        settings = {"cutoff": cutoff, "ewald_error_tolerance": tolerance}
+        if grid_scale is not None:
+            alpha, grid = get_pme_parameters(cutoff, tolerance, box_lengths)
+            settings["alpha"] = alpha
+            settings["pme_grid"] = [max(int(math.ceil(n * grid_scale)), 1) for n in grid]
+
+        candidate_system = openmm.XmlSerializer.clone(system)
+        apply_nonbonded_settings(candidate_system, settings)
+        try:
+            forces = compute_forces(
+                candidate_system, snapshots, platform_name, platform_properties, groups={NONBONDED_GROUP}
+            )
+            error = get_relative_force_error(forces, reference_forces)
+            steps_per_second = math.nan
+            if error <= max_error:
+                steps_per_second = benchmark_configuration(
+                    candidate_system,
+                    integrator,
+                    positions,
+                    box_vectors,
+                    platform_name,
+                    platform_properties or {},
+                    n_steps=n_benchmark_steps,
+                )
+        except openmm.OpenMMException as e:
+            print(f"Failed to evaluate {settings}: {e}")
+            continue
+        print(f"{settings}: error {error:.2e}, {steps_per_second:.1f} steps/s")
+        candidates.append({
+            **settings,
+            "relative_force_error": error,
+            "steps_per_second": steps_per_second,
+        })
+
+    accepted = [c for c in candidates if c["relative_force_error"] <= max_error]
+    if not accepted:
+        raise RuntimeError(f"No candidate is within the error budget of {max_error}")
+    best = max(accepted, key=lambda c: c["steps_per_second"])
+    settings = {
+        key: best[key]
+        for key in ["cutoff", "ewald_error_tolerance", "alpha", "pme_grid"]
+        if key in best
+    }
+    return {
+        "settings": settings,
+        "original": original,
+        "max_error": max_error,
+        "reference_tolerance": reference_tolerance,
+        "platform": platform_name,
+        "candidates": candidates,
+    }
@@ -6,11 +6,8 @@ import tqdm
 import os
 
 from openff.units import unit
-from openff.units.openmm import from_openmm
-from openmm import NonbondedForce
-from openff.toolkit import Molecule, Topology, ForceField
-from openff.interchange.components._packmol import pack_box, UNIT_CUBE
-from openff.interchange import Interchange
+
+from metrics import MetricsRecorder
 
 TARGET_DENSITY = 0.95 * unit.grams / unit.mL
 
@@ -43,12 +40,22 @@ TARGET_DENSITY = 0.95 * unit.grams / unit.mL
     type=int,
     help="Index",
 )
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    help="Record peak RSS and top tracemalloc allocators per stage",
+)
 def main(
     input_file: str,
     force_field: str,
     output_directory: str,
     index: int,
+    profile_memory: bool = False,
 ):
+    from openff.toolkit import Molecule, ForceField
+    from openff.interchange.components._packmol import pack_box, UNIT_CUBE
+    from openff.interchange import Interchange
+
     with open(input_file, "r") as f:
         data = json.load(f)
 
@@ -74,38 +81,48 @@ def main(
     entry_directory.mkdir(parents=True, exist_ok=True)
 
     os.chdir(str(entry_directory))
-    
+    metrics = MetricsRecorder(
+        "metrics.jsonl",
+        profile_memory=profile_memory,
+        entry=entry_directory.name,
+    )
+    metrics.record_package_versions()
+
     start_time = time.time()
-    try:
-        solvated_topology = pack_box(
-            molecules=mols,
-            number_of_copies=n_molecules,
-            solute=solute,
-            target_density=TARGET_DENSITY,
-            box_shape=UNIT_CUBE,
-            center_solute=True,
-            working_directory=".",
-            retain_working_files=True,
-        )
-    except Exception as e:
-        print(f"Failed to pack box {i:04d}")
-        error_file =  "error.txt"
-        with open(error_file, "w") as f:
-            f.write(str(e))
+    with metrics.timed("packing", n_molecules=sum(n_molecules)):
+        try:
+            solvated_topology = pack_box(
+                molecules=mols,
+                number_of_copies=n_molecules,
+                solute=solute,
+                target_density=TARGET_DENSITY,
+                box_shape=UNIT_CUBE,
+                center_solute=True,
+                working_directory=".",
+                retain_working_files=True,
+            )
+        except Exception as e:
+            print(f"Failed to pack box {i:04d}")
+            error_file =  "error.txt"
+            with open(error_file, "w") as f:
+                f.write(str(e))
 
     end_time = time.time()
     difference = end_time - start_time
     print(f"Entry {i}: {difference}")
 
-    interchange = Interchange.from_smirnoff(force_field, solvated_topology)
+    with metrics.timed("parameterization") as record:
+        interchange = Interchange.from_smirnoff(force_field, solvated_topology)
+        record["n_atoms"] = interchange.topology.n_atoms
+
+    with metrics.timed("serialize"):
+        serialized_file = "interchange.json"
+        with open(serialized_file, "w") as f:
+            f.write(interchange.json())
 
-    serialized_file = "interchange.json"
-    with open(serialized_file, "w") as f:
-        f.write(interchange.json())
-    
-    interchange.to_pdb("input.pdb")
-    interchange.to_gro("input.gro")
-    interchange.to_top("system.top")
+        interchange.to_pdb("input.pdb")
+        interchange.to_gro("input.gro")
+        interchange.to_top("system.top")
 
     timing = {"time": difference}
     with open("time.json", "w") as f:
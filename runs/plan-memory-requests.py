@@ -0,0 +1,189 @@
+"""
+Turn peak memory measurements from ``--profile-memory`` runs
+into per-entry SLURM memory requests.
+
+Entries are grouped into memory buckets and one ``sbatch`` command
+is printed per bucket, overriding the ``--mem`` and ``--array``
+directives of the submission script.
+Entries without measurements are predicted from a linear fit
+of peak memory against the number of atoms.
+"""
+
+import pathlib
+
+import click
+import numpy as np
+import pandas as pd
+
+from metrics import find_metrics_files, load_metrics
+
+# the packing job writes its records to the entry directory,
+# the simulation job writes them to the run subdirectory
+JOB_STAGES = {
+    "packing": ["packing", "parameterization", "serialize"],
+    "simulation": ["parse-interchange", "minimize", "serialize", "context-creation", "md", "plotting"],
+}
+
+
+def compress_indices(indices: list[int]) -> str:
+    """Format indices as a SLURM array specification, e.g. 0-3,7,9-10"""
+    ranges = []
+    indices = sorted(set(indices))
+    start = previous = indices[0]
+    for index in indices[1:]:
+        if index == previous + 1:
+            previous = index
+            continue
+        ranges.append(f"{start}-{previous}" if previous > start else f"{start}")
+        start = previous = index
+    ranges.append(f"{start}-{previous}" if previous > start else f"{start}")
+    return ",".join(ranges)
+
+
+def load_peak_memory(input_directory: pathlib.Path, job: str) -> pd.DataFrame:
+    rows = []
+    for metrics_file in find_metrics_files(input_directory):
+        is_run = not metrics_file.parent.name.startswith("entry-")
+        if is_run != (job == "simulation"):
+            continue
+        for record in load_metrics(metrics_file):
+            if record["stage"] not in JOB_STAGES[job]:
+                continue
+            rows.append({
+                "entry": record.get("entry"),
+                "n_atoms": record.get("n_atoms", np.nan),
+                "peak_rss_mb": record.get("peak_rss_mb", np.nan),
+                "peak_rss_children_mb": record.get("peak_rss_children_mb", 0.0),
+            })
+    df = pd.DataFrame(rows, columns=["entry", "n_atoms", "peak_rss_mb", "peak_rss_children_mb"])
+    # packmol runs as a child process, so both high-water marks count
+    df["peak_mb"] = df.peak_rss_mb + df.peak_rss_children_mb.fillna(0)
+    return df.groupby("entry").agg(
+        n_atoms=("n_atoms", "max"),
+        peak_mb=("peak_mb", "max"),
+    ).reset_index()
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing entry-* subdirectories",
+)
+@click.option(
+    "--job",
+    "-j",
+    default="simulation",
+    type=click.Choice(list(JOB_STAGES)),
+    help="Which job to plan memory for",
+)
+@click.option(
+    "--n-entries",
+    "-n",
+    default=1449,
+    type=int,
+    help="Total number of entries in the array",
+)
+@click.option(
+    "--headroom",
+    default=0.25,
+    type=float,
+    help="Fraction of extra memory to request on top of the measured peak",
+)
+@click.option(
+    "--minimum-gb",
+    default=2,
+    type=int,
+    help="Minimum memory request in GB",
+)
+@click.option(
+    "--default-gb",
+    default=16,
+    type=int,
+    help="Memory request in GB for entries that can be neither measured nor predicted",
+)
+@click.option(
+    "--script",
+    "-s",
+    default="run-simulate-general-middle.sh",
+    type=str,
+    help="Submission script to print sbatch commands for",
+)
+@click.option(
+    "--max-concurrent",
+    default=30,
+    type=int,
+    help="Maximum number of concurrently running array tasks",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="memory-requests.csv",
+    type=str,
+    help="Output file of per-entry memory requests",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    job: str = "simulation",
+    n_entries: int = 1449,
+    headroom: float = 0.25,
+    minimum_gb: int = 2,
+    default_gb: int = 16,
+    script: str = "run-simulate-general-middle.sh",
+    max_concurrent: int = 30,
+    output_file: str = "memory-requests.csv",
+):
+    input_directory = pathlib.Path(input_directory)
+    measured = load_peak_memory(input_directory, job)
+    print(f"Loaded peak memory for {len(measured)} entries")
+
+    entries = pd.DataFrame({"index": np.arange(n_entries)})
+    entries["entry"] = [f"entry-{i:04d}" for i in entries["index"]]
+    entries = entries.merge(measured, on="entry", how="left")
+
+    # n_atoms is only recorded by the profiled jobs themselves,
+    # so fall back to the packing records for prediction
+    if job == "simulation":
+        packing = load_peak_memory(input_directory, "packing")[["entry", "n_atoms"]]
+        entries = entries.merge(packing, on="entry", how="left", suffixes=("", "_packing"))
+        entries["n_atoms"] = entries.n_atoms.fillna(entries.n_atoms_packing)
+        entries = entries.drop(columns=["n_atoms_packing"])
+
+    entries["source"] = np.where(entries.peak_mb.notna(), "measured", "default")
+    fit_data = entries[entries.peak_mb.notna() & entries.n_atoms.notna()]
+    if len(fit_data) >= 2:
+        slope, intercept = np.polyfit(fit_data.n_atoms, fit_data.peak_mb, 1)
+        # predict conservatively from the worst residual
+        residual = (fit_data.peak_mb - (slope * fit_data.n_atoms + intercept)).max()
+        predictable = entries.peak_mb.isna() & entries.n_atoms.notna()
+        entries.loc[predictable, "peak_mb"] = (
+            slope * entries.loc[predictable, "n_atoms"] + intercept + residual
+        )
+        entries.loc[predictable, "source"] = "predicted"
+        print(f"Fit: peak_mb = {slope:.4f} * n_atoms + {intercept:.1f} (+{residual:.1f})")
+
+    requested = np.ceil(entries.peak_mb * (1 + headroom) / 1024)
+    entries["mem_gb"] = requested.clip(lower=minimum_gb).fillna(default_gb).astype(int)
+    entries.to_csv(output_file, index=False)
+    print(entries.groupby("source").mem_gb.describe().to_string())
+    print(f"Saved to {output_file}")
+
+    # one array submission per memory bucket
+    for mem_gb, bucket in entries.groupby("mem_gb"):
+        array = compress_indices(bucket["index"].tolist())
+        n_concurrent = min(max_concurrent, len(bucket))
+        print(f"sbatch --mem={mem_gb}gb --array={array}%{n_concurrent} {script}")
+
+    total_default = default_gb * len(entries)
+    total_planned = entries.mem_gb.sum()
+    print(
+        f"Total requested memory: {total_planned} GB "
+        f"(vs {total_default} GB at {default_gb} GB each, "
+        f"{total_default / max(total_planned, 1):.1f}x more tasks per node by memory)"
+    )
+
+
+if __name__ == "__main__":
+    main()
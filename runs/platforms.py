@@ -0,0 +1,239 @@
+"""
+Benchmark-driven choice of OpenMM platform and platform properties.
+
+Candidate configurations are timed for a few hundred steps of the
+actual system, and the fastest is cached per hardware fingerprint and
+system size so that later entries on the same kind of node skip the
+benchmark. GPU platforms are only tried in mixed precision unless single
+precision is allowed, so that a benchmark never silently changes the
+numerics of production runs.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import time
+
+import openmm
+from openmm import unit as openmm_unit
+
+from reporters import write_json_atomic
+
+DEFAULT_CACHE_FILE = pathlib.Path(
+    os.environ.get(
+        "INTERCHANGE_SIMULATIONS_CACHE",
+        pathlib.Path.home() / ".cache" / "interchange-simulations",
+    )
+) / "platform-cache.json"
+
+GPU_PLATFORMS = ["CUDA", "HIP", "OpenCL"]
+
+
+def get_available_cpus() -> int:
+    # respects SLURM's --cpus-per-task, unlike os.cpu_count
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_gpu_names() -> list[str]:
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    names = [line.strip() for line in output.splitlines() if line.strip()]
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible:
+        indices = [int(i) for i in visible.split(",") if i.strip().isdigit()]
+        names = [names[i] for i in indices if i < len(names)]
+    return names
+
+
+def get_cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return ""
+
+
+def get_hardware_fingerprint() -> dict:
+    hardware = {
+        "cpu": get_cpu_model(),
+        "n_cpus": get_available_cpus(),
+        "gpus": get_gpu_names(),
+        "openmm": openmm.__version__,
+    }
+    hardware["hash"] = hashlib.sha1(
+        json.dumps(hardware, sort_keys=True).encode()
+    ).hexdigest()[:16]
+    return hardware
+
+
+def get_size_bucket(n_particles: int) -> int:
+    """Round to two significant figures so similar boxes share a cache entry"""
+    return int(float(f"{n_particles:.2g}"))
+
+
+def get_candidate_configurations(
+    n_threads: int = None,
+    allow_single_precision: bool = False,
+) -> list[dict]:
+    available = [
+        openmm.Platform.getPlatform(i).getName()
+        for i in range(openmm.Platform.getNumPlatforms())
+    ]
+    precisions = ["mixed", "single"] if allow_single_precision else ["mixed"]
+    candidates = []
+    for name in GPU_PLATFORMS:
+        if name not in available:
+            continue
+        for precision in precisions:
+            candidates.append({"platform": name, "properties": {"Precision": precision}})
+            if name != "OpenCL":
+                candidates.append({
+                    "platform": name,
+                    "properties": {"Precision": precision, "DeterministicForces": "true"},
+                })
+
+    if "CPU" in available:
+        n_threads = n_threads or get_available_cpus()
+        thread_counts = []
+        while n_threads >= 1:
+            thread_counts.append(n_threads)
+            n_threads //= 2
+        for threads in thread_counts:
+            candidates.append({"platform": "CPU", "properties": {"Threads": str(threads)}})
+    return candidates
+
+
+def get_context_precision(context: openmm.Context) -> str:
+    """Precision of a Context, or None if its platform has no choice of precision"""
+    platform = context.getPlatform()
+    if "Precision" not in platform.getPropertyNames():
+        return None
+    return platform.getPropertyValue(context, "Precision")
+
+
+def benchmark_configuration(
+    system: openmm.System,
+    integrator: openmm.Integrator,
+    positions,
+    box_vectors,
+    platform_name: str,
+    properties: dict,
+    n_steps: int = 300,
+    n_warmup_steps: int = 20,
+) -> float:
+    """Steps per second of ``system`` with the given configuration"""
+    integrator = openmm.XmlSerializer.clone(integrator)
+    platform = openmm.Platform.getPlatformByName(platform_name)
+    context = openmm.Context(system, integrator, platform, properties)
+    try:
+        context.setPeriodicBoxVectors(*box_vectors)
+        context.setPositions(positions)
+        context.setVelocitiesToTemperature(300 * openmm_unit.kelvin)
+        # the first steps include kernel compilation
+        integrator.step(n_warmup_steps)
+        context.getState(getEnergy=True)
+        start_time = time.perf_counter()
+        integrator.step(n_steps)
+        # fetching a state waits for the queued steps to finish
+        context.getState(getEnergy=True)
+        return n_steps / (time.perf_counter() - start_time)
+    finally:
+        del context, integrator
+
+
+@contextlib.contextmanager
+def locked_cache(cache_file: pathlib.Path):
+    cache_file = pathlib.Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = cache_file.with_name(f".{cache_file.name}.lock")
+    with lock_file.open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = {}
+        if cache_file.exists():
+            with cache_file.open("r") as f:
+                cache = json.load(f)
+        yield cache
+        write_json_atomic(cache, cache_file)
+
+
+def select_platform(
+    system: openmm.System,
+    integrator: openmm.Integrator,
+    positions,
+    box_vectors,
+    cache_file: pathlib.Path = DEFAULT_CACHE_FILE,
+    n_steps: int = 300,
+    n_threads: int = None,
+    refresh: bool = False,
+    allow_single_precision: bool = False,
+) -> dict:
+    """
+    Fastest platform configuration for ``system``, from the cache
+    or by benchmarking every candidate. Single precision is only
+    a candidate if ``allow_single_precision``.
+
+    Returns a dictionary with the ``platform`` name, its ``properties``
+    and the benchmark results.
+    """
+    hardware = get_hardware_fingerprint()
+    precisions = "mixed-single" if allow_single_precision else "mixed"
+    key = f"{hardware['hash']}-{get_size_bucket(system.getNumParticles())}-{precisions}"
+
+    if not refresh:
+        with locked_cache(cache_file) as cache:
+            if key in cache:
+                print(f"Using cached platform {cache[key]['platform']} for {key}")
+                return cache[key]
+
+    results = []
+    for candidate in get_candidate_configurations(n_threads, allow_single_precision):
+        try:
+            steps_per_second = benchmark_configuration(
+                system,
+                integrator,
+                positions,
+                box_vectors,
+                candidate["platform"],
+                candidate["properties"],
+                n_steps=n_steps,
+            )
+        except Exception as e:
+            print(f"Failed to benchmark {candidate}: {e}")
+            continue
+        print(f"{candidate}: {steps_per_second:.1f} steps/s")
+        results.append({**candidate, "steps_per_second": steps_per_second})
+
+    if not results:
+        raise RuntimeError("No platform configuration could be benchmarked")
+
+    best = max(results, key=lambda result: result["steps_per_second"])
+    selection = {
+        "platform": best["platform"],
+        "properties": best["properties"],
+        "steps_per_second": best["steps_per_second"],
+        "n_particles": system.getNumParticles(),
+        "hardware": hardware,
+        "benchmarks": results,
+    }
+    with locked_cache(cache_file) as cache:
+        cache[key] = selection
+    print(f"Selected {best['platform']} {best['properties']}")
+    return selection
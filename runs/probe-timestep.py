@@ -0,0 +1,125 @@
+"""
+Find the largest stable timestep, with and without HMR,
+for the box in an entry directory.
+
+Probes run on the CPU platform so they can go ahead of, or alongside,
+the GPU jobs. The selection is written to ``timestep-probe.json``,
+which ``simulate-general-middle.py --timestep-from-probe`` reads.
+"""
+
+import json
+import pathlib
+
+import click
+
+from openff.interchange import Interchange
+
+from metrics import MetricsRecorder
+from stability import select_timestep
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default=".",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Entry directory containing interchange.json",
+)
+@click.option(
+    "--timesteps",
+    "-dt",
+    default="2.0,2.5,3.0,3.5,4.0",
+    type=str,
+    help="Comma-separated timesteps to probe, in fs",
+)
+@click.option(
+    "--hydrogen-masses",
+    "-hm",
+    default="1,3",
+    type=str,
+    help="Comma-separated hydrogen mass multipliers to probe",
+)
+@click.option(
+    "--n-steps",
+    default=2000,
+    type=int,
+    help="Number of constant-energy steps per probe",
+)
+@click.option(
+    "--n-thermalization-steps",
+    default=500,
+    type=int,
+    help="Number of Langevin steps before each probe",
+)
+@click.option(
+    "--max-drift",
+    default=0.02,
+    type=float,
+    help="Largest allowed energy drift in kT/ns per degree of freedom",
+)
+@click.option(
+    "--n-threads",
+    default=None,
+    type=int,
+    help="CPU threads; defaults to OpenMM's choice",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="timestep-probe.json",
+    type=str,
+    help="Output file, relative to the input directory",
+)
+def main(
+    input_directory: str = ".",
+    timesteps: str = "2.0,2.5,3.0,3.5,4.0",
+    hydrogen_masses: str = "1,3",
+    n_steps: int = 2000,
+    n_thermalization_steps: int = 500,
+    max_drift: float = 0.02,
+    n_threads: int = None,
+    output_file: str = "timestep-probe.json",
+):
+    input_directory = pathlib.Path(input_directory)
+    metrics = MetricsRecorder(
+        input_directory / "metrics.jsonl",
+        entry=input_directory.resolve().name,
+    )
+
+    with metrics.timed("parse-interchange"):
+        interchange = Interchange.parse_file(input_directory / "interchange.json")
+
+    print("Minimizing...")
+    with metrics.timed("minimize"):
+        interchange.minimize(max_iterations=0)
+
+    platform_properties = {}
+    if n_threads:
+        platform_properties["Threads"] = str(n_threads)
+
+    with metrics.timed("timestep-probe") as record:
+        selection = select_timestep(
+            interchange,
+            timesteps=[float(x) for x in timesteps.split(",")],
+            hydrogen_masses=[float(x) for x in hydrogen_masses.split(",")],
+            max_drift=max_drift,
+            n_steps=n_steps,
+            n_thermalization_steps=n_thermalization_steps,
+            platform_name="CPU",
+            platform_properties=platform_properties,
+        )
+        record["timestep_fs"] = selection["timestep_fs"]
+        record["hydrogen_mass"] = selection["hydrogen_mass"]
+
+    with (input_directory / output_file).open("w") as f:
+        json.dump(selection, f, indent=2)
+    print(
+        f"Selected dt={selection['timestep_fs']} fs, "
+        f"hydrogen mass x{selection['hydrogen_mass']}"
+    )
+    print(f"Saved to {input_directory / output_file}")
+
+
+if __name__ == "__main__":
+    main()
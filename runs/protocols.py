@@ -0,0 +1,115 @@
+"""
+Accelerated pre-equilibration before standard NPT equilibration.
+
+Boxes are packed at a low target density and the Monte Carlo barostat
+then takes millions of steps to walk the density to its equilibrium
+value, particularly for viscous liquids. The pre-equilibration schedule
+starts hot, compressed and with barostat moves attempted every step,
+and anneals linearly back to the target temperature, pressure and
+barostat frequency over a number of stages.
+"""
+
+import numpy as np
+import openmm
+import openmm.app
+import tqdm
+
+from openff.units import unit
+from openff.units.openmm import to_openmm
+
+
+def get_annealing_schedule(
+    n_steps: int,
+    temperature: unit.Quantity = 298.15 * unit.kelvin,
+    pressure: unit.Quantity = 1.0 * unit.atmospheres,
+    n_barostat_steps: int = 25,
+    annealing_temperature: unit.Quantity = 400.0 * unit.kelvin,
+    compression_pressure: unit.Quantity = 500.0 * unit.atmospheres,
+    initial_barostat_steps: int = 1,
+    n_stages: int = 10,
+) -> list[dict]:
+    """
+    Stages decaying from hot, compressed and frequent barostat moves
+    to the production conditions.
+
+    Temperature and pressure decay linearly, the barostat frequency
+    grows geometrically. The last stage is at the target conditions.
+    """
+    n_stages = max(min(n_stages, n_steps), 1)
+    fractions = np.linspace(0, 1, n_stages) if n_stages > 1 else np.ones(1)
+    temperatures = annealing_temperature + (temperature - annealing_temperature) * fractions
+    pressures = compression_pressure + (pressure - compression_pressure) * fractions
+    frequencies = np.geomspace(initial_barostat_steps, n_barostat_steps, n_stages)
+
+    stage_steps = [n_steps // n_stages] * n_stages
+    stage_steps[-1] += n_steps - sum(stage_steps)
+
+    schedule = []
+    for i in range(n_stages):
+        schedule.append({
+            "n_steps": stage_steps[i],
+            "temperature": temperatures[i],
+            "pressure": pressures[i],
+            "n_barostat_steps": int(round(frequencies[i])),
+        })
+    return schedule
+
+
+def get_barostat(system: openmm.System) -> openmm.MonteCarloBarostat:
+    for force in system.getForces():
+        if isinstance(force, openmm.MonteCarloBarostat):
+            return force
+    raise ValueError("System has no MonteCarloBarostat")
+
+
+def set_conditions(
+    simulation: openmm.app.Simulation,
+    temperature: unit.Quantity,
+    pressure: unit.Quantity,
+    n_barostat_steps: int = None,
+):
+    """
+    Change the thermostat and barostat of a running simulation.
+
+    Temperature and pressure are Context parameters; a new barostat
+    frequency needs the Context to be reinitialized, which preserves state.
+    """
+    barostat = get_barostat(simulation.system)
+    barostat.setDefaultTemperature(to_openmm(temperature))
+    barostat.setDefaultPressure(to_openmm(pressure))
+    if n_barostat_steps is not None and n_barostat_steps != barostat.getFrequency():
+        barostat.setFrequency(n_barostat_steps)
+        simulation.context.reinitialize(preserveState=True)
+
+    simulation.integrator.setTemperature(to_openmm(temperature))
+    simulation.context.setParameter(
+        openmm.MonteCarloBarostat.Temperature(),
+        temperature.m_as(unit.kelvin),
+    )
+    simulation.context.setParameter(
+        openmm.MonteCarloBarostat.Pressure(),
+        pressure.m_as(unit.bar),
+    )
+
+
+def run_schedule(
+    simulation: openmm.app.Simulation,
+    schedule: list[dict],
+    n_steps_per_call: int = 10,
+):
+    for i, stage in enumerate(schedule):
+        print(
+            f"Stage {i}: {stage['temperature']:.1f}, {stage['pressure']:.1f}, "
+            f"barostat every {stage['n_barostat_steps']} steps"
+        )
+        set_conditions(
+            simulation,
+            stage["temperature"],
+            stage["pressure"],
+            stage["n_barostat_steps"],
+        )
+        n_calls, remainder = divmod(stage["n_steps"], n_steps_per_call)
+        for _ in tqdm.tqdm(range(n_calls)):
+            simulation.step(n_steps_per_call)
+        if remainder:
+            simulation.step(remainder)
@@ -0,0 +1,500 @@
+"""
+OpenMM reporters used by the simulation scripts.
+"""
+
+import json
+import math
+import os
+import pathlib
+import re
+import socket
+import time
+
+import numpy as np
+import openmm
+import openmm.app
+from openmm import unit as openmm_unit
+
+BOLTZMANN = openmm_unit.MOLAR_GAS_CONSTANT_R.value_in_unit(
+    openmm_unit.kilojoules_per_mole / openmm_unit.kelvin
+)
+# bar nm^3 to kJ/mol
+PV_CONVERSION = 0.0602214076
+# what ObservableReporter can write
+OBSERVABLES = ["dipole", "enthalpy", "force-groups"]
+# OpenMM supports 32 force groups
+MAX_FORCE_GROUPS = 32
+
+
+def get_degrees_of_freedom(system: openmm.System) -> int:
+    """Degrees of freedom as counted by ``StateDataReporter``"""
+    n_dof = 0
+    for i in range(system.getNumParticles()):
+        if system.getParticleMass(i) > 0 * openmm_unit.dalton:
+            n_dof += 3
+    for i in range(system.getNumConstraints()):
+        p1, p2, _ = system.getConstraintParameters(i)
+        if (
+            system.getParticleMass(p1) > 0 * openmm_unit.dalton
+            or system.getParticleMass(p2) > 0 * openmm_unit.dalton
+        ):
+            n_dof -= 1
+    if any(
+        isinstance(force, openmm.CMMotionRemover)
+        for force in system.getForces()
+    ):
+        n_dof -= 3
+    return n_dof
+
+
+def get_total_mass(system: openmm.System) -> float:
+    """Total mass in daltons"""
+    return sum(
+        system.getParticleMass(i).value_in_unit(openmm_unit.dalton)
+        for i in range(system.getNumParticles())
+    )
+
+
+def assign_force_groups(system: openmm.System) -> dict[int, str]:
+    """
+    Put each force in its own force group, so that its energy can be
+    reported separately; returns the name of each group. Forces past the
+    32nd share the last group. Must be called before the Context is created.
+    """
+    for i, force in enumerate(system.getForces()):
+        force.setForceGroup(min(i, MAX_FORCE_GROUPS - 1))
+    return get_force_group_names(system)
+
+
+def get_force_group_names(system: openmm.System) -> dict[int, str]:
+    """Names of the forces in each force group, joined with +"""
+    names = {}
+    for force in system.getForces():
+        names.setdefault(force.getForceGroup(), []).append(force.getName())
+    return {group: "+".join(names[group]) for group in sorted(names)}
+
+
+def get_charges(system: openmm.System) -> np.ndarray:
+    """Partial charges of the NonbondedForce in elementary charges; zero without one"""
+    charges = np.zeros(system.getNumParticles())
+    for force in system.getForces():
+        if isinstance(force, openmm.NonbondedForce):
+            for i in range(force.getNumParticles()):
+                charge, _, _ = force.getParticleParameters(i)
+                charges[i] = charge.value_in_unit(openmm_unit.elementary_charge)
+    return charges
+
+
+def get_slurm_job() -> str:
+    """Job identifier that ``scancel`` understands, if running under SLURM"""
+    array_job = os.environ.get("SLURM_ARRAY_JOB_ID")
+    array_task = os.environ.get("SLURM_ARRAY_TASK_ID")
+    if array_job and array_task:
+        return f"{array_job}_{array_task}"
+    return os.environ.get("SLURM_JOB_ID", "")
+
+
+def write_json_atomic(data: dict, output_file: pathlib.Path):
+    """Write JSON so that readers never see a partially written file"""
+    output_file = pathlib.Path(output_file)
+    temporary_file = output_file.with_name(f".{output_file.name}.tmp")
+    with temporary_file.open("w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(temporary_file, output_file)
+
+
+def get_state_summary(state: openmm.State, n_dof: int, total_mass: float) -> dict:
+    """Energies, temperature, volume and density of a State"""
+    potential_energy = state.getPotentialEnergy().value_in_unit(openmm_unit.kilojoules_per_mole)
+    kinetic_energy = state.getKineticEnergy().value_in_unit(openmm_unit.kilojoules_per_mole)
+    volume = state.getPeriodicBoxVolume().value_in_unit(openmm_unit.nanometer ** 3)
+    # daltons / nm^3 to g/mL
+    density = total_mass / volume / 602.2140857 if volume > 0 else math.nan
+    temperature = 2 * kinetic_energy / (n_dof * BOLTZMANN) if n_dof > 0 else math.nan
+    return {
+        "potential_energy": potential_energy,
+        "kinetic_energy": kinetic_energy,
+        "temperature": temperature,
+        "volume": volume,
+        "density": density,
+    }
+
+
+def update_heartbeat(output_file: pathlib.Path, status: str, **fields):
+    """Set the status of an existing heartbeat file, e.g. once a run finishes"""
+    output_file = pathlib.Path(output_file)
+    heartbeat = {}
+    if output_file.exists():
+        with output_file.open("r") as f:
+            heartbeat = json.load(f)
+    heartbeat.update(status=status, timestamp=time.time(), **fields)
+    write_json_atomic(heartbeat, output_file)
+
+
+class HeartbeatReporter:
+    """
+    Periodically and atomically rewrites a JSON file describing progress.
+
+    The file is checked at reporter cadence but only rewritten
+    every ``interval_seconds``. Energies come from the State OpenMM
+    already fetches for the other reporters, so the cost is one small
+    write per interval.
+
+    Parameters
+    ----------
+    output_file: pathlib.Path
+        Heartbeat file to write
+    report_interval: int
+        Number of steps between checks
+    total_steps: int
+        Number of steps in this phase, used for the ETA
+    timestep_fs: float
+        Timestep in femtoseconds, used for ns/day
+    phase: str
+        Name of the current phase, e.g. "equilibration"
+    interval_seconds: float
+        Minimum wall time between writes
+    """
+
+    def __init__(
+        self,
+        output_file: pathlib.Path,
+        report_interval: int,
+        total_steps: int,
+        timestep_fs: float,
+        phase: str = "",
+        interval_seconds: float = 60,
+    ):
+        self.output_file = pathlib.Path(output_file)
+        self.report_interval = report_interval
+        self.total_steps = total_steps
+        self.timestep_fs = timestep_fs
+        self.phase = phase
+        self.interval_seconds = interval_seconds
+
+        self._n_dof = None
+        self._total_mass = None
+        self._start_step = None
+        self._last_step = None
+        self._last_time = None
+        self._last_write_time = -math.inf
+        self._summary = {}
+
+    def describeNextReport(self, simulation):
+        steps = self.report_interval - simulation.currentStep % self.report_interval
+        # no wrapping preference, so the State of the other reporters is shared
+        return (steps, False, False, False, True, None)
+
+    def report(self, simulation, state):
+        if self._n_dof is None:
+            self._n_dof = get_degrees_of_freedom(simulation.system)
+            self._total_mass = get_total_mass(simulation.system)
+            self._start_step = simulation.currentStep - self.report_interval
+            self._last_step = simulation.currentStep
+            self._last_time = time.time()
+
+        self._summary = get_state_summary(state, self._n_dof, self._total_mass)
+        now = time.time()
+        if now - self._last_write_time < self.interval_seconds:
+            return
+
+        n_steps = simulation.currentStep - self._last_step
+        seconds = now - self._last_time
+        # no throughput until a whole interval has been timed
+        ns_per_day = eta_seconds = None
+        if n_steps > 0 and seconds > 0:
+            ns_per_day = n_steps * self.timestep_fs * 1e-6 * 86400 / seconds
+            remaining_steps = self.total_steps - (simulation.currentStep - self._start_step)
+            eta_seconds = max(remaining_steps, 0) * seconds / n_steps
+        self.write(
+            "running",
+            step=simulation.currentStep,
+            ns_per_day=ns_per_day,
+            eta_seconds=eta_seconds,
+        )
+        self._last_step = simulation.currentStep
+        self._last_time = now
+
+    def write(self, status: str, **fields):
+        heartbeat = {
+            "status": status,
+            "phase": self.phase,
+            "timestamp": time.time(),
+            "total_steps": self.total_steps,
+            "hostname": socket.gethostname(),
+            "pid": os.getpid(),
+            "slurm_job": get_slurm_job(),
+            **self._summary,
+            **fields,
+        }
+        write_json_atomic(heartbeat, self.output_file)
+        self._last_write_time = heartbeat["timestamp"]
+
+
+class SimulationDivergedError(RuntimeError):
+    """Raised by DivergenceWatchdog when a simulation has blown up"""
+
+    def __init__(self, reason: str, step: int, diagnostics_file: pathlib.Path = None):
+        super().__init__(f"Simulation diverged at step {step}: {reason}")
+        self.reason = reason
+        self.step = step
+        self.diagnostics_file = diagnostics_file
+
+
+# OpenMM's own errors when a simulation blows up between watchdog checks
+OPENMM_DIVERGENCE_PATTERN = re.compile(r"Particle coordinate is (NaN|infinite)")
+
+
+def as_divergence(error: Exception) -> SimulationDivergedError:
+    """
+    ``error`` as a ``SimulationDivergedError`` if it is one or if it is
+    OpenMM reporting NaN or infinite coordinates, otherwise None.
+    """
+    if isinstance(error, SimulationDivergedError):
+        return error
+    if isinstance(error, openmm.OpenMMException):
+        match = OPENMM_DIVERGENCE_PATTERN.search(str(error))
+        if match is not None:
+            # OpenMM does not say at which step
+            return SimulationDivergedError(match.group(0), step=None)
+    return None
+
+
+class DivergenceWatchdog:
+    """
+    Aborts a simulation as soon as it explodes.
+
+    Checked at reporter cadence from the positions, energies and box of
+    the State OpenMM already fetches for reporting. Positions are
+    requested with the same wrapping as the DCD and StateDataReporter,
+    so OpenMM reports the watchdog in the same group as them, in list
+    order; added before them, it raises before a diverged frame is
+    written. On a trip, a snapshot of the current state and the recent
+    history of checks is written next to ``name`` and
+    ``SimulationDivergedError`` is raised out of ``Simulation.step``.
+
+    Parameters
+    ----------
+    name: str
+        Prefix of the diagnostic files, e.g. ".../equilibration"
+    report_interval: int
+        Number of steps between checks
+    max_potential_energy_per_particle: float
+        Largest allowed potential energy, in kJ/mol per particle
+    max_temperature: float
+        Largest allowed instantaneous temperature, in K
+    min_volume_fraction: float
+        Smallest allowed box volume, relative to the first check
+    max_volume_fraction: float
+        Largest allowed box volume, relative to the first check
+    n_history: int
+        Number of previous checks to keep for the diagnostics
+    """
+
+    def __init__(
+        self,
+        name: str,
+        report_interval: int,
+        max_potential_energy_per_particle: float = 1000,
+        max_temperature: float = 1000,
+        min_volume_fraction: float = 0.25,
+        max_volume_fraction: float = 3.0,
+        n_history: int = 20,
+    ):
+        self.name = str(name)
+        self.report_interval = report_interval
+        self.max_potential_energy_per_particle = max_potential_energy_per_particle
+        self.max_temperature = max_temperature
+        self.min_volume_fraction = min_volume_fraction
+        self.max_volume_fraction = max_volume_fraction
+        self.n_history = n_history
+
+        self._n_dof = None
+        self._total_mass = None
+        self._n_particles = None
+        self._initial_volume = None
+        self.history = []
+
+    def describeNextReport(self, simulation):
+        steps = self.report_interval - simulation.currentStep % self.report_interval
+        return (steps, True, False, False, True, None)
+
+    def check(self, summary: dict) -> str:
+        """Reason the summary is unphysical, or an empty string"""
+        if not summary["finite_positions"]:
+            return "positions are not finite"
+        for key in ["potential_energy", "kinetic_energy", "volume"]:
+            if not math.isfinite(summary[key]):
+                return f"{key} is {summary[key]}"
+        energy_per_particle = summary["potential_energy"] / self._n_particles
+        if energy_per_particle > self.max_potential_energy_per_particle:
+            return (
+                f"potential energy of {energy_per_particle:.1f} kJ/mol per particle "
+                f"exceeds {self.max_potential_energy_per_particle}"
+            )
+        if summary["temperature"] > self.max_temperature:
+            return (
+                f"temperature of {summary['temperature']:.1f} K "
+                f"exceeds {self.max_temperature}"
+            )
+        volume_fraction = summary["volume"] / self._initial_volume
+        if not self.min_volume_fraction <= volume_fraction <= self.max_volume_fraction:
+            return (
+                f"box volume is {volume_fraction:.3f} of the initial volume, outside "
+                f"[{self.min_volume_fraction}, {self.max_volume_fraction}]"
+            )
+        return ""
+
+    def report(self, simulation, state):
+        if self._n_dof is None:
+            self._n_dof = get_degrees_of_freedom(simulation.system)
+            self._total_mass = get_total_mass(simulation.system)
+            self._n_particles = simulation.system.getNumParticles()
+
+        summary = get_state_summary(state, self._n_dof, self._total_mass)
+        positions = state.getPositions(asNumpy=True).value_in_unit(openmm_unit.nanometer)
+        summary["finite_positions"] = bool(np.isfinite(positions).all())
+        if self._initial_volume is None:
+            self._initial_volume = summary["volume"]
+        summary["step"] = simulation.currentStep
+        self.history = (self.history + [summary])[-self.n_history:]
+
+        reason = self.check(summary)
+        if reason:
+            diagnostics_file = self.write_diagnostics(simulation, reason)
+            raise SimulationDivergedError(reason, simulation.currentStep, diagnostics_file)
+
+    def write_diagnostics(self, simulation, reason: str) -> pathlib.Path:
+        state = simulation.context.getState(
+            getPositions=True,
+            getVelocities=True,
+            getEnergy=True,
+        )
+        with open(f"{self.name}-diverged-state.xml", "w") as f:
+            f.write(openmm.XmlSerializer.serialize(state))
+
+        # PDBFile refuses to write NaN coordinates
+        positions = state.getPositions(asNumpy=True).value_in_unit(openmm_unit.nanometer)
+        if np.isfinite(positions).all():
+            with open(f"{self.name}-diverged.pdb", "w") as f:
+                openmm.app.PDBFile.writeFile(
+                    simulation.topology,
+                    state.getPositions(),
+                    f,
+                )
+
+        diagnostics_file = pathlib.Path(f"{self.name}-diverged.json")
+        write_json_atomic(
+            {
+                "reason": reason,
+                "step": simulation.currentStep,
+                "thresholds": {
+                    "max_potential_energy_per_particle": self.max_potential_energy_per_particle,
+                    "max_temperature": self.max_temperature,
+                    "min_volume_fraction": self.min_volume_fraction,
+                    "max_volume_fraction": self.max_volume_fraction,
+                },
+                "initial_volume": self._initial_volume,
+                "history": self.history,
+            },
+            diagnostics_file,
+        )
+        return diagnostics_file
+
+
+class ObservableReporter:
+    """
+    Writes observables derived from each reported State to a CSV, so that
+    e.g. dielectric constants or per-force energies do not need the
+    trajectory or a rerun.
+
+    ``observables`` are any of:
+
+    dipole
+        Total box dipole, sum of q r over particles, in e nm. Charges are
+        read from the NonbondedForce once. Positions are requested with
+        the same wrapping as the DCD and StateDataReporter, so the State is
+        shared with them. Whole molecules are wrapped, which leaves the
+        dipole of neutral molecules unchanged.
+    enthalpy
+        PV at the barostat's current pressure, and potential plus
+        kinetic energy plus PV, in kJ/mol
+    force-groups
+        Potential energy of each force group, in kJ/mol. Unlike the
+        others this costs one extra energy evaluation per group per
+        report; see ``assign_force_groups``.
+
+    Parameters
+    ----------
+    output_file: pathlib.Path
+        CSV file to write
+    report_interval: int
+        Number of steps between reports
+    observables: list[str]
+        Observables to write
+    """
+
+    def __init__(
+        self,
+        output_file: pathlib.Path,
+        report_interval: int,
+        observables: list[str] = ("dipole", "enthalpy"),
+    ):
+        unknown = set(observables) - set(OBSERVABLES)
+        if unknown:
+            raise ValueError(f"Unknown observables {sorted(unknown)}; choose from {OBSERVABLES}")
+        self.output_file = pathlib.Path(output_file)
+        self.report_interval = report_interval
+        self.observables = list(observables)
+
+        self._charges = None
+        self._groups = None
+        self._file = None
+
+    def describeNextReport(self, simulation):
+        steps = self.report_interval - simulation.currentStep % self.report_interval
+        return (steps, "dipole" in self.observables, False, False, True, None)
+
+    def get_header(self) -> list[str]:
+        header = ["Step", "Time (ps)"]
+        if "dipole" in self.observables:
+            header += ["Dipole X (e nm)", "Dipole Y (e nm)", "Dipole Z (e nm)"]
+        if "enthalpy" in self.observables:
+            header += ["PV (kJ/mole)", "Enthalpy (kJ/mole)"]
+        if "force-groups" in self.observables:
+            header += [f"{name} (kJ/mole)" for name in self._groups.values()]
+        return header
+
+    def report(self, simulation, state):
+        if self._file is None:
+            self._charges = get_charges(simulation.system)
+            self._groups = get_force_group_names(simulation.system)
+            self._file = self.output_file.open("w")
+            # the same header format as StateDataReporter
+            self._file.write('#"' + '","'.join(self.get_header()) + '"\n')
+
+        row = [simulation.currentStep, state.getTime().value_in_unit(openmm_unit.picosecond)]
+        if "dipole" in self.observables:
+            positions = state.getPositions(asNumpy=True).value_in_unit(openmm_unit.nanometer)
+            row.extend(self._charges @ positions)
+        if "enthalpy" in self.observables:
+            volume = state.getPeriodicBoxVolume().value_in_unit(openmm_unit.nanometer ** 3)
+            try:
+                pressure = simulation.context.getParameter(openmm.MonteCarloBarostat.Pressure())
+            except openmm.OpenMMException:
+                # no barostat
+                pressure = math.nan
+            pv = pressure * volume * PV_CONVERSION
+            energy = state.getPotentialEnergy() + state.getKineticEnergy()
+            row.extend([pv, energy.value_in_unit(openmm_unit.kilojoules_per_mole) + pv])
+        if "force-groups" in self.observables:
+            for group in self._groups:
+                group_state = simulation.context.getState(getEnergy=True, groups={group})
+                row.append(group_state.getPotentialEnergy().value_in_unit(openmm_unit.kilojoules_per_mole))
+        self._file.write(",".join(map(str, row)) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,161 @@
+"""
+A persistent SQLite table of per-file analysis results.
+
+Results are stored with the fingerprint (size, modification time and
+SHA-256) of the file they were computed from and the settings they were
+computed with. On the next pass only files that are new or whose content
+changed are reanalyzed. A file whose modification time changed but
+whose content did not is not reanalyzed; its stored fingerprint is
+updated instead.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    input_file TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (input_file, settings)
+)
+"""
+
+
+def get_file_fingerprint(input_file: pathlib.Path, content_hash: bool = True) -> dict:
+    """Size, modification time and (optionally) SHA-256 of a file"""
+    stat = pathlib.Path(input_file).stat()
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": None}
+    if content_hash:
+        with open(input_file, "rb") as f:
+            fingerprint["sha256"] = hashlib.file_digest(f, "sha256").hexdigest()
+    return fingerprint
+
+
+def write_csv_atomic(df, output_file: pathlib.Path):
+    """Write a DataFrame so that readers never see a partially written file"""
+    output_file = pathlib.Path(output_file)
+    temporary_file = output_file.with_name(f".{output_file.name}.tmp")
+    df.to_csv(temporary_file, index=False)
+    os.replace(temporary_file, output_file)
+
+
+class ResultsCache:
+    def __init__(self, cache_file: pathlib.Path, settings: dict = None):
+        """
+        Parameters
+        ----------
+        cache_file: pathlib.Path
+            SQLite database, created if missing
+        settings: dict
+            Analysis settings. Results computed with other settings
+            are kept but not returned.
+        """
+        self.cache_file = pathlib.Path(cache_file)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.settings = json.dumps(settings or {}, sort_keys=True)
+        with self.transaction() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """A write transaction that holds the database lock from the start"""
+        connection = sqlite3.connect(self.cache_file, timeout=300, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def get_stale(self, input_files: list[pathlib.Path]) -> dict[pathlib.Path, dict]:
+        """
+        Files that are not cached or whose content changed, with their
+        current fingerprints to pass to ``store``.
+
+        Only files whose size or modification time changed are hashed.
+        """
+        with self.transaction() as connection:
+            cached = {
+                input_file: (size, mtime_ns, sha256)
+                for input_file, size, mtime_ns, sha256 in connection.execute(
+                    "SELECT input_file, size, mtime_ns, sha256 FROM results WHERE settings = ?",
+                    (self.settings,),
+                )
+            }
+        stale = {}
+        touched = []
+        for input_file in input_files:
+            key = str(input_file)
+            fingerprint = get_file_fingerprint(input_file, content_hash=False)
+            if key in cached:
+                size, mtime_ns, sha256 = cached[key]
+                if (fingerprint["size"], fingerprint["mtime_ns"]) == (size, mtime_ns):
+                    continue
+            fingerprint = get_file_fingerprint(input_file)
+            if key in cached and fingerprint["sha256"] == cached[key][2]:
+                touched.append((fingerprint["size"], fingerprint["mtime_ns"], key, self.settings))
+                continue
+            stale[input_file] = fingerprint
+
+        if touched:
+            with self.transaction() as connection:
+                connection.executemany(
+                    "UPDATE results SET size = ?, mtime_ns = ? WHERE input_file = ? AND settings = ?",
+                    touched,
+                )
+        return stale
+
+    def store(self, results: list[tuple[pathlib.Path, dict, list[dict]]]):
+        """
+        Store ``(input_file, fingerprint, rows)`` for several files in one
+        transaction. The fingerprint should be taken before the file was
+        read, so that a file changed during analysis is reanalyzed.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                """
+                INSERT OR REPLACE INTO results
+                    (input_file, settings, size, mtime_ns, sha256, rows, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        str(input_file),
+                        self.settings,
+                        fingerprint["size"],
+                        fingerprint["mtime_ns"],
+                        fingerprint["sha256"],
+                        json.dumps(rows),
+                        now,
+                    )
+                    for input_file, fingerprint, rows in results
+                ],
+            )
+
+    def get_rows(self, input_files: list[pathlib.Path]) -> list[dict]:
+        """Cached rows of ``input_files``, in the order given"""
+        with self.transaction() as connection:
+            cached = dict(connection.execute(
+                "SELECT input_file, rows FROM results WHERE settings = ?",
+                (self.settings,),
+            ))
+        rows = []
+        for input_file in input_files:
+            if str(input_file) in cached:
+                rows.extend(json.loads(cached[str(input_file)]))
+        return rows
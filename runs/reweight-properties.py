@@ -0,0 +1,242 @@
+"""
+Estimate properties of every entry of a run under new force-field
+parameters by MBAR reweighting of its production frames, instead of
+simulating again.
+
+    python reweight-properties.py -i boxes-nosort/n-2000/runs-interchange-final \\
+        -r ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1 \\
+        -f modified-1.offxml -f modified-2.offxml --stride 10 -w 16
+
+Each entry is reweighted in its own process; see ``reweighting.py``.
+Entries where a force field has too few effective samples are written
+to ``<output directory>/<force field>/entry-XXXX/interchange.json`` and
+added to a queue there, so they can be simulated by
+``simulation-worker.py``:
+
+    python simulation-worker.py --queue-file reweighted/modified-1/queue.sqlite \\
+        work -i reweighted/modified-1 ...
+"""
+
+import concurrent.futures
+import multiprocessing
+import pathlib
+import sys
+
+import click
+
+from job_queue import JobQueue, parse_indices
+from platforms import get_available_cpus
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Directory containing the entry-XXXX directories",
+)
+@click.option(
+    "--run",
+    "-r",
+    default="ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1",
+    type=str,
+    help="Run whose production frames are reweighted",
+)
+@click.option(
+    "--force-field",
+    "-f",
+    "force_fields",
+    multiple=True,
+    required=True,
+    type=str,
+    help="Force field to reweight to; repeat for several",
+)
+@click.option(
+    "--entries",
+    "-e",
+    default=None,
+    type=str,
+    help="Entry indices to reweight, e.g. 0-15,20. Default: every entry with the run",
+)
+@click.option(
+    "--temperature",
+    "-t",
+    default=298.15,
+    type=float,
+    help="Temperature in K",
+)
+@click.option(
+    "--pressure",
+    "-p",
+    default=1.01325,
+    type=float,
+    help="Pressure in bar",
+)
+@click.option(
+    "--hydrogen-mass",
+    default=1,
+    type=float,
+    help="Hydrogen mass multiplier of the run",
+)
+@click.option(
+    "--start",
+    default=0,
+    type=int,
+    help="First production frame to use, e.g. after equilibration",
+)
+@click.option(
+    "--stride",
+    default=1,
+    type=int,
+    help="Use every this many frames; about the statistical inefficiency",
+)
+@click.option(
+    "--chunk-size",
+    default=100,
+    type=int,
+    help="Number of frames held in memory at once",
+)
+@click.option(
+    "--min-effective-samples",
+    default=50,
+    type=float,
+    help="Force fields with fewer effective samples are queued for simulation",
+)
+@click.option(
+    "--reference-tolerance",
+    default=1e-3,
+    type=float,
+    help="Relative tolerance of the run's own density and potential energy against production.csv",
+)
+@click.option(
+    "--nonbonded-settings",
+    default=None,
+    type=str,
+    help="JSON file from tune-nonbonded.py that the run used, relative to each entry directory",
+)
+@click.option(
+    "--n-workers",
+    "-w",
+    default=0,
+    type=int,
+    help="Number of entries to reweight concurrently; 0 uses every available core",
+)
+@click.option(
+    "--n-threads",
+    default=1,
+    type=int,
+    help="CPU threads of each OpenMM Context",
+)
+@click.option(
+    "--platform",
+    default="CPU",
+    type=click.Choice(["CPU", "CUDA", "OpenCL", "Reference"]),
+    help="OpenMM platform to evaluate energies on",
+)
+@click.option(
+    "--output-directory",
+    default="reweighted",
+    type=str,
+    help="Where to write entries that need simulating",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="reweighted-properties.csv",
+    type=str,
+    help="Output file",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    run: str = "ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1",
+    force_fields: list[str] = (),
+    entries: str = None,
+    temperature: float = 298.15,
+    pressure: float = 1.01325,
+    hydrogen_mass: float = 1,
+    start: int = 0,
+    stride: int = 1,
+    chunk_size: int = 100,
+    min_effective_samples: float = 50,
+    reference_tolerance: float = 1e-3,
+    nonbonded_settings: str = None,
+    n_workers: int = 0,
+    n_threads: int = 1,
+    platform: str = "CPU",
+    output_directory: str = "reweighted",
+    output_file: str = "reweighted-properties.csv",
+):
+    import pandas as pd
+
+    from reweighting import reweight_entry
+
+    input_directory = pathlib.Path(input_directory).resolve()
+    if entries is None:
+        run_directories = sorted(input_directory.glob(f"entry-*/{run}"))
+    else:
+        run_directories = [input_directory / f"entry-{index:04d}" / run for index in parse_indices(entries)]
+    run_directories = [
+        run_directory for run_directory in run_directories
+        if (run_directory / "production.dcd").exists()
+    ]
+
+    n_workers = n_workers or max(get_available_cpus() // n_threads, 1)
+    print(f"Reweighting {len(run_directories)} entries to {len(force_fields)} force fields on {n_workers} workers")
+    kwargs = dict(
+        force_fields=[str(pathlib.Path(force_field).resolve()) for force_field in force_fields],
+        temperature=temperature,
+        pressure=pressure,
+        hydrogen_mass=hydrogen_mass,
+        start=start,
+        stride=stride,
+        chunk_size=chunk_size,
+        min_effective_samples=min_effective_samples,
+        reference_tolerance=reference_tolerance,
+        nonbonded_settings=nonbonded_settings,
+        output_directory=str(pathlib.Path(output_directory).resolve()),
+        platform=platform,
+        n_threads=n_threads,
+    )
+    rows = []
+    n_failed = 0
+    # spawn rather than fork so that no OpenMM or thread-pool state is inherited
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(reweight_entry, str(run_directory), **kwargs): run_directory.parent.name
+            for run_directory in run_directories
+        }
+        for future in concurrent.futures.as_completed(futures):
+            entry = futures[future]
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                n_failed += 1
+                print(f"{entry}: failed: {e}")
+
+    df = pd.DataFrame(rows)
+    if not len(df):
+        print("No entries reweighted")
+        sys.exit(1)
+    df = df.sort_values(["entry", "force_field", "property"])
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} rows to {output_file}")
+
+    # fall back to simulation where overlap is poor
+    needs_simulation = df[df.needs_simulation].drop_duplicates(["entry", "force_field"])
+    for force_field, group in needs_simulation.groupby("force_field"):
+        queue = JobQueue(pathlib.Path(output_directory) / force_field / "queue.sqlite")
+        n_added = queue.add([f"entry-{entry:04d}" for entry in group.entry])
+        print(f"{force_field}: queued {n_added} of {len(group)} entries with poor overlap for simulation")
+    if not len(needs_simulation):
+        print("Every force field overlaps well enough with every entry")
+    if n_failed:
+        print(f"{n_failed} entries failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
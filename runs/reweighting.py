@@ -0,0 +1,226 @@
+"""
+MBAR reweighting of stored production frames to new force-field parameters.
+
+The frames of ``production.dcd`` and their box vectors are re-evaluated
+under the parameters of the run (the sampled state) and under each new
+SMIRNOFF force field. Each parameter set has one OpenMM Context, which
+is reused for every frame; frames are read from the memory-mapped DCD a
+chunk at a time. Reduced potentials u = (U + pV) / kT go into MBAR with
+all samples from the sampled state.
+
+The effective sample size of each new state says how well it overlaps
+with the sampled state. When it is too small, the estimates are not
+trusted and the entry needs to be simulated with the new parameters.
+"""
+
+import json
+import pathlib
+
+import numpy as np
+import openmm
+from openmm import unit as openmm_unit
+
+from openff.interchange import Interchange
+
+from nonbonded import apply_nonbonded_settings
+from reporters import BOLTZMANN, PV_CONVERSION
+from trajectory import DENSITY_CONVERSION, DCDFile
+
+# reporter columns that the run's own parameters must reproduce
+PRODUCTION_COLUMNS = ["Density (g/mL)", "Potential Energy (kJ/mole)"]
+
+
+class PotentialEvaluator:
+    """Potential energies of many frames of one System, in kJ/mol"""
+
+    def __init__(self, system: openmm.System, platform: str = "CPU", n_threads: int = 1):
+        properties = {"Threads": str(n_threads)} if platform == "CPU" else {}
+        # the integrator is never stepped
+        self.context = openmm.Context(
+            system,
+            openmm.VerletIntegrator(1.0 * openmm_unit.femtoseconds),
+            openmm.Platform.getPlatformByName(platform),
+            properties,
+        )
+
+    def evaluate(self, positions: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        """Potential energy of each frame of positions and rectangular box lengths in nm"""
+        energies = np.empty(len(positions))
+        for i, (frame, box) in enumerate(zip(positions, boxes)):
+            self.context.setPeriodicBoxVectors(
+                openmm.Vec3(box[0], 0, 0),
+                openmm.Vec3(0, box[1], 0),
+                openmm.Vec3(0, 0, box[2]),
+            )
+            self.context.setPositions(frame)
+            state = self.context.getState(getEnergy=True)
+            energies[i] = state.getPotentialEnergy().value_in_unit(openmm_unit.kilojoules_per_mole)
+        return energies
+
+
+def create_parameterized_interchange(interchange: Interchange, force_field: str) -> Interchange:
+    """The topology, positions and box of ``interchange`` with the parameters of ``force_field``"""
+    from openff.toolkit import ForceField
+
+    return Interchange.from_smirnoff(
+        ForceField(force_field),
+        interchange.topology,
+        box=interchange.box,
+        positions=interchange.positions,
+    )
+
+
+def get_production_means(
+    run_directory: pathlib.Path,
+    start: int,
+    stop: int,
+    stride: int,
+    n_frames: int,
+) -> dict[str, float]:
+    """
+    Means of rows ``start:stop:stride`` of ``production.csv``, which are
+    the frames of ``production.dcd`` as both reporters share an interval.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(run_directory / "production.csv", usecols=PRODUCTION_COLUMNS)
+    df = df.iloc[start:stop:stride]
+    if len(df) != n_frames:
+        raise ValueError(f"production.csv of {run_directory} does not match production.dcd")
+    return df.mean().to_dict()
+
+
+def reweight_entry(
+    run_directory: str,
+    force_fields: list[str],
+    temperature: float = 298.15,
+    pressure: float = 1.01325,
+    hydrogen_mass: float = 1,
+    start: int = 0,
+    stop: int = None,
+    stride: int = 1,
+    chunk_size: int = 100,
+    min_effective_samples: float = 50,
+    reference_tolerance: float = 1e-3,
+    nonbonded_settings: str = None,
+    output_directory: str = None,
+    platform: str = "CPU",
+    n_threads: int = 1,
+) -> list[dict]:
+    """
+    Reweight frames ``start:stop:stride`` of ``production.dcd`` in
+    ``run_directory`` to each force field, at ``temperature`` in K and
+    ``pressure`` in bar.
+
+    Frames should be roughly uncorrelated for the MBAR uncertainties to
+    hold, so ``stride`` should be about the statistical inefficiency.
+
+    The run's own parameters weight every frame equally, so their density
+    and potential energy must match the means of the same rows of
+    ``production.csv`` to a relative ``reference_tolerance``; otherwise
+    the energies are not those of the sampled state and nothing is
+    reweighted. ``nonbonded_settings`` is the JSON file from
+    tune-nonbonded.py that the run was simulated with, relative to the
+    entry directory, and is applied to every parameter set.
+
+    Returns a row per force field and observable. If a force field has
+    fewer than ``min_effective_samples`` effective samples and
+    ``output_directory`` is given, the entry with its parameters is
+    written to ``output_directory/<force field>/entry-XXXX/interchange.json``
+    to be simulated.
+    """
+    from pymbar import MBAR
+
+    run_directory = pathlib.Path(run_directory)
+    entry_directory = run_directory.parent
+    interchange = Interchange.parse_file(entry_directory / "interchange.json")
+    n_molecules = interchange.topology.n_molecules
+    total_mass = sum(atom.mass.m_as("dalton") for atom in interchange.topology.atoms)
+
+    if nonbonded_settings is not None:
+        with (entry_directory / nonbonded_settings).open("r") as f:
+            nonbonded_settings = json.load(f)["settings"]
+
+    names = [pathlib.Path(force_field).stem for force_field in force_fields]
+    interchanges = [interchange] + [
+        create_parameterized_interchange(interchange, force_field)
+        for force_field in force_fields
+    ]
+    evaluators = []
+    for state in interchanges:
+        system = state.to_openmm_system(hydrogen_mass=1.007947 * hydrogen_mass)
+        if system.getNumParticles() != interchange.topology.n_atoms:
+            raise ValueError("Virtual sites are not supported")
+        if nonbonded_settings is not None:
+            apply_nonbonded_settings(system, nonbonded_settings)
+        evaluators.append(PotentialEvaluator(system, platform=platform, n_threads=n_threads))
+
+    dcd = DCDFile(run_directory / "production.dcd")
+    if dcd.n_atoms != interchange.topology.n_atoms:
+        raise ValueError(f"production.dcd of {run_directory} does not match interchange.json")
+    stop = dcd.n_frames if stop is None else min(stop, dcd.n_frames)
+    energies = [[] for _ in evaluators]
+    volumes = []
+    # chunks start on frames of the stride so that chunks join seamlessly
+    chunk_frames = chunk_size * stride
+    for chunk_start in range(start, stop, chunk_frames):
+        positions, boxes = dcd.read(chunk_start, min(chunk_start + chunk_frames, stop), stride)
+        volumes.append(np.prod(boxes, axis=1))
+        for evaluator, state_energies in zip(evaluators, energies):
+            state_energies.append(evaluator.evaluate(positions, boxes))
+    del evaluators
+
+    volumes = np.concatenate(volumes)
+    potential_energies = np.array([np.concatenate(state_energies) for state_energies in energies])
+    n_frames = len(volumes)
+    if n_frames < 2:
+        raise ValueError(f"Only {n_frames} frames of {run_directory} to reweight")
+
+    kT = BOLTZMANN * temperature
+    u_kn = (potential_energies + pressure * volumes * PV_CONVERSION) / kT
+    mbar = MBAR(u_kn, np.array([n_frames] + [0] * len(force_fields)))
+    n_effective = mbar.compute_effective_sample_number()
+
+    observables = {
+        "Density (g/mL)": (total_mass / volumes * DENSITY_CONVERSION, False),
+        "Box Volume (nm^3)": (volumes, False),
+        "Potential Energy (kJ/mole)": (potential_energies, True),
+        "Potential Energy per Molecule (kJ/mole)": (potential_energies / n_molecules, True),
+    }
+    estimates = {
+        observable: mbar.compute_expectations(values, state_dependent=state_dependent)
+        for observable, (values, state_dependent) in observables.items()
+    }
+
+    production_means = get_production_means(run_directory, start, stop, stride, n_frames)
+    for observable, production_mean in production_means.items():
+        reference = estimates[observable]["mu"][0]
+        if not abs(reference - production_mean) <= reference_tolerance * abs(production_mean):
+            raise ValueError(
+                f"Reference {observable} of {run_directory} is {reference:.6g}, "
+                f"but {production_mean:.6g} in production.csv"
+            )
+
+    entry = int(entry_directory.name.split("-")[1])
+    rows = []
+    for k, name in enumerate(["reference"] + names):
+        needs_simulation = k > 0 and bool(n_effective[k] < min_effective_samples)
+        if needs_simulation and output_directory is not None:
+            new_entry_directory = pathlib.Path(output_directory) / name / entry_directory.name
+            new_entry_directory.mkdir(parents=True, exist_ok=True)
+            with (new_entry_directory / "interchange.json").open("w") as f:
+                f.write(interchanges[k].json())
+        for observable, estimate in estimates.items():
+            rows.append({
+                "entry": entry,
+                "run": run_directory.name,
+                "force_field": name,
+                "property": observable,
+                "mean": estimate["mu"][k],
+                "sem": estimate["sigma"][k],
+                "production_mean": production_means.get(observable, np.nan) if k == 0 else np.nan,
+                "n_frames": n_frames,
+                "n_effective": n_effective[k],
+                "needs_simulation": needs_simulation,
+            })
+    return rows
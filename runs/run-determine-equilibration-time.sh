@@ -1,10 +1,10 @@
 #!/usr/bin/env bash
 #SBATCH -J detect-equilibration
 #SBATCH -p standard
-#SBATCH -t 72:00:00
+#SBATCH -t 12:00:00
 #SBATCH --nodes=1
 #SBATCH --tasks-per-node=1
-#SBATCH --cpus-per-task=1
+#SBATCH --cpus-per-task=32
 #SBATCH --mem=16gb
 #SBATCH --account [xxx]
 #SBATCH --output slurm-%x.%A.out
@@ -33,4 +33,4 @@ RUN="ne-6000000_np-5000000_dt-2.0_nb-25_fc-1.0_h1_middle-rep1"
 INPUT_DIRECTORY="${BOXES}/n-${NMOL}/runs-interchange-final"
 OUTPUT_FILES="${BOXES}_n-${NMOL}_interchange-equilibration.csv"
 
-python determine-equilibration-time.py -i $INPUT_DIRECTORY -o $OUTPUT_FILES -r $RUN
+python determine-equilibration-time.py -i $INPUT_DIRECTORY -o $OUTPUT_FILES -r $RUN -w $SLURM_CPUS_PER_TASK
@@ -0,0 +1,43 @@
+#!/usr/bin/env bash
+#SBATCH -J simulate-multiple
+#SBATCH --array=0-90%10
+#SBATCH -p standard
+#SBATCH -t 72:00:00
+#SBATCH --nodes=1
+#SBATCH --tasks-per-node=1
+#SBATCH --cpus-per-task=32
+#SBATCH --mem=64gb
+#SBATCH --account [xxx]
+#SBATCH --output run-logs/slurm-%x.%A-%a.out
+
+. ~/.bashrc
+
+# Use the right conda environment
+conda activate interchange-packmol-040-final
+
+BOXES="boxes-nosort"
+NMOL=2000
+NEQ=6000000
+NPROD=5000000
+TIMESTEP='2.0'
+NBAROSTAT=25
+FRICTION_COEFFICIENT=1
+REP=1
+HMR='1'
+
+# entries per array task, and how many run at once
+NENTRIES=16
+NWORKERS=8
+
+export OE_LICENSE=[path/to/oe_license.txt]
+
+START=$(( SLURM_ARRAY_TASK_ID * NENTRIES ))
+END=$(( START + NENTRIES - 1 ))
+echo "entries ${START}-${END}"
+
+INPUT_DIRECTORY="${BOXES}/n-${NMOL}/runs-interchange-final"
+
+python simulate-multiple.py -i $INPUT_DIRECTORY -e "${START}-${END}" -w $NWORKERS --platform CPU \
+    -ne $NEQ -np $NPROD -dt $TIMESTEP -nb $NBAROSTAT -fc $FRICTION_COEFFICIENT -hm $HMR -sf "_middle-rep${REP}"
+
+echo "done"
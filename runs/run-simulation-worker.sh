@@ -0,0 +1,43 @@
+#!/usr/bin/env bash
+#SBATCH -J simulation-worker
+#SBATCH --array=0-29
+#SBATCH -p free-gpu
+#SBATCH --gres=gpu:1
+#SBATCH -t 16:00:00
+#SBATCH --nodes=1
+#SBATCH --tasks-per-node=1
+#SBATCH --cpus-per-task=1
+#SBATCH --mem=16gb
+#SBATCH --account [xxx]
+#SBATCH --output run-logs/slurm-%x.%A-%a.out
+
+# Each array task is one long-lived worker; queue entries first with
+#   python simulation-worker.py -q $QUEUE_FILE enqueue -e 0-1448
+
+. ~/.bashrc
+
+# Use the right conda environment
+conda activate interchange-packmol-040-final
+
+BOXES="boxes-nosort"
+NMOL=2000
+NEQ=6000000
+NPROD=5000000
+TIMESTEP='2.0'
+NBAROSTAT=25
+FRICTION_COEFFICIENT=1
+REP=1
+HMR='1'
+# leave some of the 16 hours for the last entry to be written out
+TIME_LIMIT=55800
+
+export OE_LICENSE=[path/to/oe_license.txt]
+export CUDA_VISIBLE_DEVICES=0
+
+INPUT_DIRECTORY="${BOXES}/n-${NMOL}/runs-interchange-final"
+QUEUE_FILE="${INPUT_DIRECTORY}/queue.sqlite"
+
+python simulation-worker.py -q $QUEUE_FILE work -i $INPUT_DIRECTORY --time-limit $TIME_LIMIT \
+    -ne $NEQ -np $NPROD -dt $TIMESTEP -nb $NBAROSTAT -fc $FRICTION_COEFFICIENT -hm $HMR -sf "_middle-rep${REP}"
+
+echo "done"
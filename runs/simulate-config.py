@@ -0,0 +1,101 @@
+"""
+Run one box with the settings of a run configuration file.
+
+All variants in the file run one after another on the same parameterized
+and minimized box, e.g.
+
+    python simulate-config.py -i . -c configs/friction-coefficient.yaml
+    python simulate-config.py -i . -c configs/general-middle.yaml --set timestep=4.0 --set hydrogen_mass=3
+    python simulate-config.py -i . -c configs/ladder.yaml --box-file ../liquid-boxes.json
+"""
+
+import json
+import pathlib
+import sys
+
+import click
+
+DEFAULT_CONFIG_FILE = pathlib.Path(__file__).resolve().parent / "configs" / "general-middle.yaml"
+
+
+def parse_override(text: str) -> tuple[str, object]:
+    """Parse ``key=value``, reading the value as JSON where possible"""
+    key, _, value = text.partition("=")
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return key.strip(), value
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default=".",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Input directory",
+)
+@click.option(
+    "--config-file",
+    "-c",
+    default=str(DEFAULT_CONFIG_FILE),
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="YAML or JSON run configuration",
+)
+@click.option(
+    "--set",
+    "overrides",
+    multiple=True,
+    help="Override a config field, e.g. --set timestep=4.0",
+)
+@click.option(
+    "--box-file",
+    default=None,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Box specifications to read the entry's state points from, for ladder runs",
+)
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    help="Record peak RSS and top allocations for each stage",
+)
+def main(
+    input_directory: str = ".",
+    config_file: str = str(DEFAULT_CONFIG_FILE),
+    overrides: list[str] = (),
+    box_file: str = None,
+    profile_memory: bool = False,
+):
+    from engine import SimulationEngine, load_configs, run_config
+    from reporters import SimulationDivergedError
+
+    overrides = dict(map(parse_override, overrides))
+    if box_file is not None:
+        # entry-0123 is the box at index 123
+        index = int(pathlib.Path(input_directory).resolve().name.split("-")[1])
+        with open(box_file, "r") as f:
+            box = json.load(f)[index]
+        if "state_points" not in box:
+            raise click.UsageError(
+                f"{box_file} has no state points. Regenerate it with "
+                "boxes-nosort/generate-box-specifications-nosort.py, or leave out "
+                "--box-file to use the state_points of the config"
+            )
+        overrides["state_points"] = box["state_points"]
+    configs = load_configs(config_file, **overrides)
+    # parameterized once and shared by all variants
+    engine = SimulationEngine.from_file(pathlib.Path(input_directory) / "interchange.json")
+    n_diverged = 0
+    for config in configs:
+        print(f"Running {config.run_name}")
+        try:
+            run_config(input_directory, config, engine=engine, profile_memory=profile_memory)
+        except SimulationDivergedError:
+            n_diverged += 1
+    if n_diverged:
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
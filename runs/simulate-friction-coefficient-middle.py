@@ -1,3 +1,7 @@
+"""
+Superseded by ``simulate-config.py -c configs/friction-coefficient-middle.yaml``; kept as a record of the runs.
+"""
+
 import click
 import logging
 import tqdm
@@ -0,0 +1,205 @@
+"""
+Run a gas-phase simulation of the molecule of every pure box, many at a
+time on one CPU node, for heats of vaporization.
+
+    python simulate-gas-phase.py -i boxes-nosort/n-2000/runs-interchange-final \\
+        -b boxes-nosort/n-2000/liquid-boxes.json -w 32
+
+Each molecule runs in its own single-threaded process from the
+parameters of its liquid box; see ``gas_phase.py``. Results are written
+to ``gas-phase.json`` in each entry directory, so finished molecules are
+skipped on reruns, and collected into one table keyed by entry.
+
+With ``--liquid-properties-file`` (from estimate-properties.py), the
+heat of vaporization is estimated as
+U_gas + RT - U_liquid / N.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing
+import pathlib
+import sys
+
+import click
+
+from job_queue import parse_indices
+from platforms import get_available_cpus
+
+
+def get_pure_boxes(box_file: pathlib.Path) -> list[int]:
+    """Indices of the boxes of a single component"""
+    with open(box_file, "r") as f:
+        boxes = json.load(f)
+    return [index for index, box in enumerate(boxes) if len(box["smiles"]) == 1]
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing the entry-XXXX directories",
+)
+@click.option(
+    "--box-file",
+    "-b",
+    default="boxes-nosort/n-2000/liquid-boxes.json",
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="Box specifications, to find the pure boxes",
+)
+@click.option(
+    "--entries",
+    "-e",
+    default=None,
+    type=str,
+    help="Entry indices to run, e.g. 0-15,20. Default: every pure box",
+)
+@click.option(
+    "--n-workers",
+    "-w",
+    default=0,
+    type=int,
+    help="Number of molecules to run concurrently; 0 uses every available core",
+)
+@click.option(
+    "--temperature",
+    "-t",
+    default=298.15,
+    type=float,
+    help="Temperature in K",
+)
+@click.option(
+    "--friction-coefficient",
+    "-fc",
+    default=1.0,
+    type=float,
+    help="Friction coefficient in ps^-1",
+)
+@click.option(
+    "--timestep",
+    "-dt",
+    default=1.0,
+    type=float,
+    help="Timestep in fs",
+)
+@click.option(
+    "--n-equilibration-steps",
+    "-ne",
+    default=100000,
+    type=int,
+    help="Number of equilibration steps",
+)
+@click.option(
+    "--n-production-steps",
+    "-np",
+    default=1000000,
+    type=int,
+    help="Number of production steps",
+)
+@click.option(
+    "--output-frequency",
+    default=500,
+    type=int,
+    help="Number of steps between potential energy samples",
+)
+@click.option(
+    "--liquid-properties-file",
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    help="Per-box results from estimate-properties.py, to estimate heats of vaporization",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="gas-phase.csv",
+    type=str,
+    help="Output file",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    box_file: str = "boxes-nosort/n-2000/liquid-boxes.json",
+    entries: str = None,
+    n_workers: int = 0,
+    temperature: float = 298.15,
+    friction_coefficient: float = 1.0,
+    timestep: float = 1.0,
+    n_equilibration_steps: int = 100000,
+    n_production_steps: int = 1000000,
+    output_frequency: int = 500,
+    liquid_properties_file: str = None,
+    output_file: str = "gas-phase.csv",
+):
+    import numpy as np
+    import pandas as pd
+
+    from gas_phase import run_gas_phase
+
+    input_directory = pathlib.Path(input_directory).resolve()
+    indices = parse_indices(entries) if entries else get_pure_boxes(box_file)
+    entry_directories = []
+    for index in indices:
+        entry_directory = input_directory / f"entry-{index:04d}"
+        if not (entry_directory / "interchange.json").exists():
+            print(f"Skipping {entry_directory.name}: no interchange.json")
+            continue
+        entry_directories.append(entry_directory)
+
+    n_workers = n_workers or get_available_cpus()
+    print(f"Running {len(entry_directories)} molecules on {n_workers} workers")
+    kwargs = dict(
+        temperature=temperature,
+        friction_coefficient=friction_coefficient,
+        timestep=timestep,
+        n_equilibration_steps=n_equilibration_steps,
+        n_production_steps=n_production_steps,
+        output_frequency=output_frequency,
+        n_threads=1,
+    )
+    rows = []
+    n_failed = 0
+    # spawn rather than fork so that no OpenMM or thread-pool state is inherited
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(run_gas_phase, str(entry_directory), **kwargs): entry_directory.name
+            for entry_directory in entry_directories
+        }
+        for future in concurrent.futures.as_completed(futures):
+            entry = futures[future]
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                n_failed += 1
+                print(f"{entry}: failed: {e}")
+
+    df = pd.DataFrame(rows)
+    if not len(df):
+        print("No molecules finished")
+        sys.exit(1)
+    df["entry"] = [int(entry.split("-")[1]) for entry in df.entry]
+    df = df.sort_values("entry")
+
+    if liquid_properties_file is not None:
+        liquid = pd.read_csv(liquid_properties_file)
+        liquid = liquid[liquid.property == "Potential Energy (kJ/mole)"].set_index("entry")
+        with open(box_file, "r") as f:
+            n_molecules = {index: sum(box["n_molecules"]) for index, box in enumerate(json.load(f))}
+        per_molecule = df.entry.map(n_molecules)
+        df["liquid_potential_energy"] = df.entry.map(liquid["mean"]) / per_molecule
+        df["liquid_potential_energy_sem"] = df.entry.map(liquid["sem_block"]) / per_molecule
+        df["hvap"] = df.potential_energy + df.RT - df.liquid_potential_energy
+        df["hvap_sem"] = np.hypot(df.potential_energy_sem, df.liquid_potential_energy_sem)
+
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} molecules to {output_file}")
+    if n_failed:
+        print(f"{n_failed} molecules failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,116 +1,12 @@
 import click
 import logging
-import tqdm
-import pathlib
 import sys
 
-import openmm
-import openmmtools
-import pandas as pd
-import seaborn as sns
-from matplotlib import pyplot as plt
-
-from openff.units import unit
-from openff.units.openmm import from_openmm, to_openmm
-from openff.interchange import Interchange
-
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
-def create_openmm_simulation(
-    interchange: Interchange,
-    friction_coefficient: int = 1,
-    temperature: unit.Quantity = 298.15 * unit.kelvin,
-    pressure: unit.Quantity = 1.0 * unit.atmospheres,
-    timestep: unit.Quantity = 2.0 * unit.femtoseconds,  # 2 fs
-    n_barostat_steps: int = 25,
-    hydrogen_mass: int = 1,
-):
-    collision_rate = friction_coefficient / unit.picoseconds
-    integrator = openmm.openmm.LangevinMiddleIntegrator(
-        to_openmm(temperature),
-        to_openmm(collision_rate),
-        to_openmm(timestep),
-    )
-    barostat = openmm.MonteCarloBarostat(
-        to_openmm(pressure),
-        to_openmm(temperature),
-        n_barostat_steps,
-    )
-    simulation = interchange.to_openmm_simulation(
-        integrator=integrator,
-        additional_forces=[barostat],
-        hydrogen_mass=1.007947 * hydrogen_mass
-    )
-    return simulation
-
-
-def simulate(
-    interchange: Interchange,
-    name: str,
-    friction_coefficient: int = 1,
-    temperature: unit.Quantity = 298.15 * unit.kelvin,
-    pressure: unit.Quantity = 1.0 * unit.atmospheres,
-    timestep: unit.Quantity = 2.0 * unit.femtoseconds,  # 2 fs
-    n_barostat_steps: int = 25,
-    n_total_steps: int = 1000000,
-    output_frequency: int = 1000,
-    hydrogen_mass: int = 1,
-):
-    simulation = create_openmm_simulation(
-        interchange,
-        friction_coefficient=friction_coefficient,
-        temperature=temperature,
-        pressure=pressure,
-        timestep=timestep,
-        n_barostat_steps=n_barostat_steps,
-        hydrogen_mass=hydrogen_mass
-    )
-    simulation.reporters.append(
-        openmm.app.DCDReporter(
-            f"{name}.dcd",
-            output_frequency,
-        )
-    )
-    simulation.reporters.append(
-        openmm.app.StateDataReporter(
-            f"{name}.csv",
-            output_frequency,
-            step=True,
-            time=True,
-            potentialEnergy=True,
-            kineticEnergy=True,
-            totalEnergy=True,
-            temperature=True,
-            volume=True,
-            density=True,
-            speed=True,
-            separator=",",
-        )
-    )
-    steps = list(range(n_total_steps // 10))
-    for i in tqdm.tqdm(steps):
-        simulation.step(10)
-
-    # plot statistics
-    df = pd.read_csv(f"{name}.csv")
-    cols = [x for x in df.columns if (x != '#"Step"' and "Speed" not in x)]
-    melted = df.melt(
-        id_vars=["Time (ps)"],
-        value_vars=cols,
-        var_name="Quantity",
-        value_name="Value"
-    )
-    g = sns.FacetGrid(melted, col="Quantity", col_wrap=3, sharey=False, sharex=False)
-    g.map(sns.lineplot, "Time (ps)", "Value")
-    g.set_titles("{col_name}")
-    g.savefig(f"{name}_statistics.png", dpi=300)
-
-    return simulation
-
-
 @click.command()
 @click.option(
     "--input-directory",
@@ -168,6 +64,140 @@ def simulate(
     type=float,
     help="Hydrogen mass for HMR, in amu"
 )
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    help="Record peak RSS and top tracemalloc allocators per stage",
+)
+@click.option(
+    "--heartbeat-interval",
+    default=60,
+    type=float,
+    help="Seconds between heartbeat.json updates; 0 to disable",
+)
+@click.option(
+    "--watchdog/--no-watchdog",
+    default=True,
+    help="Abort as soon as the simulation diverges",
+)
+@click.option(
+    "--max-energy-per-particle",
+    default=1000,
+    type=float,
+    help="Watchdog: largest allowed potential energy, in kJ/mol per particle",
+)
+@click.option(
+    "--max-temperature",
+    default=1000,
+    type=float,
+    help="Watchdog: largest allowed instantaneous temperature, in K",
+)
+@click.option(
+    "--min-volume-fraction",
+    default=0.25,
+    type=float,
+    help="Watchdog: smallest allowed box volume relative to the start of each phase",
+)
+@click.option(
+    "--max-volume-fraction",
+    default=3.0,
+    type=float,
+    help="Watchdog: largest allowed box volume relative to the start of each phase",
+)
+@click.option(
+    "--minimizer",
+    default="interchange",
+    type=click.Choice(["interchange", "staged"]),
+    help=(
+        "interchange: Interchange.minimize to convergence. "
+        "staged: capped-force clash relief, L-BFGS to a tolerance, optional low-temperature MD"
+    ),
+)
+@click.option(
+    "--minimization-tolerance",
+    default=10.0,
+    type=float,
+    help="Staged minimizer: L-BFGS force tolerance in kJ/mol/nm",
+)
+@click.option(
+    "--n-minimization-iterations",
+    default=10000,
+    type=int,
+    help="Staged minimizer: maximum L-BFGS iterations",
+)
+@click.option(
+    "--n-clash-iterations",
+    default=500,
+    type=int,
+    help="Staged minimizer: maximum clash-relief steps; 0 to skip",
+)
+@click.option(
+    "--n-minimization-md-steps",
+    default=0,
+    type=int,
+    help="Staged minimizer: low-temperature MD steps after L-BFGS; 0 to skip",
+)
+@click.option(
+    "--n-pre-equilibration-steps",
+    "-npe",
+    default=0,
+    type=int,
+    help="Number of annealing/compression steps before equilibration; 0 to skip",
+)
+@click.option(
+    "--annealing-temperature",
+    default=400.0,
+    type=float,
+    help="Pre-equilibration: starting temperature in K",
+)
+@click.option(
+    "--compression-pressure",
+    default=500.0,
+    type=float,
+    help="Pre-equilibration: starting pressure in atm",
+)
+@click.option(
+    "--n-pre-equilibration-stages",
+    default=10,
+    type=int,
+    help="Pre-equilibration: number of stages to anneal over",
+)
+@click.option(
+    "--platform",
+    default="default",
+    type=str,
+    help=(
+        "OpenMM platform name, 'default' to let OpenMM choose, or 'auto' to "
+        "benchmark candidate platforms, precisions and thread counts on this system"
+    ),
+)
+@click.option(
+    "--refresh-platform/--no-refresh-platform",
+    default=False,
+    help="Re-run the platform benchmark even if a cached choice exists",
+)
+@click.option(
+    "--allow-single-precision/--no-allow-single-precision",
+    default=False,
+    help="Let --platform auto pick single precision on GPUs if it is faster; results may differ",
+)
+@click.option(
+    "--timestep-from-probe/--no-timestep-from-probe",
+    default=False,
+    help=(
+        "Override --timestep and --hydrogen-mass with the selection "
+        "in timestep-probe.json written by probe-timestep.py"
+    ),
+)
+@click.option(
+    "--nonbonded-settings",
+    default=None,
+    type=str,
+    help=(
+        "JSON file written by tune-nonbonded.py, relative to the input directory. "
+        "Its cutoff and PME settings are applied to the simulated System"
+    ),
+)
 def main(
     input_directory: str,
     friction_coefficient: float = 1,
@@ -177,70 +207,65 @@ def main(
     n_barostat_steps: int = 25,
     suffix: str = "",
     hydrogen_mass: int = 1,
+    profile_memory: bool = False,
+    heartbeat_interval: float = 60,
+    watchdog: bool = True,
+    max_energy_per_particle: float = 1000,
+    max_temperature: float = 1000,
+    min_volume_fraction: float = 0.25,
+    max_volume_fraction: float = 3.0,
+    minimizer: str = "interchange",
+    minimization_tolerance: float = 10.0,
+    n_minimization_iterations: int = 10000,
+    n_clash_iterations: int = 500,
+    n_minimization_md_steps: int = 0,
+    n_pre_equilibration_steps: int = 0,
+    annealing_temperature: float = 400.0,
+    compression_pressure: float = 500.0,
+    n_pre_equilibration_stages: int = 10,
+    platform: str = "default",
+    refresh_platform: bool = False,
+    allow_single_precision: bool = False,
+    timestep_from_probe: bool = False,
+    nonbonded_settings: str = None,
 ):
+    from reporters import SimulationDivergedError
+    from engine import run_entry
 
-    input_directory = pathlib.Path(input_directory)
-    # check type of hydrogen_mass...
-    if hydrogen_mass == int(hydrogen_mass):
-        hydrogen_mass = int(hydrogen_mass)
-    output_subdirectory = f"ne-{n_equilibration_steps}_np-{n_production_steps}_dt-{timestep}_nb-{n_barostat_steps}_fc-{friction_coefficient}_h{hydrogen_mass}{suffix}"
-    output_directory = input_directory / output_subdirectory
-    output_directory.mkdir(exist_ok=True, parents=True)
-    # quit early if file exists
-    output_file = input_directory / f"{output_subdirectory}.pdb"
-    if output_file.exists():
-        print(f"{output_file} exists")
-        return
-
-    interchange = Interchange.parse_file(input_directory / "interchange.json")
-    
-    print("Minimizing...")
-
-    # minimize. Roughly approximates Evaluator
-    interchange.minimize(max_iterations=0)
-
-    # save the minimized structure
-    with (output_directory / "minimized-interchange.json").open("w") as f:
-        f.write(interchange.json())
-    interchange.to_pdb(output_directory / "minimized.pdb")
-    interchange.to_gro(output_directory / "minimized.gro")
-
-    print("Equilibrating...")
-
-    # equilibrate
-    equilibration = simulate(
-        interchange,
-        friction_coefficient=friction_coefficient,
-        name=output_directory / "equilibration",
-        n_total_steps=n_equilibration_steps,
-        timestep=timestep * unit.femtoseconds,
-        n_barostat_steps=n_barostat_steps,
-        hydrogen_mass=hydrogen_mass
-    )
-    state = equilibration.context.getState(getPositions=True)
-    box_vectors = state.getPeriodicBoxVectors() 
-    equilibrated_positions = state.getPositions(asNumpy=True)
-    interchange.positions = from_openmm(equilibrated_positions)
-    interchange.box = from_openmm(box_vectors)
-
-    interchange.to_pdb(output_directory / "equilibrated.pdb")
-
-    print("Simulating...")
-
-    # simulate
-    production = simulate(
-        interchange,
-        friction_coefficient=friction_coefficient,
-        name=output_directory / "production",
-        n_total_steps=n_production_steps,
-        timestep=timestep * unit.femtoseconds,
-        n_barostat_steps=n_barostat_steps,
-        hydrogen_mass=hydrogen_mass,
-    )
-    production_positions = production.context.getState(getPositions=True).getPositions(asNumpy=True)
-    interchange.positions = from_openmm(production_positions)
-    interchange.to_pdb(output_file)
-    interchange.to_pdb(output_directory / "final.pdb")
+    try:
+        run_entry(
+            input_directory=input_directory,
+            friction_coefficient=friction_coefficient,
+            n_equilibration_steps=n_equilibration_steps,
+            n_production_steps=n_production_steps,
+            timestep=timestep,
+            n_barostat_steps=n_barostat_steps,
+            suffix=suffix,
+            hydrogen_mass=hydrogen_mass,
+            profile_memory=profile_memory,
+            heartbeat_interval=heartbeat_interval,
+            watchdog=watchdog,
+            max_energy_per_particle=max_energy_per_particle,
+            max_temperature=max_temperature,
+            min_volume_fraction=min_volume_fraction,
+            max_volume_fraction=max_volume_fraction,
+            minimizer=minimizer,
+            minimization_tolerance=minimization_tolerance,
+            n_minimization_iterations=n_minimization_iterations,
+            n_clash_iterations=n_clash_iterations,
+            n_minimization_md_steps=n_minimization_md_steps,
+            n_pre_equilibration_steps=n_pre_equilibration_steps,
+            annealing_temperature=annealing_temperature,
+            compression_pressure=compression_pressure,
+            n_pre_equilibration_stages=n_pre_equilibration_stages,
+            platform=platform,
+            refresh_platform=refresh_platform,
+            allow_single_precision=allow_single_precision,
+            timestep_from_probe=timestep_from_probe,
+            nonbonded_settings=nonbonded_settings,
+        )
+    except SimulationDivergedError:
+        sys.exit(3)
 
 
 if __name__ == "__main__":
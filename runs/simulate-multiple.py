@@ -0,0 +1,218 @@
+"""
+Run several small boxes concurrently on one CPU node.
+
+Each worker process runs one entry at a time through the same pipeline as
+``simulate-general-middle.py`` and writes the same per-entry outputs.
+Workers are reused across entries, so imports are paid once per worker,
+and the node's cores are split evenly between the workers' CPU Contexts.
+Entries are started largest first so that the last ones to finish are small.
+"""
+
+import concurrent.futures
+import multiprocessing
+import pathlib
+import sys
+
+import click
+
+from job_queue import parse_indices
+from platforms import get_available_cpus
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing the entry-XXXX directories",
+)
+@click.option(
+    "--entries",
+    "-e",
+    required=True,
+    type=str,
+    help="Entry indices to run, e.g. 0-15,20",
+)
+@click.option(
+    "--n-workers",
+    "-w",
+    default=4,
+    type=int,
+    help="Number of entries to run concurrently",
+)
+@click.option(
+    "--n-threads",
+    default=0,
+    type=int,
+    help="CPU threads per Context; 0 splits the available cores between workers",
+)
+@click.option(
+    "--platform",
+    default="CPU",
+    type=str,
+    help="OpenMM platform shared by all workers",
+)
+@click.option(
+    "--friction-coefficient",
+    "-fc",
+    default=1.0,
+    type=float,
+    help="Friction coefficient in ps^-1",
+)
+@click.option(
+    "--n-equilibration-steps",
+    "-ne",
+    default=100000,
+    type=int,
+    help="Number of equilibration steps",
+)
+@click.option(
+    "--n-production-steps",
+    "-np",
+    default=1000000,
+    type=int,
+    help="Number of production steps",
+)
+@click.option(
+    "--timestep",
+    "-dt",
+    default=2.0,
+    type=float,
+    help="Timestep in fs",
+)
+@click.option(
+    "--n-barostat-steps",
+    "-nb",
+    default=25,
+    type=int,
+    help="Number of steps between barostat moves",
+)
+@click.option(
+    "--suffix",
+    "-sf",
+    default="",
+    type=str,
+    help="Suffix for output directory",
+)
+@click.option(
+    "--hydrogen-mass",
+    "-hm",
+    default=1.0,
+    type=float,
+    help="Hydrogen mass for HMR",
+)
+@click.option(
+    "--minimizer",
+    default="interchange",
+    type=click.Choice(["interchange", "staged"]),
+    help="Minimization protocol",
+)
+@click.option(
+    "--n-pre-equilibration-steps",
+    "-npe",
+    default=0,
+    type=int,
+    help="Number of annealing/compression steps before equilibration",
+)
+@click.option(
+    "--heartbeat-interval",
+    default=60.0,
+    type=float,
+    help="Minimum seconds between heartbeat updates; 0 disables the heartbeat",
+)
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    help="Record peak RSS and top allocations for each stage",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    entries: str = None,
+    n_workers: int = 4,
+    n_threads: int = 0,
+    platform: str = "CPU",
+    friction_coefficient: float = 1,
+    n_equilibration_steps: int = 100000,
+    n_production_steps: int = 1000000,
+    timestep: float = 2.0,
+    n_barostat_steps: int = 25,
+    suffix: str = "",
+    hydrogen_mass: float = 1,
+    minimizer: str = "interchange",
+    n_pre_equilibration_steps: int = 0,
+    heartbeat_interval: float = 60,
+    profile_memory: bool = False,
+):
+    input_directory = pathlib.Path(input_directory).resolve()
+    entry_directories = []
+    for index in parse_indices(entries):
+        entry_directory = input_directory / f"entry-{index:04d}"
+        if not (entry_directory / "interchange.json").exists():
+            print(f"Skipping {entry_directory.name}: no interchange.json")
+            continue
+        entry_directories.append(entry_directory)
+    # largest first, with the size of the serialized box as a proxy
+    entry_directories.sort(
+        key=lambda directory: (directory / "interchange.json").stat().st_size,
+        reverse=True,
+    )
+
+    n_workers = max(min(n_workers, len(entry_directories)), 1)
+    platform_properties = {}
+    if platform == "CPU":
+        n_threads = n_threads or max(get_available_cpus() // n_workers, 1)
+        platform_properties["Threads"] = str(n_threads)
+    print(
+        f"Running {len(entry_directories)} entries on {n_workers} workers "
+        f"with {platform} {platform_properties}"
+    )
+
+    kwargs = dict(
+        friction_coefficient=friction_coefficient,
+        n_equilibration_steps=n_equilibration_steps,
+        n_production_steps=n_production_steps,
+        timestep=timestep,
+        n_barostat_steps=n_barostat_steps,
+        suffix=suffix,
+        hydrogen_mass=hydrogen_mass,
+        minimizer=minimizer,
+        n_pre_equilibration_steps=n_pre_equilibration_steps,
+        heartbeat_interval=heartbeat_interval,
+        profile_memory=profile_memory,
+        platform=platform,
+        platform_properties=platform_properties,
+    )
+    from engine import run_entry_quietly
+
+    # spawn rather than fork so that no OpenMM or thread-pool state is inherited
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_entry_quietly,
+                str(entry_directory),
+                str(entry_directory / f"simulate-multiple{suffix}.log"),
+                **kwargs,
+            ): entry_directory.name
+            for entry_directory in entry_directories
+        }
+        statuses = {}
+        for future in concurrent.futures.as_completed(futures):
+            entry = futures[future]
+            try:
+                statuses[entry] = future.result()
+            except Exception as e:
+                statuses[entry] = f"failed: {e}"
+            print(f"{entry}: {statuses[entry]}")
+
+    n_failed = sum(status != "finished" for status in statuses.values())
+    print(f"{len(statuses) - n_failed}/{len(statuses)} entries finished")
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+"""
+Superseded by ``simulate-config.py -c configs/openmm-integrator-gpu.yaml``; kept as a record of the runs.
+"""
+
 import click
 import tqdm
 import json
@@ -0,0 +1,152 @@
+"""
+Run every variant of a config file on one box from a single
+parameterization and minimization, several variants at a time.
+
+    python simulate-sweep.py -i . -c configs/friction-coefficient.yaml -w 2
+
+The box is serialized to ``sweep-{config name}/`` and each variant writes
+its usual run directory. One row per variant is written to the results
+table, tagged by the fields the variant changes.
+"""
+
+import concurrent.futures
+import multiprocessing
+import pathlib
+import sys
+
+import click
+
+DEFAULT_CONFIG_FILE = pathlib.Path(__file__).resolve().parent / "configs" / "friction-coefficient.yaml"
+
+
+def get_variant_name(variant: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in sorted(variant.items())) or "base"
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default=".",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Input directory",
+)
+@click.option(
+    "--config-file",
+    "-c",
+    default=str(DEFAULT_CONFIG_FILE),
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="YAML or JSON run configuration with a list of variants",
+)
+@click.option(
+    "--n-workers",
+    "-w",
+    default=1,
+    type=int,
+    help="Number of variants to run concurrently",
+)
+@click.option(
+    "--n-threads",
+    default=0,
+    type=int,
+    help="CPU threads per Context on the CPU platform; 0 splits the available cores",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="sweep-results.csv",
+    type=str,
+    help="Results table, relative to the sweep directory",
+)
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    help="Record peak RSS and top allocations for each stage",
+)
+def main(
+    input_directory: str = ".",
+    config_file: str = str(DEFAULT_CONFIG_FILE),
+    n_workers: int = 1,
+    n_threads: int = 0,
+    output_file: str = "sweep-results.csv",
+    profile_memory: bool = False,
+):
+    import pandas as pd
+
+    from engine import RunConfig, read_config_file
+    from metrics import MetricsRecorder
+    from platforms import get_available_cpus
+    from sweep import check_variants, prepare_sweep, run_variant, summarize_variant
+
+    input_directory = pathlib.Path(input_directory).resolve()
+    data = read_config_file(config_file)
+    variants = data.pop("variants", None) or [{}]
+    fields = sorted({key for variant in variants for key in variant})
+    configs = [RunConfig(**{**data, **variant}) for variant in variants]
+    names = [get_variant_name(variant) for variant in variants]
+    try:
+        check_variants(configs, names)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    sweep_directory = input_directory / f"sweep-{pathlib.Path(config_file).stem}"
+    metrics = MetricsRecorder(
+        sweep_directory / "metrics.jsonl",
+        profile_memory=profile_memory,
+        entry=input_directory.name,
+    )
+    print("Preparing...")
+    with metrics.timed("prepare-sweep", n_variants=len(configs)):
+        prepare_sweep(
+            input_directory,
+            sweep_directory,
+            minimization_settings=configs[0].get_minimization_settings(),
+            metrics=metrics,
+        )
+
+    n_workers = max(min(n_workers, len(configs)), 1)
+    n_threads = n_threads or max(get_available_cpus() // n_workers, 1)
+    for config in configs:
+        if config.platform == "CPU" and "Threads" not in config.platform_properties:
+            config.platform_properties["Threads"] = str(n_threads)
+
+    statuses = {}
+    # spawn rather than fork so that no OpenMM state is inherited
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_variant,
+                str(sweep_directory),
+                str(input_directory),
+                config,
+                name,
+                profile_memory,
+            ): name
+            for config, name in zip(configs, names)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                statuses[name] = future.result()
+            except Exception as e:
+                statuses[name] = f"failed: {e}"
+            print(f"{name}: {statuses[name]}")
+
+    rows = [
+        summarize_variant(input_directory, config, name, fields)
+        for config, name in zip(configs, names)
+    ]
+    df = pd.DataFrame(rows)
+    df.to_csv(sweep_directory / output_file, index=False)
+    print(df.to_string(index=False))
+    print(f"Saved to {sweep_directory / output_file}")
+
+    if any(status != "finished" for status in statuses.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Long-lived simulation workers that pull entries from a local queue.
+
+Queue entries once, then start any number of workers, e.g. one per
+SLURM task. Each worker pays for its imports once and keeps claiming
+entries until the queue is empty or its allocation is about to run out:
+
+    python simulation-worker.py enqueue -e 0-1448
+    python simulation-worker.py work --time-limit 57600 -ne 6000000 ...
+    python simulation-worker.py status
+"""
+
+import os
+import pathlib
+import socket
+import sys
+import threading
+import time
+
+import click
+
+from job_queue import STATUSES, JobQueue, parse_indices
+
+DEFAULT_QUEUE_FILE = "boxes-nosort/n-2000/runs-interchange-final/queue.sqlite"
+
+
+def get_worker_name() -> str:
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    job = os.environ.get("SLURM_JOB_ID")
+    if job:
+        name = f"{name}-{job}"
+    return name
+
+
+class ClaimHeartbeat:
+    """Refresh the claim on an entry from a background thread"""
+
+    def __init__(self, queue: JobQueue, entry: str, worker: str, interval_seconds: float):
+        self.queue = queue
+        self.entry = entry
+        self.worker = worker
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.queue.heartbeat(self.entry, self.worker)
+            except Exception as e:
+                print(f"Failed to refresh claim on {self.entry}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+@click.group()
+@click.option(
+    "--queue-file",
+    "-q",
+    default=DEFAULT_QUEUE_FILE,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="SQLite queue file",
+)
+@click.option(
+    "--stale-seconds",
+    default=1800.0,
+    type=float,
+    help="Seconds without a heartbeat after which a claimed entry is retried",
+)
+@click.option(
+    "--max-attempts",
+    default=3,
+    type=int,
+    help="Number of times an entry is tried before it is marked failed",
+)
+@click.pass_context
+def cli(ctx, queue_file: str, stale_seconds: float, max_attempts: int):
+    ctx.obj = JobQueue(queue_file, stale_seconds=stale_seconds, max_attempts=max_attempts)
+
+
+@cli.command()
+@click.option(
+    "--entries",
+    "-e",
+    required=True,
+    type=str,
+    help="Entry indices to queue, e.g. 0-1448",
+)
+@click.pass_obj
+def enqueue(queue: JobQueue, entries: str):
+    names = [f"entry-{index:04d}" for index in parse_indices(entries)]
+    n_added = queue.add(names)
+    print(f"Queued {n_added} new entries of {len(names)}")
+
+
+@cli.command()
+@click.option(
+    "--status",
+    "-s",
+    "statuses",
+    multiple=True,
+    default=["failed", "diverged"],
+    type=click.Choice(STATUSES),
+    help="Statuses to make pending again",
+)
+@click.pass_obj
+def reset(queue: JobQueue, statuses: list[str]):
+    n_reset = queue.reset(statuses)
+    print(f"Reset {n_reset} entries")
+
+
+@cli.command()
+@click.option(
+    "--show",
+    default=None,
+    type=click.Choice(STATUSES),
+    help="List the entries with this status",
+)
+@click.pass_obj
+def status(queue: JobQueue, show: str):
+    counts = queue.get_counts()
+    for name in STATUSES:
+        print(f"{name}: {counts.get(name, 0)}")
+    if show is not None:
+        for job in queue.get_jobs(show):
+            print(f"{job['entry']} {job['worker']} attempts={job['attempts']} {job['message'] or ''}")
+
+
+@cli.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing the entry-XXXX directories",
+)
+@click.option(
+    "--time-limit",
+    default=0.0,
+    type=float,
+    help="Seconds this worker may run for; 0 runs until the queue is empty",
+)
+@click.option(
+    "--safety-factor",
+    default=1.2,
+    type=float,
+    help="Only claim an entry if this times the longest entry so far still fits",
+)
+@click.option(
+    "--claim-heartbeat-interval",
+    default=300.0,
+    type=float,
+    help="Seconds between refreshes of the claim on the running entry",
+)
+@click.option(
+    "--platform",
+    default="default",
+    type=str,
+    help="OpenMM platform; 'auto' benchmarks and caches the fastest",
+)
+@click.option(
+    "--allow-single-precision/--no-allow-single-precision",
+    default=False,
+    help="Let --platform auto pick single precision on GPUs if it is faster; results may differ",
+)
+@click.option(
+    "--friction-coefficient",
+    "-fc",
+    default=1.0,
+    type=float,
+    help="Friction coefficient in ps^-1",
+)
+@click.option(
+    "--n-equilibration-steps",
+    "-ne",
+    default=100000,
+    type=int,
+    help="Number of equilibration steps",
+)
+@click.option(
+    "--n-production-steps",
+    "-np",
+    default=1000000,
+    type=int,
+    help="Number of production steps",
+)
+@click.option(
+    "--timestep",
+    "-dt",
+    default=2.0,
+    type=float,
+    help="Timestep in fs",
+)
+@click.option(
+    "--n-barostat-steps",
+    "-nb",
+    default=25,
+    type=int,
+    help="Number of steps between barostat moves",
+)
+@click.option(
+    "--suffix",
+    "-sf",
+    default="",
+    type=str,
+    help="Suffix for output directory",
+)
+@click.option(
+    "--hydrogen-mass",
+    "-hm",
+    default=1.0,
+    type=float,
+    help="Hydrogen mass for HMR",
+)
+@click.option(
+    "--minimizer",
+    default="interchange",
+    type=click.Choice(["interchange", "staged"]),
+    help="Minimization protocol",
+)
+@click.option(
+    "--n-pre-equilibration-steps",
+    "-npe",
+    default=0,
+    type=int,
+    help="Number of annealing/compression steps before equilibration",
+)
+@click.pass_obj
+def work(
+    queue: JobQueue,
+    input_directory: str,
+    time_limit: float,
+    safety_factor: float,
+    claim_heartbeat_interval: float,
+    platform: str,
+    **kwargs,
+):
+    start_time = time.time()
+    # paid once for every entry this worker runs
+    from reporters import SimulationDivergedError
+    from engine import run_entry
+
+    input_directory = pathlib.Path(input_directory)
+    worker = get_worker_name()
+    print(f"Worker {worker} ready after {time.time() - start_time:.1f} s")
+
+    longest_seconds = 0.0
+    n_entries = 0
+    while True:
+        if time_limit > 0:
+            remaining = time_limit - (time.time() - start_time)
+            if remaining < longest_seconds * safety_factor:
+                print(f"Stopping with {remaining:.0f} s left")
+                break
+        entry = queue.claim(worker)
+        if entry is None:
+            print("Queue is empty")
+            break
+
+        print(f"Running {entry}")
+        entry_start_time = time.time()
+        with ClaimHeartbeat(queue, entry, worker, claim_heartbeat_interval):
+            try:
+                run_entry(input_directory / entry, platform=platform, **kwargs)
+            except SimulationDivergedError as e:
+                queue.complete(entry, worker, "diverged", message=e.reason)
+            except Exception as e:
+                print(f"{entry} failed: {e!r}")
+                queue.complete(entry, worker, "failed", message=repr(e))
+            else:
+                queue.complete(entry, worker, "finished")
+        seconds = time.time() - entry_start_time
+        longest_seconds = max(longest_seconds, seconds)
+        n_entries += 1
+        print(f"{entry} done in {seconds:.0f} s")
+        sys.stdout.flush()
+
+    print(f"Worker {worker} ran {n_entries} entries")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,216 @@
+"""
+The phases shared by every run of ``engine.py``: minimization of an
+Interchange, one simulated phase with its reporters, and recording how
+a run ended.
+"""
+
+import pathlib
+
+import openmm
+import openmm.app
+import tqdm
+
+from openff.units import unit
+from openff.interchange import Interchange
+
+from metrics import MetricsRecorder, TimedReporter
+from minimization import staged_minimize
+from protocols import run_schedule
+from reporters import (
+    DivergenceWatchdog,
+    HeartbeatReporter,
+    ObservableReporter,
+    SimulationDivergedError,
+    update_heartbeat,
+    write_json_atomic,
+)
+
+
+def plot_statistics(name: str):
+    # plotting libraries are slow to import and only needed here
+    import pandas as pd
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+
+    df = pd.read_csv(f"{name}.csv")
+    cols = [x for x in df.columns if (x != '#"Step"' and "Speed" not in x)]
+    melted = df.melt(
+        id_vars=["Time (ps)"],
+        value_vars=cols,
+        var_name="Quantity",
+        value_name="Value"
+    )
+    g = sns.FacetGrid(melted, col="Quantity", col_wrap=3, sharey=False, sharex=False)
+    g.map(sns.lineplot, "Time (ps)", "Value")
+    g.set_titles("{col_name}")
+    g.savefig(f"{name}_statistics.png", dpi=300)
+    plt.close(g.figure)
+
+
+def simulate(
+    simulation: openmm.app.Simulation,
+    name: str,
+    timestep: unit.Quantity = 2.0 * unit.femtoseconds,  # 2 fs
+    n_total_steps: int = 1000000,
+    output_frequency: int = 1000,
+    metrics: MetricsRecorder = None,
+    heartbeat_interval: float = 60,
+    watchdog_thresholds: dict = None,
+    schedule: list[dict] = None,
+    observables: list[str] = None,
+):
+    """
+    Run one phase of ``simulation`` and write ``{name}.dcd``,
+    ``{name}.csv`` and the plots.
+
+    ``observables`` are also written to ``{name}-observables.csv``
+    by an ``ObservableReporter``.
+    """
+    phase = pathlib.Path(name).name
+    if schedule is not None:
+        n_total_steps = sum(stage["n_steps"] for stage in schedule)
+    if metrics is None:
+        metrics = MetricsRecorder()
+
+    dcd_reporter = TimedReporter(
+        openmm.app.DCDReporter(
+            f"{name}.dcd",
+            output_frequency,
+        )
+    )
+    csv_reporter = TimedReporter(
+        openmm.app.StateDataReporter(
+            f"{name}.csv",
+            output_frequency,
+            step=True,
+            time=True,
+            potentialEnergy=True,
+            kineticEnergy=True,
+            totalEnergy=True,
+            temperature=True,
+            volume=True,
+            density=True,
+            speed=True,
+            separator=",",
+        )
+    )
+    # the watchdog shares the wrapping of the DCD and CSV reporters, so
+    # OpenMM reports it in their group and, added first, before them
+    if watchdog_thresholds is not None:
+        simulation.reporters.append(
+            DivergenceWatchdog(name, output_frequency, **watchdog_thresholds)
+        )
+    simulation.reporters.append(dcd_reporter)
+    simulation.reporters.append(csv_reporter)
+    observable_reporter = None
+    if observables:
+        observable_reporter = TimedReporter(
+            ObservableReporter(f"{name}-observables.csv", output_frequency, observables)
+        )
+        simulation.reporters.append(observable_reporter)
+
+    timestep_fs = timestep.m_as(unit.femtoseconds)
+    heartbeat = None
+    if heartbeat_interval > 0:
+        heartbeat = HeartbeatReporter(
+            pathlib.Path(name).parent / "heartbeat.json",
+            output_frequency,
+            total_steps=n_total_steps,
+            timestep_fs=timestep_fs,
+            phase=phase,
+            interval_seconds=heartbeat_interval,
+        )
+        simulation.reporters.append(heartbeat)
+
+    steps = list(range(n_total_steps // 10))
+    with metrics.timed(
+        "md", phase=phase, n_steps=n_total_steps, timestep_fs=timestep_fs
+    ) as record:
+        if schedule is None:
+            for i in tqdm.tqdm(steps):
+                simulation.step(10)
+        else:
+            run_schedule(simulation, schedule)
+        record["reporter_seconds"] = dcd_reporter.seconds + csv_reporter.seconds
+
+    if heartbeat is not None:
+        heartbeat.write("completed", step=simulation.currentStep)
+
+    reporter_io = {}
+    if observable_reporter is not None:
+        observable_reporter.reporter.close()
+        reporter_io["observables_seconds"] = observable_reporter.seconds
+    metrics.record(
+        "reporter-io",
+        phase=phase,
+        dcd_seconds=dcd_reporter.seconds,
+        csv_seconds=csv_reporter.seconds,
+        n_reports=csv_reporter.n_reports,
+        **reporter_io,
+    )
+
+    # plot statistics
+    with metrics.timed("plotting", phase=phase):
+        plot_statistics(name)
+
+    return simulation
+
+
+# written by minimize_interchange
+MINIMIZED_FILES = ["minimized-interchange.json", "minimized.pdb", "minimized.gro"]
+
+
+def minimize_interchange(
+    interchange: Interchange,
+    output_directory: pathlib.Path,
+    minimizer: str = "interchange",
+    metrics: MetricsRecorder = None,
+    **kwargs,
+):
+    """
+    Minimize ``interchange`` in place and save the minimized structure.
+
+    ``kwargs`` are passed to ``staged_minimize`` for the staged minimizer.
+    """
+    if metrics is None:
+        metrics = MetricsRecorder()
+    if minimizer == "staged":
+        with metrics.timed("minimize", minimizer=minimizer):
+            staged_minimize(interchange, metrics=metrics, **kwargs)
+    else:
+        # minimize. Roughly approximates Evaluator
+        with metrics.timed("minimize", minimizer=minimizer):
+            interchange.minimize(max_iterations=0)
+
+    # save the minimized structure
+    with metrics.timed("serialize", phase="minimized"):
+        with (output_directory / "minimized-interchange.json").open("w") as f:
+            f.write(interchange.json())
+        interchange.to_pdb(output_directory / "minimized.pdb")
+        interchange.to_gro(output_directory / "minimized.gro")
+
+
+def record_divergence(
+    error: SimulationDivergedError,
+    output_directory: pathlib.Path,
+    metrics: MetricsRecorder,
+    heartbeat_interval: float = 60,
+):
+    """Mark a run as diverged in ``status.json``, the metrics and the heartbeat"""
+    print(error)
+    status = {
+        "status": "diverged",
+        "reason": error.reason,
+        "step": error.step,
+        "diagnostics": str(error.diagnostics_file),
+    }
+    write_json_atomic(status, output_directory / "status.json")
+    metrics.record("diverged", **status)
+    if heartbeat_interval > 0:
+        update_heartbeat(output_directory / "heartbeat.json", "failed", reason=error.reason)
+
+
+def record_finished(output_directory: pathlib.Path, heartbeat_interval: float = 60):
+    write_json_atomic({"status": "finished"}, output_directory / "status.json")
+    if heartbeat_interval > 0:
+        update_heartbeat(output_directory / "heartbeat.json", "finished")
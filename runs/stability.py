@@ -0,0 +1,175 @@
+"""
+Short stability probes for choosing the largest safe timestep.
+
+Each probe thermalizes the box briefly with Langevin dynamics and then
+integrates it at constant energy with a Verlet integrator. A timestep is
+considered safe if the total energy drift stays below a threshold and
+nothing becomes NaN. Constraints are not checked: the integrator
+re-applies them to its tolerance every step, so they always hold.
+"""
+
+import time
+
+import numpy as np
+import openmm
+from openmm import unit as openmm_unit
+
+from openff.units import unit
+from openff.units.openmm import to_openmm
+from openff.interchange import Interchange
+
+from reporters import BOLTZMANN, get_degrees_of_freedom
+
+KJ_PER_MOL = openmm_unit.kilojoules_per_mole
+
+
+def probe_timestep(
+    interchange: Interchange,
+    timestep: unit.Quantity,
+    hydrogen_mass: float = 1,
+    temperature: unit.Quantity = 298.15 * unit.kelvin,
+    n_thermalization_steps: int = 500,
+    n_steps: int = 2000,
+    report_interval: int = 50,
+    platform_name: str = "CPU",
+    platform_properties: dict = None,
+) -> dict:
+    """
+    Integrate ``interchange`` at constant energy with ``timestep``
+    and report the energy drift.
+
+    Parameters
+    ----------
+    interchange: Interchange
+        Minimized box
+    timestep: unit.Quantity
+        Timestep to probe
+    hydrogen_mass: float
+        Hydrogen mass for HMR, in multiples of the hydrogen mass
+    temperature: unit.Quantity
+        Temperature to thermalize at
+    n_thermalization_steps: int
+        Number of Langevin steps before the constant-energy run
+    n_steps: int
+        Number of constant-energy steps
+    report_interval: int
+        Number of steps between total energy samples
+    platform_name: str
+        OpenMM platform to probe on
+    platform_properties: dict
+        Properties of the platform
+    """
+    system = interchange.to_openmm_system(hydrogen_mass=1.007947 * hydrogen_mass)
+    platform = openmm.Platform.getPlatformByName(platform_name)
+    platform_properties = platform_properties or {}
+    timestep_fs = timestep.m_as(unit.femtoseconds)
+    result = {
+        "timestep_fs": timestep_fs,
+        "hydrogen_mass": hydrogen_mass,
+        "n_steps": n_steps,
+    }
+
+    start_time = time.perf_counter()
+    thermostat = openmm.LangevinMiddleIntegrator(
+        to_openmm(temperature),
+        1.0 / openmm_unit.picosecond,
+        to_openmm(timestep),
+    )
+    context = openmm.Context(system, thermostat, platform, platform_properties)
+    context.setPeriodicBoxVectors(*to_openmm(interchange.box))
+    context.setPositions(to_openmm(interchange.positions))
+    context.setVelocitiesToTemperature(to_openmm(temperature))
+    try:
+        thermostat.step(n_thermalization_steps)
+        state = context.getState(getPositions=True, getVelocities=True)
+    except openmm.OpenMMException as e:
+        return {**result, "stable": False, "reason": f"thermalization failed: {e}"}
+    finally:
+        del context
+
+    integrator = openmm.VerletIntegrator(to_openmm(timestep))
+    context = openmm.Context(system, integrator, platform, platform_properties)
+    context.setPeriodicBoxVectors(*state.getPeriodicBoxVectors())
+    context.setPositions(state.getPositions())
+    context.setVelocities(state.getVelocities())
+
+    times = []
+    energies = []
+    reason = ""
+    try:
+        for step in range(0, n_steps, report_interval):
+            integrator.step(report_interval)
+            state = context.getState(getEnergy=True)
+            energy = (
+                state.getPotentialEnergy() + state.getKineticEnergy()
+            ).value_in_unit(KJ_PER_MOL)
+            if not np.isfinite(energy):
+                reason = f"total energy is {energy} at step {step + report_interval}"
+                break
+            times.append((step + report_interval) * timestep_fs * 1e-6)
+            energies.append(energy)
+    except openmm.OpenMMException as e:
+        reason = str(e)
+    finally:
+        del context
+
+    result["seconds"] = time.perf_counter() - start_time
+    if reason or len(energies) < 2:
+        return {**result, "stable": False, "reason": reason or "too few energy samples"}
+
+    # drift in kT per nanosecond per degree of freedom
+    n_dof = get_degrees_of_freedom(system)
+    kt = BOLTZMANN * temperature.m_as(unit.kelvin)
+    slope, _ = np.polyfit(times, energies, 1)
+    result["drift_kt_per_ns_per_dof"] = float(abs(slope) / kt / n_dof)
+    result["energy_fluctuation_kt_per_dof"] = float(np.std(energies) / kt / n_dof)
+    return result
+
+
+def select_timestep(
+    interchange: Interchange,
+    timesteps: list[float] = (2.0, 2.5, 3.0, 3.5, 4.0),
+    hydrogen_masses: list[float] = (1, 3),
+    max_drift: float = 0.02,
+    **kwargs,
+) -> dict:
+    """
+    Probe increasing timesteps, with and without HMR, and pick
+    the largest safe one. Ties go to the smaller hydrogen mass.
+
+    Timesteps are in fs. For each hydrogen mass, probing stops
+    at the first unsafe timestep.
+    """
+    probes = []
+    for hydrogen_mass in sorted(hydrogen_masses):
+        for timestep in sorted(timesteps):
+            result = probe_timestep(
+                interchange,
+                timestep * unit.femtoseconds,
+                hydrogen_mass=hydrogen_mass,
+                **kwargs,
+            )
+            # probes that ran to completion still have to pass the thresholds
+            if "stable" not in result:
+                if result["drift_kt_per_ns_per_dof"] > max_drift:
+                    result.update(stable=False, reason="energy drift")
+                else:
+                    result["stable"] = True
+            print(
+                f"dt={timestep} fs, hydrogen mass x{hydrogen_mass}: "
+                f"{'stable' if result['stable'] else 'unstable (' + result['reason'] + ')'}"
+            )
+            probes.append(result)
+            if not result["stable"]:
+                break
+
+    stable = [probe for probe in probes if probe["stable"]]
+    if not stable:
+        raise RuntimeError("No probed timestep was stable")
+    best = max(stable, key=lambda probe: (probe["timestep_fs"], -probe["hydrogen_mass"]))
+    return {
+        "timestep_fs": best["timestep_fs"],
+        "hydrogen_mass": best["hydrogen_mass"],
+        "max_drift": max_drift,
+        "probes": probes,
+    }
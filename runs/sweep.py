@@ -0,0 +1,246 @@
+"""
+Parameter sweeps that parameterize and minimize a box once.
+
+``prepare_sweep`` serializes the minimized System, State and topology of
+a box. Each variant then starts from a clone of that XML, with hydrogen
+masses repartitioned and the integrator swapped as its config requires,
+so that variants can run in separate processes without touching the
+force field or Interchange again.
+"""
+
+import json
+import pathlib
+
+import numpy as np
+import openmm
+import openmm.app
+from openmm import unit as openmm_unit
+
+from openff.units.openmm import to_openmm
+from openff.interchange import Interchange
+
+from engine import RunConfig, SimulationEngine, run_config
+from metrics import MetricsRecorder, load_metrics
+from nonbonded import apply_nonbonded_settings
+from reporters import SimulationDivergedError
+from simulation import minimize_interchange
+
+HYDROGEN_MASS = 1.007947
+# anything lighter than this (in Da) is treated as a hydrogen
+MAX_HYDROGEN_MASS = 1.1
+
+
+def get_bonded_pairs(system: openmm.System) -> set[tuple[int, int]]:
+    """Pairs of particles joined by a harmonic bond or a constraint"""
+    pairs = set()
+    for i in range(system.getNumConstraints()):
+        p1, p2, _ = system.getConstraintParameters(i)
+        pairs.add((min(p1, p2), max(p1, p2)))
+    for force in system.getForces():
+        if isinstance(force, openmm.HarmonicBondForce):
+            for i in range(force.getNumBonds()):
+                p1, p2, *_ = force.getBondParameters(i)
+                pairs.add((min(p1, p2), max(p1, p2)))
+    return pairs
+
+
+def repartition_hydrogen_mass(system: openmm.System, hydrogen_mass: float):
+    """
+    Set the mass of every hydrogen to ``hydrogen_mass`` times the hydrogen
+    mass in place, taking the difference from the heavy atom it is bonded to.
+
+    Water is skipped, as in Interchange.
+    """
+    masses = np.array([
+        system.getParticleMass(i).value_in_unit(openmm_unit.dalton)
+        for i in range(system.getNumParticles())
+    ])
+    is_hydrogen = (masses > 0) & (masses < MAX_HYDROGEN_MASS)
+    neighbors = [[] for _ in range(len(masses))]
+    for p1, p2 in get_bonded_pairs(system):
+        neighbors[p1].append(p2)
+        neighbors[p2].append(p1)
+
+    new_mass = hydrogen_mass * HYDROGEN_MASS
+    for heavy, bonded in enumerate(neighbors):
+        if is_hydrogen[heavy] or masses[heavy] == 0:
+            continue
+        hydrogens = [i for i in bonded if is_hydrogen[i]]
+        # an oxygen bonded to exactly two hydrogens and nothing else
+        if len(hydrogens) == 2 and len(bonded) == 2 and round(masses[heavy]) == 16:
+            continue
+        for hydrogen in hydrogens:
+            transferred = new_mass - masses[hydrogen]
+            system.setParticleMass(hydrogen, new_mass * openmm_unit.dalton)
+            masses[heavy] -= transferred
+        system.setParticleMass(heavy, masses[heavy] * openmm_unit.dalton)
+
+
+class SerializedSystemEngine(SimulationEngine):
+    """A ``SimulationEngine`` that starts from a prepared sweep directory"""
+
+    def __init__(self, sweep_directory: pathlib.Path):
+        sweep_directory = pathlib.Path(sweep_directory)
+        self.interchange = None
+        pdb = openmm.app.PDBFile(str(sweep_directory / "minimized.pdb"))
+        self.topology = pdb.topology
+        with (sweep_directory / "system.xml").open("r") as f:
+            self.base_system = openmm.XmlSerializer.deserialize(f.read())
+        with (sweep_directory / "state.xml").open("r") as f:
+            state = openmm.XmlSerializer.deserialize(f.read())
+        self.positions = state.getPositions(asNumpy=True)
+        self.box_vectors = state.getPeriodicBoxVectors()
+        self.minimized = "serialized"
+        self._systems = {}
+
+    def get_system(self, hydrogen_mass: float = 1, nonbonded_settings: dict = None) -> openmm.System:
+        key = (hydrogen_mass, json.dumps(nonbonded_settings, sort_keys=True))
+        if key not in self._systems:
+            system = openmm.XmlSerializer.clone(self.base_system)
+            if hydrogen_mass != 1:
+                repartition_hydrogen_mass(system, hydrogen_mass)
+            if nonbonded_settings is not None:
+                apply_nonbonded_settings(system, nonbonded_settings)
+            self._systems[key] = system
+        return openmm.XmlSerializer.clone(self._systems[key])
+
+    def minimize(self, *args, **kwargs):
+        # minimized once in prepare_sweep
+        pass
+
+    def to_pdb(self, output_file: pathlib.Path):
+        self.topology.setPeriodicBoxVectors(self.box_vectors)
+        with open(output_file, "w") as f:
+            openmm.app.PDBFile.writeFile(self.topology, self.positions, f)
+
+
+def check_variants(configs: list[RunConfig], names: list[str]):
+    """
+    Raise ValueError unless the variants can start from one prepared box
+    and write to separate run directories.
+    """
+    minimization_settings = {
+        json.dumps(config.get_minimization_settings(), sort_keys=True) for config in configs
+    }
+    if len(minimization_settings) > 1:
+        raise ValueError(
+            "Variants change the minimizer or its settings, "
+            "but the box is minimized once for all of them"
+        )
+    variants_by_run = {}
+    for config, name in zip(configs, names):
+        variants_by_run.setdefault(config.run_name, []).append(name)
+    for run_name, variants in variants_by_run.items():
+        if len(variants) > 1:
+            raise ValueError(
+                f"Variants {variants} would all write to {run_name}; "
+                f"add the fields they change to name_template"
+            )
+
+
+def prepare_sweep(
+    input_directory: pathlib.Path,
+    sweep_directory: pathlib.Path,
+    minimization_settings: dict = None,
+    metrics: MetricsRecorder = None,
+) -> pathlib.Path:
+    """
+    Parameterize and minimize the box in ``input_directory`` once and write
+    ``system.xml``, ``state.xml`` and ``minimized.pdb`` to ``sweep_directory``.
+    ``minimization_settings`` are passed to ``minimize_interchange``, as
+    from ``RunConfig.get_minimization_settings``.
+
+    Hydrogen masses are left unpartitioned; variants apply their own.
+    """
+    sweep_directory = pathlib.Path(sweep_directory)
+    if all((sweep_directory / name).exists() for name in ["system.xml", "state.xml", "minimized.pdb"]):
+        print(f"{sweep_directory} is already prepared")
+        return sweep_directory
+    sweep_directory.mkdir(parents=True, exist_ok=True)
+    if metrics is None:
+        metrics = MetricsRecorder()
+
+    with metrics.timed("parse-interchange") as record:
+        interchange = Interchange.parse_file(pathlib.Path(input_directory) / "interchange.json")
+        record["n_atoms"] = interchange.topology.n_atoms
+    minimize_interchange(interchange, sweep_directory, metrics=metrics, **(minimization_settings or {}))
+
+    with metrics.timed("serialize", phase="sweep"):
+        system = interchange.to_openmm_system()
+        # a throwaway Context is the simplest way to get a serializable State
+        context = openmm.Context(
+            system,
+            openmm.VerletIntegrator(1.0 * openmm_unit.femtoseconds),
+            openmm.Platform.getPlatformByName("Reference"),
+        )
+        context.setPeriodicBoxVectors(*to_openmm(interchange.box))
+        context.setPositions(to_openmm(interchange.positions))
+        state = context.getState(getPositions=True)
+        del context
+        with (sweep_directory / "system.xml").open("w") as f:
+            f.write(openmm.XmlSerializer.serialize(system))
+        with (sweep_directory / "state.xml").open("w") as f:
+            f.write(openmm.XmlSerializer.serialize(state))
+    return sweep_directory
+
+
+def run_variant(
+    sweep_directory: str,
+    input_directory: str,
+    config: RunConfig,
+    variant: str,
+    profile_memory: bool = False,
+) -> str:
+    """Run one variant from a prepared sweep; returns the final status"""
+    engine = SerializedSystemEngine(sweep_directory)
+    try:
+        run_config(
+            input_directory,
+            config,
+            engine=engine,
+            profile_memory=profile_memory,
+            variant=variant,
+            sweep=pathlib.Path(sweep_directory).name,
+        )
+    except SimulationDivergedError:
+        return "diverged"
+    return "finished"
+
+
+def summarize_variant(
+    input_directory: pathlib.Path,
+    config: RunConfig,
+    variant: str,
+    fields: list[str],
+) -> dict:
+    """One row of the sweep results table"""
+    import pandas as pd
+
+    output_directory = pathlib.Path(input_directory) / config.run_name
+    row = {"variant": variant, "run": config.run_name}
+    row.update({field: getattr(config, field) for field in fields})
+
+    status_file = output_directory / "status.json"
+    row["status"] = "missing"
+    if status_file.exists():
+        with status_file.open("r") as f:
+            row["status"] = json.load(f)["status"]
+
+    metrics_file = output_directory / "metrics.jsonl"
+    if metrics_file.exists():
+        for record in load_metrics(metrics_file):
+            if record["stage"] == "md" and record.get("phase") == "production":
+                row["production_ns_per_day"] = record.get("ns_per_day")
+
+    production_csv = output_directory / "production.csv"
+    if production_csv.exists():
+        df = pd.read_csv(production_csv)
+        for column, name in [
+            ("Density (g/mL)", "density"),
+            ("Potential Energy (kJ/mole)", "potential_energy"),
+            ("Temperature (K)", "temperature_observed"),
+        ]:
+            if column in df.columns:
+                row[f"{name}_mean"] = df[column].mean()
+                row[f"{name}_std"] = df[column].std()
+    return row
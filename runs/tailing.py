@@ -0,0 +1,106 @@
+"""
+Incremental reading of reporter CSVs that are still being written.
+
+``CSVTail`` remembers how many bytes of a file it has consumed and only
+reads what was appended since, leaving a partially written last line for
+the next poll. ``RunTail`` follows the ``equilibration.csv`` and then
+``production.csv`` of one run as a single timeseries of observables.
+"""
+
+import csv
+import pathlib
+
+import numpy as np
+
+# StateDataReporter columns that are not observables, shared by the
+# scripts that read reporter CSVs
+IGNORE_COLUMNS = ['#"Step"', "Time (ps)", "Speed (ns/day)"]
+STEP_COLUMN = '#"Step"'
+
+
+class CSVTail:
+    def __init__(self, csv_file: pathlib.Path):
+        self.csv_file = pathlib.Path(csv_file)
+        self.offset = 0
+        self.header = None
+
+    def get_size(self) -> int:
+        try:
+            return self.csv_file.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def is_truncated(self) -> bool:
+        """Whether the file was rewritten since it was last read, e.g. by a restarted job"""
+        return self.get_size() < self.offset
+
+    def read_new(self) -> list[list[str]]:
+        """Complete lines appended since the last call, split into fields"""
+        size = self.get_size()
+        if size <= self.offset:
+            return []
+
+        with self.csv_file.open("rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        lines = data[:end].decode().splitlines()
+        rows = list(csv.reader(lines))
+        if self.header is None and rows:
+            self.header = rows.pop(0)
+        return rows
+
+
+class RunTail:
+    """The observables of one run, equilibration followed by production"""
+
+    def __init__(self, run_directory: pathlib.Path, columns: list[str] = None):
+        self.run_directory = pathlib.Path(run_directory)
+        self.tails = [
+            CSVTail(self.run_directory / "equilibration.csv"),
+            CSVTail(self.run_directory / "production.csv"),
+        ]
+        self.columns = columns
+        self.rows = []
+        self.step = None
+
+    def reset(self):
+        for tail in self.tails:
+            tail.offset = 0
+            tail.header = None
+        self.rows = []
+        self.step = None
+
+    def update(self) -> int:
+        """
+        Read appended rows; returns the number of new samples. If either
+        file was rewritten, both are read again from the start.
+        """
+        if any(tail.is_truncated() for tail in self.tails):
+            self.reset()
+        n_rows = len(self.rows)
+        for tail in self.tails:
+            rows = tail.read_new()
+            if not rows:
+                continue
+            header = tail.header
+            if self.columns is None:
+                self.columns = [column for column in header if column not in IGNORE_COLUMNS]
+            indices = [header.index(column) for column in self.columns if column in header]
+            if len(indices) < len(self.columns):
+                continue
+            step_index = header.index(STEP_COLUMN) if STEP_COLUMN in header else None
+            for row in rows:
+                try:
+                    self.rows.append([float(row[i]) for i in indices])
+                except (IndexError, ValueError):
+                    continue
+                if step_index is not None:
+                    self.step = int(float(row[step_index]))
+        return len(self.rows) - n_rows
+
+    @property
+    def observables(self) -> np.ndarray:
+        """Samples so far, shape (n_samples, n_columns)"""
+        return np.array(self.rows, dtype=float).reshape(-1, len(self.columns or []))
@@ -0,0 +1,59 @@
+"""
+Tests of the claim files of ``job_queue.JobQueue``.
+
+    python -m pytest test_job_queue.py
+"""
+
+import contextlib
+import os
+import sqlite3
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+def fail_commits(queue: JobQueue):
+    """Make every transaction of ``queue`` fail after its statements, as a failed COMMIT would"""
+    transaction = queue.transaction
+
+    @contextlib.contextmanager
+    def failing_transaction():
+        with transaction() as connection:
+            yield connection
+            raise sqlite3.OperationalError("database is locked")
+
+    queue.transaction = failing_transaction
+    return transaction
+
+
+def test_failed_commit_releases_claim(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite")
+    queue.add(["entry-0000"])
+
+    transaction = fail_commits(queue)
+    with pytest.raises(sqlite3.OperationalError):
+        queue.claim("worker-1")
+    queue.transaction = transaction
+
+    assert not queue.get_claim_file("entry-0000", 1).exists()
+    assert queue.get_jobs()[0]["attempts"] == 0
+    assert queue.claim("worker-2") == "entry-0000"
+    assert queue.get_jobs()[0]["attempts"] == 1
+
+
+def test_stale_unrecorded_claim_is_skipped(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite", stale_seconds=60)
+    queue.add(["entry-0000"])
+
+    # a worker killed between creating the claim file and committing
+    assert queue.create_claim_file("entry-0000", 1, "worker-1")
+    assert queue.claim("worker-2") is None
+
+    old = time.time() - 120
+    os.utime(queue.get_claim_file("entry-0000", 1), (old, old))
+    assert queue.claim("worker-2") == "entry-0000"
+    job = queue.get_jobs()[0]
+    assert job["attempts"] == 2
+    assert job["worker"] == "worker-2"
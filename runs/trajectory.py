@@ -0,0 +1,390 @@
+"""
+Chunked, parallel analysis of DCD trajectories written by OpenMM.
+
+``DCDFile`` memory-maps the frames of a DCD, so that reading frames
+``start:stop`` touches only those bytes. An analysis reduces the frames
+of a range to a partial result of fixed size; ``run_analysis`` splits
+the trajectory into frame ranges, computes their partial results in
+worker processes a chunk of frames at a time, and sums them. Memory is
+bounded by the chunk size, not the trajectory length.
+
+Boxes must be rectangular, which is the case for all boxes here.
+"""
+
+import concurrent.futures
+import pathlib
+import struct
+
+import numpy as np
+
+# g/mL per Da/nm^3
+DENSITY_CONVERSION = 1.66053906660e-3
+
+
+class DCDFile:
+    """
+    Frames of a CHARMM-format DCD as written by ``openmm.app.DCDReporter``.
+
+    The number of frames is taken from the file size, so trajectories
+    that are still being written can be read up to the last whole frame.
+    """
+
+    def __init__(self, dcd_file: pathlib.Path):
+        self.dcd_file = pathlib.Path(dcd_file)
+        with self.dcd_file.open("rb") as f:
+            # header record: "CORD" and 20 control integers
+            length, = struct.unpack("<i", f.read(4))
+            header = f.read(length)
+            f.read(4)
+            if header[:4] != b"CORD":
+                raise ValueError(f"{dcd_file} is not a DCD file")
+            control = struct.unpack("<20i", header[4:84])
+            self.has_box = bool(control[10])
+            # title record
+            length, = struct.unpack("<i", f.read(4))
+            f.seek(length + 4, 1)
+            # number of atoms record
+            f.read(4)
+            self.n_atoms, = struct.unpack("<i", f.read(4))
+            f.read(4)
+            self.header_size = f.tell()
+
+        fields = []
+        if self.has_box:
+            fields += [("box_start", "<i4"), ("box", "<f8", 6), ("box_end", "<i4")]
+        for axis in "xyz":
+            fields += [
+                (f"{axis}_start", "<i4"),
+                (axis, "<f4", self.n_atoms),
+                (f"{axis}_end", "<i4"),
+            ]
+        self.frame_dtype = np.dtype(fields)
+        size = self.dcd_file.stat().st_size - self.header_size
+        self.n_frames = size // self.frame_dtype.itemsize
+        self.frames = np.memmap(
+            self.dcd_file,
+            dtype=self.frame_dtype,
+            mode="r",
+            offset=self.header_size,
+            shape=(self.n_frames,),
+        )
+
+    def read(self, start: int, stop: int, step: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positions in nm, shape (n_frames, n_atoms, 3), and box lengths
+        in nm, shape (n_frames, 3), of frames ``start:stop:step``.
+        """
+        frames = self.frames[start:stop:step]
+        positions = np.stack([frames["x"], frames["y"], frames["z"]], axis=-1) / 10
+        if not self.has_box:
+            return positions, np.full((len(frames), 3), np.nan)
+        # a, cos(gamma), b, cos(beta), cos(alpha), c in angstroms
+        box = np.asarray(frames["box"])
+        if np.abs(box[:, [1, 3, 4]]).max(initial=0) > 1e-6:
+            raise ValueError("Only rectangular boxes are supported")
+        return positions, box[:, [0, 2, 5]] / 10
+
+
+def get_molecule_ids(n_atoms: int, bonds: list[tuple[int, int]]) -> np.ndarray:
+    """Index of the molecule of each atom, from the bonds between atoms"""
+    parents = np.arange(n_atoms)
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in bonds:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.array([find(i) for i in range(n_atoms)])
+    return np.unique(roots, return_inverse=True)[1]
+
+
+def get_neighbor_distances(
+    positions_a: np.ndarray,
+    positions_b: np.ndarray,
+    box: np.ndarray,
+    cutoff: float,
+    excluded_a: np.ndarray = None,
+    excluded_b: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Minimum-image distances of all pairs of an atom of ``positions_a``
+    and one of ``positions_b`` closer than ``cutoff``, from a cell list of
+    ``positions_b``. Each A atom is compared with the padded contents of
+    the 27 cells around it at once, one neighbouring cell offset at a time.
+
+    Pairs with equal ``excluded_a`` and ``excluded_b`` labels (e.g. the
+    same atom, or the same molecule) are left out.
+    """
+    box = np.asarray(box, dtype=float)
+    # dimensions too short for three cells are not split
+    n_cells = np.floor(box / cutoff).astype(int)
+    n_cells[n_cells < 3] = 1
+    cell_size = box / n_cells
+
+    def get_cells(positions):
+        wrapped = positions - box * np.floor(positions / box)
+        cells = np.minimum((wrapped / cell_size).astype(int), n_cells - 1)
+        return cells, wrapped
+
+    cells_a, wrapped_a = get_cells(positions_a)
+    cells_b, wrapped_b = get_cells(positions_b)
+    flat_b = np.ravel_multi_index(cells_b.T, n_cells)
+
+    # contents of each cell, padded with -1
+    order = np.argsort(flat_b, kind="stable")
+    counts = np.bincount(flat_b, minlength=np.prod(n_cells))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    cell_atoms = np.full((len(counts), max(counts.max(initial=0), 1)), -1)
+    rank = np.arange(len(order)) - starts[flat_b[order]]
+    cell_atoms[flat_b[order], rank] = order
+
+    offsets = [
+        np.array([i, j, k])
+        for i in (range(-1, 2) if n_cells[0] > 1 else [0])
+        for j in (range(-1, 2) if n_cells[1] > 1 else [0])
+        for k in (range(-1, 2) if n_cells[2] > 1 else [0])
+    ]
+    distances = []
+    for offset in offsets:
+        neighbor_cells = np.ravel_multi_index(((cells_a + offset) % n_cells).T, n_cells)
+        candidates = cell_atoms[neighbor_cells]
+        valid = candidates >= 0
+        delta = wrapped_b[candidates] - wrapped_a[:, None, :]
+        delta -= box * np.round(delta / box)
+        r = np.sqrt((delta ** 2).sum(axis=-1))
+        keep = valid & (r < cutoff)
+        if excluded_a is not None:
+            keep &= excluded_b[candidates] != excluded_a[:, None]
+        distances.append(r[keep])
+    return np.concatenate(distances)
+
+
+def get_centers_of_mass(positions: np.ndarray, masses: np.ndarray, molecule_ids: np.ndarray) -> np.ndarray:
+    """
+    Centers of mass of each molecule in each frame, shape
+    (n_frames, n_molecules, 3). Molecules must be whole, as they are
+    in OpenMM's wrapped output.
+    """
+    n_molecules = molecule_ids.max() + 1
+    totals = np.bincount(molecule_ids, weights=masses, minlength=n_molecules)
+    centers = np.zeros((len(positions), n_molecules, 3))
+    for axis in range(3):
+        for i, frame in enumerate(positions[..., axis]):
+            centers[i, :, axis] = np.bincount(molecule_ids, weights=frame * masses, minlength=n_molecules)
+    return centers / totals[:, None]
+
+
+class Analysis:
+    """
+    An analysis of frames whose partial results over frame ranges add up.
+
+    Subclasses implement ``accumulate``, which adds a chunk of frames to
+    a dictionary of arrays, and ``finalize``, which turns the sum of all
+    partial results into a table.
+    """
+
+    def compute(self, dcd_file: str, start: int, stop: int, chunk_size: int = 100) -> dict:
+        dcd = DCDFile(dcd_file)
+        partial = {}
+        for chunk_start in range(start, stop, chunk_size):
+            positions, boxes = dcd.read(chunk_start, min(chunk_start + chunk_size, stop))
+            self.accumulate(partial, positions, boxes)
+        return partial
+
+    def accumulate(self, partial: dict, positions: np.ndarray, boxes: np.ndarray):
+        raise NotImplementedError
+
+    def finalize(self, result: dict):
+        raise NotImplementedError
+
+
+def add_to(partial: dict, key: str, value):
+    partial[key] = partial.get(key, 0) + value
+
+
+class RDF(Analysis):
+    """
+    Radial distribution function between atoms ``selection_a`` and
+    ``selection_b``, leaving out pairs in the same molecule if
+    ``molecule_ids`` are given and otherwise only self pairs.
+    """
+
+    def __init__(
+        self,
+        selection_a: np.ndarray,
+        selection_b: np.ndarray,
+        cutoff: float = 1.2,
+        bin_width: float = 0.01,
+        molecule_ids: np.ndarray = None,
+    ):
+        self.selection_a = np.asarray(selection_a)
+        self.selection_b = np.asarray(selection_b)
+        self.cutoff = cutoff
+        self.bin_width = bin_width
+        self.n_bins = int(np.ceil(cutoff / bin_width))
+        if molecule_ids is None:
+            labels = np.arange(max(self.selection_a.max(), self.selection_b.max()) + 1)
+        else:
+            labels = np.asarray(molecule_ids)
+        self.labels_a = labels[self.selection_a]
+        self.labels_b = labels[self.selection_b]
+        # pairs that are never counted, for the normalization
+        _, counts_a = np.unique(self.labels_a, return_counts=True)
+        shared = dict(zip(*np.unique(self.labels_b, return_counts=True)))
+        n_excluded = sum(
+            count * shared.get(label, 0)
+            for label, count in zip(np.unique(self.labels_a), counts_a)
+        )
+        self.n_pairs = len(self.selection_a) * len(self.selection_b) - n_excluded
+
+    def accumulate(self, partial, positions, boxes):
+        histogram = np.zeros(self.n_bins)
+        pair_density = 0.0
+        for frame, box in zip(positions, boxes):
+            if self.cutoff > box.min() / 2:
+                raise ValueError(f"Cutoff {self.cutoff} nm exceeds half the box, {box.min() / 2:.3f} nm")
+            distances = get_neighbor_distances(
+                frame[self.selection_a],
+                frame[self.selection_b],
+                box,
+                self.cutoff,
+                self.labels_a,
+                self.labels_b,
+            )
+            histogram += np.bincount(
+                np.minimum((distances / self.bin_width).astype(int), self.n_bins - 1),
+                minlength=self.n_bins,
+            )
+            pair_density += self.n_pairs / np.prod(box)
+        add_to(partial, "histogram", histogram)
+        add_to(partial, "pair_density", pair_density)
+        add_to(partial, "n_frames", len(positions))
+
+    def finalize(self, result):
+        import pandas as pd
+
+        edges = np.arange(self.n_bins + 1) * self.bin_width
+        shell_volumes = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+        return pd.DataFrame({
+            "r": (edges[1:] + edges[:-1]) / 2,
+            "g": result["histogram"] / (result["pair_density"] * shell_volumes),
+        })
+
+
+class DensityProfile(Analysis):
+    """Mass density along one box axis, in bins of fractional coordinates"""
+
+    def __init__(self, masses: np.ndarray, axis: int = 2, n_bins: int = 100):
+        self.masses = np.asarray(masses)
+        self.axis = axis
+        self.n_bins = n_bins
+
+    def accumulate(self, partial, positions, boxes):
+        density = np.zeros(self.n_bins)
+        for frame, box in zip(positions, boxes):
+            fractional = frame[:, self.axis] / box[self.axis]
+            fractional -= np.floor(fractional)
+            bins = np.minimum((fractional * self.n_bins).astype(int), self.n_bins - 1)
+            mass = np.bincount(bins, weights=self.masses, minlength=self.n_bins)
+            density += mass / (np.prod(box) / self.n_bins) * DENSITY_CONVERSION
+        add_to(partial, "density", density)
+        add_to(partial, "n_frames", len(positions))
+
+    def finalize(self, result):
+        import pandas as pd
+
+        return pd.DataFrame({
+            "fractional_coordinate": (np.arange(self.n_bins) + 0.5) / self.n_bins,
+            "density": result["density"] / result["n_frames"],
+        })
+
+
+class MSD(Analysis):
+    """
+    Mean squared displacement of molecular centers of mass for lags of up
+    to ``max_lag`` frames, averaged over all time origins.
+
+    A frame range also reads up to ``max_lag`` frames after it, so that
+    displacements from its last origins are complete; each displacement
+    is counted with the frame it ends at, so none is counted twice.
+    Centers of mass are unwrapped by taking the minimum image of the
+    displacement between consecutive frames.
+    """
+
+    def __init__(self, masses: np.ndarray, molecule_ids: np.ndarray, max_lag: int = 100):
+        self.masses = np.asarray(masses)
+        self.molecule_ids = np.asarray(molecule_ids)
+        self.max_lag = max_lag
+
+    def compute(self, dcd_file, start, stop, chunk_size=100):
+        dcd = DCDFile(dcd_file)
+        squared_displacement = np.zeros(self.max_lag + 1)
+        n_origins = np.zeros(self.max_lag + 1)
+        n_molecules = self.molecule_ids.max() + 1
+        # unwrapped centers of the frames before the chunk, at most max_lag of them
+        history = np.zeros((0, n_molecules, 3))
+        previous = None
+        read_stop = min(stop + self.max_lag, dcd.n_frames)
+        for chunk_start in range(start, read_stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, read_stop)
+            positions, boxes = dcd.read(chunk_start, chunk_stop)
+            centers = get_centers_of_mass(positions, self.masses, self.molecule_ids)
+            steps = np.diff(centers, axis=0, prepend=(centers if previous is None else previous)[:1])
+            steps -= boxes[:, None, :] * np.round(steps / boxes[:, None, :])
+            unwrapped = (centers[0] if previous is None else history[-1]) + np.cumsum(steps, axis=0)
+
+            frames = np.concatenate([history, unwrapped])
+            first_frame = chunk_start - len(history)
+            ends = np.arange(chunk_start, chunk_stop)
+            for lag in range(1, self.max_lag + 1):
+                origins = ends - lag
+                mask = (origins >= start) & (origins < stop)
+                if not mask.any():
+                    continue
+                displacement = frames[ends[mask] - first_frame] - frames[origins[mask] - first_frame]
+                squared_displacement[lag] += (displacement ** 2).sum(axis=-1).mean(axis=-1).sum()
+                n_origins[lag] += mask.sum()
+            history = frames[-self.max_lag:]
+            previous = centers[-1:]
+        return {"squared_displacement": squared_displacement, "n_origins": n_origins}
+
+    def finalize(self, result):
+        import pandas as pd
+
+        with np.errstate(invalid="ignore"):
+            msd = result["squared_displacement"] / result["n_origins"]
+        return pd.DataFrame({"lag": np.arange(self.max_lag + 1), "msd": msd})
+
+
+def run_analysis(
+    analysis: Analysis,
+    dcd_file: pathlib.Path,
+    n_workers: int = 1,
+    chunk_size: int = 100,
+    start: int = 0,
+    stop: int = None,
+):
+    """Split frames ``start:stop`` between workers and sum their partial results"""
+    n_frames = DCDFile(dcd_file).n_frames
+    stop = n_frames if stop is None else min(stop, n_frames)
+    # a few ranges per worker so that they finish together
+    n_ranges = max(min(n_workers * 4, (stop - start) // chunk_size), 1)
+    bounds = np.linspace(start, stop, n_ranges + 1).astype(int)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        partials = executor.map(
+            analysis.compute,
+            [str(dcd_file)] * n_ranges,
+            bounds[:-1],
+            bounds[1:],
+            [chunk_size] * n_ranges,
+        )
+        result = {}
+        for partial in partials:
+            for key, value in partial.items():
+                add_to(result, key, value)
+    return analysis.finalize(result)
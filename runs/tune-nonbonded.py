@@ -0,0 +1,167 @@
+"""
+Search Ewald error tolerance and PME grid dimensions for the fastest
+setting within a nonbonded force error budget for one box. The cutoff
+stays at the force field's value unless ``--cutoffs`` is given.
+
+Snapshots are PDB files of the box, e.g. the minimized, equilibrated
+and final structures of an earlier run. The selection is written to
+``nonbonded-settings.json``, which ``simulate-general-middle.py
+--nonbonded-settings`` applies to the System it simulates.
+"""
+
+import json
+import pathlib
+
+import click
+import openmm
+import openmm.app
+from openmm import unit as openmm_unit
+
+from openff.interchange import Interchange
+
+from metrics import MetricsRecorder
+from nonbonded import tune_nonbonded
+
+
+def parse_floats(text: str) -> list[float]:
+    return [float(x) for x in text.split(",") if x]
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default=".",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Entry directory containing interchange.json",
+)
+@click.option(
+    "--snapshots",
+    "-s",
+    default="minimized.pdb,equilibrated.pdb,final.pdb",
+    type=str,
+    help="Comma-separated PDB files of the box, relative to the snapshot directory",
+)
+@click.option(
+    "--snapshot-directory",
+    "-r",
+    default=".",
+    type=str,
+    help="Directory of the snapshots relative to the input directory, e.g. a run",
+)
+@click.option(
+    "--max-error",
+    "-e",
+    default=5e-4,
+    type=float,
+    help="Largest allowed RMS nonbonded force error relative to the RMS reference nonbonded force",
+)
+@click.option(
+    "--cutoffs",
+    default="",
+    type=str,
+    help=(
+        "Comma-separated candidate cutoffs in nm. Default: the force field's cutoff. "
+        "Other cutoffs change the force field, not only the accuracy"
+    ),
+)
+@click.option(
+    "--ewald-error-tolerances",
+    default="1e-4,5e-4,1e-3",
+    type=str,
+    help="Comma-separated candidate Ewald error tolerances",
+)
+@click.option(
+    "--grid-scales",
+    default="0.8,0.9",
+    type=str,
+    help="Comma-separated scale factors of the PME grid OpenMM would choose",
+)
+@click.option(
+    "--platform",
+    default="CUDA",
+    type=str,
+    help="OpenMM platform to evaluate and benchmark on",
+)
+@click.option(
+    "--timestep",
+    "-dt",
+    default=2.0,
+    type=float,
+    help="Timestep in fs for benchmarking",
+)
+@click.option(
+    "--hydrogen-mass",
+    "-hm",
+    default=1,
+    type=float,
+    help="Hydrogen mass for HMR, in amu",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default="nonbonded-settings.json",
+    type=str,
+    help="Output file, relative to the input directory",
+)
+def main(
+    input_directory: str = ".",
+    snapshots: str = "minimized.pdb,equilibrated.pdb,final.pdb",
+    snapshot_directory: str = ".",
+    max_error: float = 5e-4,
+    cutoffs: str = "",
+    ewald_error_tolerances: str = "1e-4,5e-4,1e-3",
+    grid_scales: str = "0.8,0.9",
+    platform: str = "CUDA",
+    timestep: float = 2.0,
+    hydrogen_mass: float = 1,
+    output_file: str = "nonbonded-settings.json",
+):
+    input_directory = pathlib.Path(input_directory)
+    metrics = MetricsRecorder(
+        input_directory / "metrics.jsonl",
+        entry=input_directory.resolve().name,
+    )
+
+    interchange = Interchange.parse_file(input_directory / "interchange.json")
+    system = interchange.to_openmm_system(hydrogen_mass=1.007947 * hydrogen_mass)
+    integrator = openmm.LangevinMiddleIntegrator(
+        298.15 * openmm_unit.kelvin,
+        1.0 / openmm_unit.picosecond,
+        timestep * openmm_unit.femtoseconds,
+    )
+
+    snapshot_data = []
+    for snapshot in snapshots.split(","):
+        pdb_file = input_directory / snapshot_directory / snapshot
+        if not pdb_file.exists():
+            print(f"Skipping missing snapshot {pdb_file}")
+            continue
+        pdb = openmm.app.PDBFile(str(pdb_file))
+        snapshot_data.append((pdb.getPositions(), pdb.topology.getPeriodicBoxVectors()))
+    if not snapshot_data:
+        raise FileNotFoundError(f"No snapshots found in {input_directory / snapshot_directory}")
+
+    # None keeps OpenMM's own grid choice as a candidate
+    scales = [None] + parse_floats(grid_scales)
+    with metrics.timed("nonbonded-tuning", max_error=max_error) as record:
+        result = tune_nonbonded(
+            system,
+            integrator,
+            snapshot_data,
+            max_error=max_error,
+            cutoffs=parse_floats(cutoffs) or None,
+            ewald_error_tolerances=parse_floats(ewald_error_tolerances),
+            grid_scales=scales,
+            platform_name=platform,
+        )
+        record["settings"] = result["settings"]
+
+    with (input_directory / output_file).open("w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Selected {result['settings']}")
+    print(f"Saved to {input_directory / output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Follow the reporter CSVs of running simulations and flag entries whose
+observables have clearly equilibrated or are clearly equilibrating slowly,
+so that jobs can be cut short or extended before they finish.
+
+    python watch-equilibration.py -i boxes-nosort/n-2000/runs-interchange-final -w 300
+
+Each poll only reads the bytes appended to ``equilibration.csv`` and
+``production.csv`` since the last one, and only runs with new samples
+are reanalyzed. Equilibration and production are treated as one
+timeseries, whose provisional t0 is found with
+``equilibration.detect_equilibration_batch``.
+"""
+
+import pathlib
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from equilibration import detect_equilibration_batch
+from tailing import RunTail
+
+
+def classify(
+    t0: int,
+    Neff_max: float,
+    n_samples: int,
+    min_samples: int,
+    min_effective_samples: float,
+    converged_fraction: float,
+    slow_fraction: float,
+) -> str:
+    """Provisional state of one observable"""
+    if n_samples < min_samples:
+        return "pending"
+    # still drifting: only the last few samples look equilibrated
+    if t0 > slow_fraction * n_samples:
+        return "slow"
+    if t0 <= converged_fraction * n_samples and Neff_max >= min_effective_samples:
+        return "converged"
+    return "equilibrating"
+
+
+def analyze_run(run_tail: RunTail, nskip: int = 1, **thresholds) -> list[dict]:
+    """Provisional t0 and statistics of the equilibrated part of each observable"""
+    A_t = run_tail.observables
+    n_samples = len(A_t)
+    if n_samples < 3:
+        return []
+    t0, g, Neff_max = detect_equilibration_batch(A_t, nskip=nskip)
+    rows = []
+    for i, column in enumerate(run_tail.columns):
+        equilibrated = A_t[t0[i]:, i]
+        rows.append({
+            "entry": run_tail.run_directory.parent.name,
+            "run": run_tail.run_directory.name,
+            "property": column,
+            "step": run_tail.step,
+            "n_samples": n_samples,
+            "t0": int(t0[i]),
+            "g": float(g[i]),
+            "Neff_max": float(Neff_max[i]),
+            "mean": equilibrated.mean(),
+            "std": equilibrated.std(),
+            "sem": equilibrated.std() / np.sqrt(max(Neff_max[i], 1)),
+            "flag": classify(int(t0[i]), float(Neff_max[i]), n_samples, **thresholds),
+        })
+    return rows
+
+
+def summarize_entries(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per run: slow if any observable is slow, converged if all are"""
+    rows = []
+    for (entry, run), group in df.groupby(["entry", "run"], sort=True):
+        flags = set(group.flag)
+        if "slow" in flags:
+            flag = "slow"
+        elif flags == {"converged"}:
+            flag = "converged"
+        elif "pending" in flags:
+            flag = "pending"
+        else:
+            flag = "equilibrating"
+        t0_fraction = group.t0 / group.n_samples
+        rows.append({
+            "entry": entry,
+            "run": run,
+            "step": group.step.iloc[0],
+            "n_samples": group.n_samples.iloc[0],
+            "flag": flag,
+            "slowest_property": group.property.iloc[t0_fraction.argmax()],
+            "max_t0_fraction": t0_fraction.max(),
+            "min_Neff": group.Neff_max.min(),
+        })
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing entry-* subdirectories",
+)
+@click.option(
+    "--run",
+    "-r",
+    default="*",
+    type=str,
+    help="Run subdirectory, or glob pattern of runs",
+)
+@click.option(
+    "--column",
+    "-c",
+    "columns",
+    multiple=True,
+    help="Observable to follow, e.g. 'Density (g/mL)'; repeat for several. Default: all",
+)
+@click.option(
+    "--min-samples",
+    default=100,
+    type=int,
+    help="Do not flag runs with fewer samples than this",
+)
+@click.option(
+    "--min-effective-samples",
+    default=50,
+    type=float,
+    help="Effective samples after t0 needed to call an observable converged",
+)
+@click.option(
+    "--converged-fraction",
+    default=0.5,
+    type=float,
+    help="Call an observable converged if t0 is within this fraction of the samples so far",
+)
+@click.option(
+    "--slow-fraction",
+    default=0.8,
+    type=float,
+    help="Call an observable slow if t0 is beyond this fraction of the samples so far",
+)
+@click.option(
+    "--nskip",
+    default=1,
+    type=int,
+    help="Only try every nskip-th sample as the equilibration time",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default=None,
+    type=str,
+    help="Optional CSV file to write the per-observable analysis to",
+)
+@click.option(
+    "--watch",
+    "-w",
+    default=0,
+    type=float,
+    help="Poll every this many seconds; 0 to poll once",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    run: str = "*",
+    columns: list[str] = (),
+    min_samples: int = 100,
+    min_effective_samples: float = 50,
+    converged_fraction: float = 0.5,
+    slow_fraction: float = 0.8,
+    nskip: int = 1,
+    output_file: str = None,
+    watch: float = 0,
+):
+    input_directory = pathlib.Path(input_directory)
+    thresholds = {
+        "min_samples": min_samples,
+        "min_effective_samples": min_effective_samples,
+        "converged_fraction": converged_fraction,
+        "slow_fraction": slow_fraction,
+    }
+    run_tails = {}
+    results = {}
+    while True:
+        # new runs may have started since the last poll
+        for equilibration_csv in sorted(input_directory.glob(f"*/{run}/equilibration.csv")):
+            run_directory = equilibration_csv.parent
+            if run_directory not in run_tails:
+                run_tails[run_directory] = RunTail(run_directory, columns=list(columns) or None)
+
+        start_time = time.perf_counter()
+        n_updated = 0
+        for run_directory, run_tail in run_tails.items():
+            if run_tail.update():
+                results[run_directory] = analyze_run(run_tail, nskip=nskip, **thresholds)
+                n_updated += 1
+        seconds = time.perf_counter() - start_time
+        print(f"Updated {n_updated} of {len(run_tails)} runs in {seconds:.1f} s")
+
+        df = pd.DataFrame([row for rows in results.values() for row in rows])
+        if len(df):
+            summary = summarize_entries(df)
+            print(summary.flag.value_counts().to_string())
+            for flag in ["slow", "converged"]:
+                flagged = summary[summary.flag == flag]
+                if len(flagged):
+                    print(f"{flag}:")
+                    print(flagged.to_string(index=False))
+            if output_file:
+                df.to_csv(output_file, index=False)
+                print(f"Saved to {output_file}")
+
+        if watch <= 0:
+            break
+        time.sleep(watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Scan heartbeat.json files of all entries and flag runs that are
+stalled, slow or diverging, so that they can be killed and requeued.
+"""
+
+import json
+import math
+import pathlib
+import time
+
+import click
+import pandas as pd
+
+TERMINAL_STATUSES = {"finished", "failed"}
+
+
+def classify(
+    heartbeat: dict,
+    now: float,
+    stall_seconds: float,
+    min_ns_per_day: float,
+    min_density: float,
+    max_density: float,
+    max_temperature: float,
+) -> list[str]:
+    status = heartbeat.get("status", "")
+    if status in TERMINAL_STATUSES:
+        return [status]
+
+    flags = []
+    if now - heartbeat.get("timestamp", 0) > stall_seconds:
+        flags.append("stalled")
+
+    ns_per_day = heartbeat.get("ns_per_day", math.nan)
+    if ns_per_day is not None and ns_per_day < min_ns_per_day:
+        flags.append("slow")
+
+    # comparisons against NaN are False, so a NaN density also diverges
+    energy = heartbeat.get("potential_energy")
+    density = heartbeat.get("density")
+    temperature = heartbeat.get("temperature")
+    if energy is not None and not math.isfinite(energy):
+        flags.append("diverging")
+    elif density is not None and not min_density <= density <= max_density:
+        flags.append("diverging")
+    elif temperature is not None and not temperature <= max_temperature:
+        flags.append("diverging")
+    return flags
+
+
+@click.command()
+@click.option(
+    "--input-directory",
+    "-i",
+    default="boxes-nosort/n-2000/runs-interchange-final",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory containing entry-* subdirectories",
+)
+@click.option(
+    "--run",
+    "-r",
+    default="*",
+    type=str,
+    help="Run subdirectory, or glob pattern of runs",
+)
+@click.option(
+    "--stall-seconds",
+    default=900,
+    type=float,
+    help="Flag running entries whose heartbeat is older than this",
+)
+@click.option(
+    "--min-ns-per-day",
+    default=5,
+    type=float,
+    help="Flag running entries slower than this",
+)
+@click.option(
+    "--min-density",
+    default=0.3,
+    type=float,
+    help="Flag running entries with a density below this, in g/mL",
+)
+@click.option(
+    "--max-density",
+    default=3.0,
+    type=float,
+    help="Flag running entries with a density above this, in g/mL",
+)
+@click.option(
+    "--max-temperature",
+    default=500,
+    type=float,
+    help="Flag running entries hotter than this, in K",
+)
+@click.option(
+    "--output-file",
+    "-o",
+    default=None,
+    type=str,
+    help="Optional CSV file to write flagged entries to",
+)
+@click.option(
+    "--watch",
+    "-w",
+    default=0,
+    type=float,
+    help="Rescan every this many seconds; 0 to scan once",
+)
+def main(
+    input_directory: str = "boxes-nosort/n-2000/runs-interchange-final",
+    run: str = "*",
+    stall_seconds: float = 900,
+    min_ns_per_day: float = 5,
+    min_density: float = 0.3,
+    max_density: float = 3.0,
+    max_temperature: float = 500,
+    output_file: str = None,
+    watch: float = 0,
+):
+    input_directory = pathlib.Path(input_directory)
+    while True:
+        now = time.time()
+        rows = []
+        for heartbeat_file in sorted(input_directory.glob(f"*/{run}/heartbeat.json")):
+            try:
+                with heartbeat_file.open("r") as f:
+                    heartbeat = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            flags = classify(
+                heartbeat,
+                now,
+                stall_seconds=stall_seconds,
+                min_ns_per_day=min_ns_per_day,
+                min_density=min_density,
+                max_density=max_density,
+                max_temperature=max_temperature,
+            )
+            rows.append({
+                "entry": heartbeat_file.parent.parent.name,
+                "run": heartbeat_file.parent.name,
+                "status": heartbeat.get("status"),
+                "phase": heartbeat.get("phase"),
+                "step": heartbeat.get("step"),
+                "ns_per_day": heartbeat.get("ns_per_day"),
+                "eta_hours": (heartbeat.get("eta_seconds") or math.nan) / 3600,
+                "age_minutes": (now - heartbeat.get("timestamp", now)) / 60,
+                "potential_energy": heartbeat.get("potential_energy"),
+                "density": heartbeat.get("density"),
+                "slurm_job": heartbeat.get("slurm_job"),
+                "flags": ",".join(flags),
+            })
+
+        df = pd.DataFrame(rows)
+        if not len(df):
+            print(f"No heartbeats found in {input_directory}")
+        else:
+            counts = df.flags.replace("", "ok").str.split(",").explode().value_counts()
+            print(counts.to_string())
+            flagged = df[df.flags.str.contains("stalled|slow|diverging")]
+            if len(flagged):
+                print(flagged.to_string(index=False))
+                jobs = [job for job in flagged.slurm_job if job]
+                if jobs:
+                    print(f"scancel {' '.join(jobs)}")
+            if output_file:
+                flagged.to_csv(output_file, index=False)
+                print(f"Saved to {output_file}")
+
+        if watch <= 0:
+            break
+        time.sleep(watch)
+
+
+if __name__ == "__main__":
+    main()